@@ -0,0 +1,161 @@
+import calendar
+import math
+import time
+from line_protocol import TIME_FORMAT, epoch_seconds
+
+# Mergeable quantile sketch with relative error bounded by relative_accuracy
+# (the DDSketch scheme): values land in logarithmically sized buckets, so two
+# sketches merge by adding bucket weights and memory grows with the value range
+# rather than the number of samples.
+class LatencySketch:
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_weight = 0.0
+        self.total_weight = 0.0
+
+    def add(self, value, weight=1.0):
+        if weight <= 0:
+            return
+        if value <= 1e-9:
+            self.zero_weight += weight
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0.0) + weight
+        self.total_weight += weight
+
+    def merge(self, other):
+        for index, weight in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0.0) + weight
+        self.zero_weight += other.zero_weight
+        self.total_weight += other.total_weight
+
+    def quantile(self, q):
+        if self.total_weight <= 0:
+            return None
+        rank = q * self.total_weight
+        cumulative = self.zero_weight
+        if cumulative >= rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            if cumulative >= rank:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+# Running aggregate of one server's ping results inside one window
+class PingWindow:
+    __slots__ = ('min_latency', 'max_latency', 'weighted_sum', 'weight', 'success_sum', 'count', 'sketch')
+
+    def __init__(self):
+        self.min_latency = math.inf
+        self.max_latency = -math.inf
+        self.weighted_sum = 0.0
+        self.weight = 0.0
+        self.success_sum = 0.0
+        self.count = 0
+        self.sketch = LatencySketch()
+
+    def add(self, min_latency, max_latency, avg_latency, success_rate):
+        self.count += 1
+        self.success_sum += success_rate
+        # A row without successful replies carries no latency information
+        if success_rate > 0:
+            self.min_latency = min(self.min_latency, min_latency)
+            self.max_latency = max(self.max_latency, max_latency)
+            self.weighted_sum += avg_latency * success_rate
+            self.weight += success_rate
+            self.sketch.add(avg_latency, success_rate)
+
+def window_start(timestamp, window):
+    seconds = calendar.timegm(time.strptime(timestamp, TIME_FORMAT))
+    return seconds - seconds % window
+
+# window_start() memoized per distinct timestamp, as many rows share a second
+def _window_starts(window):
+    starts = {}
+
+    def start_of(timestamp):
+        start = starts.get(timestamp)
+        if start is None:
+            if len(starts) >= 65536:
+                starts.clear()
+            start = starts[timestamp] = window_start(timestamp, window)
+        return start
+    return start_of
+
+# Reduce PingResults rows to one row per (server_ip, window). Each output row is
+# (server_ip, window start, min, max, weighted mean, success rate, samples,
+# *percentiles); the mean and percentiles are weighted by each row's success
+# rate, and latency fields are None for windows without a successful reply.
+def aggregate_ping_rows(rows, window, percentiles=(50, 95, 99)):
+    windows = {}
+    start_of = _window_starts(window)
+    for row in rows:
+        key = (row[1], start_of(row[7]))
+        aggregate = windows.get(key)
+        if aggregate is None:
+            aggregate = windows[key] = PingWindow()
+        aggregate.add(float(row[3]), float(row[4]), float(row[5]), float(row[6]))
+
+    aggregated = []
+    for (server_ip, start), aggregate in windows.items():
+        has_latency = aggregate.weight > 0
+        aggregated.append((
+            server_ip,
+            time.strftime(TIME_FORMAT, time.gmtime(start)),
+            aggregate.min_latency if has_latency else None,
+            aggregate.max_latency if has_latency else None,
+            aggregate.weighted_sum / aggregate.weight if has_latency else None,
+            aggregate.success_sum / aggregate.count,
+            aggregate.count,
+            *(aggregate.sketch.quantile(p / 100) for p in percentiles),
+        ))
+    return aggregated
+
+# Length of the longest prefix of rows, given by their window starts in rowid
+# order, that holds only whole windows closed by horizon: every window in it
+# ended grace seconds before horizon and has no row left after the prefix.
+def _closed_prefix(starts, window, grace, horizon):
+    last = {start: index for index, start in enumerate(starts)}
+    prefix = 0
+    reach = -1
+    for index, start in enumerate(starts):
+        if start + window + grace > horizon:
+            break
+        reach = max(reach, last[start])
+        if reach == index:
+            prefix = index + 1
+    return prefix
+
+# Re-chunk PingResults chunks so only whole, closed windows are handed on.
+#
+# Rows are buffered until their window has ended grace seconds before the newest
+# timestamp seen, and handed on as the longest rowid-ordered prefix of the
+# buffer whose windows have no rows left behind in it, so a window is never
+# split across two uploads (Influx would keep only the last one) even when the
+# collector wrote rows out of timestamp order. At the end, windows are judged
+# against the current time instead; what is left stays unacknowledged for the
+# next run. Each yielded chunk is a prefix in rowid order, so its last rowid
+# still marks exactly what may be acknowledged.
+def closed_window_chunks(chunks, window, grace=0, now=None):
+    day_seconds = {}
+    held = []
+    seconds = []
+    for rows in chunks:
+        held += rows
+        seconds += (epoch_seconds(row[7], day_seconds) for row in rows)
+        starts = [second - second % window for second in seconds]
+        prefix = _closed_prefix(starts, window, grace, max(seconds))
+        if prefix:
+            yield held[:prefix]
+            held, seconds = held[prefix:], seconds[prefix:]
+
+    if held:
+        now = time.time() if now is None else now
+        starts = [second - second % window for second in seconds]
+        prefix = _closed_prefix(starts, window, grace, now)
+        if prefix:
+            yield held[:prefix]
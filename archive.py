@@ -0,0 +1,265 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import mmap
+import os
+from array import array
+from line_protocol import epoch_seconds
+
+DEFAULT_BLOCK_ROWS = 4096
+_TIME = 'time'
+# Column types: Unix seconds as uint32 (good until 2106) and fields as float32,
+# which keeps about seven significant digits, plenty for latencies and rates
+TIME_TYPE = 'I'
+FIELD_TYPE = 'f'
+_ITEMSIZE = 4
+
+# What an exporter archives from its SQLite rows: row indexes of the tags that
+# identify a series, of the numeric fields and of the TIME_FORMAT timestamp
+class ArchiveTable:
+    def __init__(self, measurement, tags, fields, time_index):
+        self.measurement = measurement
+        self.tags = dict(tags)
+        self.fields = dict(fields)
+        self.time_index = time_index
+
+def _count(path, itemsize=4):
+    try:
+        return os.path.getsize(path) // itemsize
+    except FileNotFoundError:
+        return 0
+
+def _read(path, typecode, start, stop):
+    values = array(typecode)
+    if stop > start:
+        with _mapped(path, typecode, stop) as view:
+            values.frombytes(view[start:stop].cast('B'))
+    return values
+
+# The first length items of a column file as a memoryview of the mapped file
+@contextlib.contextmanager
+def _mapped(path, typecode, length):
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)[:length * array(typecode).itemsize].cast(typecode)
+        try:
+            yield view
+        finally:
+            view.release()
+
+# Append-only columnar archive of exported rows, one directory per measurement.
+#
+# Every distinct tag set of a measurement is one series, dictionary-encoded as
+# a line of series.jsonl whose number names the series' directory. A series
+# holds one fixed-width file per column, time.u32 (Unix seconds) and
+# <field>.f32, so a row costs 4 bytes per column and its tags nothing, plus
+# index.u32, the time index: the min and max time of every block_rows rows.
+#
+# A range query for one series reads only the index, skips blocks outside the
+# range and copies the blocks inside it straight out of the memory-mapped
+# columns; only the rows of the (usually two) boundary blocks are compared one
+# by one. Columns are appended separately, so a series is as long as its
+# shortest column and a torn append is cut back on the next one.
+class Archive:
+    def __init__(self, root, block_rows=DEFAULT_BLOCK_ROWS):
+        self.root = root
+        self.block_rows = block_rows
+        self._series = {}
+        self._day_seconds = {}
+
+    def _measurement_dir(self, measurement):
+        return os.path.join(self.root, measurement)
+
+    # Tag dictionaries of a measurement by series id
+    def series(self, measurement):
+        if measurement not in self._series:
+            path = os.path.join(self._measurement_dir(measurement), 'series.jsonl')
+            series = []
+            if os.path.exists(path):
+                with open(path) as file:
+                    series = [json.loads(line) for line in file if line.strip()]
+            self._series[measurement] = series
+        return self._series[measurement]
+
+    def _series_id(self, measurement, tags):
+        series = self.series(measurement)
+        try:
+            return series.index(tags)
+        except ValueError:
+            pass
+        directory = self._measurement_dir(measurement)
+        os.makedirs(os.path.join(directory, str(len(series))), exist_ok=True)
+        with open(os.path.join(directory, 'series.jsonl'), 'a') as file:
+            file.write(json.dumps(tags, sort_keys=True) + '\n')
+        series.append(tags)
+        return len(series) - 1
+
+    def _length(self, directory, fields):
+        return min(_count(os.path.join(directory, name)) for name in [f'{_TIME}.u32'] + [f'{f}.f32' for f in fields])
+
+    # Append rows to the archive, returning how many were written
+    def append(self, table, rows):
+        columns = {}
+        for row in rows:
+            tags = {name: row[index] for name, index in table.tags.items() if row[index] is not None}
+            key = json.dumps(tags, sort_keys=True)
+            series = columns.get(key)
+            if series is None:
+                series = columns[key] = (tags, array(TIME_TYPE), {name: array(FIELD_TYPE) for name in table.fields})
+            series[1].append(epoch_seconds(row[table.time_index], self._day_seconds))
+            for name, index in table.fields.items():
+                value = row[index]
+                series[2][name].append(float('nan') if value is None else float(value))
+
+        for tags, times, fields in columns.values():
+            directory = os.path.join(self._measurement_dir(table.measurement),
+                                     str(self._series_id(table.measurement, tags)))
+            self._append_series(directory, times, fields)
+        return sum(len(times) for _, times, _ in columns.values())
+
+    def _append_series(self, directory, times, fields):
+        length = self._length(directory, fields)
+        for name, values in [(f'{_TIME}.u32', times)] + [(f'{name}.f32', values) for name, values in fields.items()]:
+            with open(os.path.join(directory, name), 'ab') as file:
+                if file.tell() != length * _ITEMSIZE:
+                    file.truncate(length * _ITEMSIZE)
+                    file.seek(length * _ITEMSIZE)
+                values.tofile(file)
+
+        # Extend the time index from the first block the new rows touch
+        index_path = os.path.join(directory, 'index.u32')
+        first_block = length // self.block_rows
+        index = _read(index_path, TIME_TYPE, first_block * 2, _count(index_path)) \
+            if length % self.block_rows else array(TIME_TYPE)
+        for offset, moment in enumerate(times):
+            block = (length + offset) // self.block_rows - first_block
+            if block * 2 == len(index):
+                index.extend((moment, moment))
+            elif moment < index[block * 2]:
+                index[block * 2] = moment
+            elif moment > index[block * 2 + 1]:
+                index[block * 2 + 1] = moment
+        with open(index_path, 'ab') as file:
+            file.truncate(first_block * 2 * _ITEMSIZE)
+            file.seek(first_block * 2 * _ITEMSIZE)
+            index.tofile(file)
+
+    # Row ranges [first, last) of a series with start <= time < end, adjacent ranges merged
+    def _ranges(self, index, times, start, end):
+        ranges = []
+        for block in range(len(index) // 2):
+            low, high = index[block * 2], index[block * 2 + 1]
+            if high < start or low >= end:
+                continue
+            block_start = block * self.block_rows
+            block_stop = min(block_start + self.block_rows, len(times))
+            if start <= low and high < end:
+                runs = [(block_start, block_stop)]
+            else:
+                runs = []
+                for row in range(block_start, block_stop):
+                    if start <= times[row] < end:
+                        if runs and runs[-1][1] == row:
+                            runs[-1] = (runs[-1][0], row + 1)
+                        else:
+                            runs.append((row, row + 1))
+            for first, last in runs:
+                if ranges and ranges[-1][1] == first:
+                    ranges[-1] = (ranges[-1][0], last)
+                elif first < last:
+                    ranges.append((first, last))
+        return ranges
+
+    def _query_series(self, directory, fields, start, end):
+        length = self._length(directory, fields)
+        index_path = os.path.join(directory, 'index.u32')
+        index = _read(index_path, TIME_TYPE, 0, _count(index_path))
+        result = {_TIME: array(TIME_TYPE), **{name: array(FIELD_TYPE) for name in fields}}
+        if not length:
+            return result
+        with contextlib.ExitStack() as stack:
+            columns = {name: stack.enter_context(_mapped(os.path.join(directory, f'{name}.f32'), FIELD_TYPE, length))
+                       for name in fields}
+            columns[_TIME] = stack.enter_context(_mapped(os.path.join(directory, f'{_TIME}.u32'), TIME_TYPE, length))
+            for first, last in self._ranges(index, columns[_TIME], start, end):
+                for name, view in columns.items():
+                    result[name].frombytes(view[first:last].cast('B'))
+        return result
+
+    # Rows of measurement with start <= time < end (Unix seconds) for every series
+    # whose tags include the given ones, as {'time': array('I'), field: array('f')}.
+    # One series comes back in append order, which is time order for rows
+    # collected in order; several series are merged by time.
+    def query(self, measurement, start, end, fields=None, **tags):
+        directory = self._measurement_dir(measurement)
+        if fields is None:
+            fields = self.fields(measurement)
+        results = [self._query_series(os.path.join(directory, str(series_id)), fields, start, end)
+                   for series_id, series_tags in enumerate(self.series(measurement))
+                   if all(series_tags.get(key) == value for key, value in tags.items())]
+        if len(results) == 1:
+            return results[0]
+        result = {_TIME: array(TIME_TYPE), **{name: array(FIELD_TYPE) for name in fields}}
+        for part in results:
+            for name, values in part.items():
+                result[name].extend(values)
+        if len(results) > 1:
+            times = result[_TIME]
+            order = sorted(range(len(times)), key=times.__getitem__)
+            result = {name: array(values.typecode, (values[i] for i in order)) for name, values in result.items()}
+        return result
+
+    # Field names stored for a measurement, read from its first series
+    def fields(self, measurement):
+        directory = os.path.join(self._measurement_dir(measurement), '0')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.f32'))
+
+    def size(self):
+        return sum(os.path.getsize(os.path.join(path, name))
+                   for path, _, names in os.walk(self.root) for name in names)
+
+# Callback for ExportSource(archive=...) appending uploaded rows, or None when
+# config.yml has no archive section
+def archive_writer(config, table):
+    archive_config = config.get('archive')
+    if not archive_config:
+        return None
+    archive = Archive(archive_config['path'], archive_config.get('block_rows', DEFAULT_BLOCK_ROWS))
+
+    def write(rows):
+        try:
+            archive.append(table, rows)
+        except OSError:
+            # The local copy is best effort; it never holds up acknowledging an upload
+            logging.error(f"Could not archive {table.measurement} rows", exc_info=True)
+    return write
+
+def _parse_time(value):
+    return int(datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the local metrics archive')
+    parser.add_argument('path', help='Archive directory (archive.path in config.yml)')
+    parser.add_argument('measurement', help='e.g. ping_metrics, performance_metrics, network_metrics')
+    parser.add_argument('--start', type=_parse_time, default=0, help='UTC, e.g. 2024-05-01 or "2024-05-01 12:00"')
+    parser.add_argument('--end', type=_parse_time, default=2 ** 62, help='UTC, exclusive')
+    parser.add_argument('--tag', action='append', default=[], metavar='KEY=VALUE', help='Series filter, repeatable')
+    parser.add_argument('--series', action='store_true', help='List the series of the measurement')
+    args = parser.parse_args()
+
+    archive = Archive(args.path)
+    if args.series:
+        for series_id, tags in enumerate(archive.series(args.measurement)):
+            print(series_id, json.dumps(tags))
+        return
+    result = archive.query(args.measurement, args.start, args.end, **dict(tag.split('=', 1) for tag in args.tag))
+    names = list(result)
+    for row in zip(*(result[name] for name in names)):
+        moment = datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        print(json.dumps(dict(zip(names, (moment,) + row[1:]))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import argparse
+import datetime
+import gzip
+import importlib
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import telemetry
+from config_loader import EXPORTER_SCHEMA, load_config
+from line_protocol import TIME_FORMAT
+from spool import SpoolSendError, SpoolSender
+
+config = load_config('config.yml', EXPORTER_SCHEMA)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Collector tables and the exporter module whose serializer_for() formats them
+TABLES = {'Performance': 'iperf', 'PingResults': 'ping', 'SpeedtestResults': 'speedtest'}
+DEFAULT_WRITERS = 4
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_MIN_BATCH_SIZE = 500
+DEFAULT_MAX_BATCH_SIZE = 50000
+DEFAULT_TARGET_LATENCY = 2.0
+DEFAULT_CHECKPOINT = 'backfill-checkpoint.json'
+DEFAULT_CHECKPOINT_INTERVAL = 5
+DEFAULT_COMPRESSLEVEL = 1
+
+class BackfillError(Exception):
+    pass
+
+# Token bucket shared by the writers. A caller takes what it needs up front and
+# sleeps off any debt outside the lock, so a batch larger than the burst still
+# goes through and concurrent callers queue up in the order they asked.
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - amount
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+# Points per batch, adapted to the write latency InfluxDB shows: grown by a
+# quarter while full batches come back in under half the target, halved when
+# one takes longer than the target or fails
+class BatchSizer:
+    def __init__(self, size, minimum, maximum, target_latency):
+        self.size = size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def observe(self, latency, points):
+        with self._lock:
+            if latency > self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+            elif latency < self.target_latency / 2 and points >= self.size:
+                self.size = min(self.maximum, self.size + max(1, self.size // 4))
+
+    def failed(self):
+        with self._lock:
+            self.size = max(self.minimum, self.size // 2)
+
+# Rows of a collector table with start <= timestamp < end, paged by rowid and
+# serialized with the table's exporter serializer. A position is the last rowid.
+class TableSource:
+    def __init__(self, db_path, table, location_name, start, end):
+        if table not in TABLES:
+            raise BackfillError(f"Unknown table {table}; expected one of {', '.join(TABLES)}")
+        self.db_path = db_path
+        self.table = table
+        self.start = start.strftime(TIME_FORMAT) if start else '0'
+        # TIME_FORMAT text sorts by time, and any timestamp sorts before '9'
+        self.end = end.strftime(TIME_FORMAT) if end else '9'
+        self.serializer = importlib.import_module(TABLES[table]).serializer_for(location_name)
+        self.key = f"{os.path.abspath(db_path)}:{table}"
+
+    def batches(self, sizer, position):
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            cursor = connection.cursor()
+            last_rowid = position or 0
+            while True:
+                with telemetry.timer('fetch_seconds', table=self.table):
+                    cursor.execute(f"SELECT *, rowid FROM {self.table} WHERE rowid > ? "
+                                   f"AND timestamp >= ? AND timestamp < ? ORDER BY rowid LIMIT ?",
+                                   (last_rowid, self.start, self.end, sizer.size))
+                    rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_rowid = rows[-1][-1]
+                with telemetry.timer('serialize_seconds', table=self.table):
+                    payload = self.serializer.serialize(rows)
+                yield last_rowid, payload, payload.count(b'\n') + 1 if payload else 0
+        finally:
+            connection.close()
+
+# Line protocol files, plain or gzip-compressed (spool batches, earlier
+# exports), replayed in the order given. Only lines with a nanosecond timestamp
+# in [start, end) are sent. A position is [file index, line number].
+class FileSource:
+    def __init__(self, paths, start, end):
+        self.paths = paths
+        self.start = int(start.timestamp()) * 1000000000 if start else None
+        self.end = int(end.timestamp()) * 1000000000 if end else None
+        self.key = ','.join(os.path.abspath(path) for path in paths)
+
+    def _in_range(self, line):
+        timestamp = line.rsplit(b' ', 1)[-1]
+        if not timestamp.isdigit():
+            # Without a timestamp InfluxDB stamps the point on arrival, so it is never part of a range
+            return self.start is None and self.end is None
+        timestamp = int(timestamp)
+        return (self.start is None or timestamp >= self.start) and (self.end is None or timestamp < self.end)
+
+    def batches(self, sizer, position):
+        first_file, first_line = position or (0, 0)
+        for file_index in range(first_file, len(self.paths)):
+            path = self.paths[file_index]
+            opener = gzip.open if path.endswith('.gz') else open
+            lines = []
+            line_number = 0
+            with opener(path, 'rb') as file:
+                for line_number, line in enumerate(file, 1):
+                    if file_index == first_file and line_number <= first_line:
+                        continue
+                    line = line.strip()
+                    if line and not line.startswith(b'#') and self._in_range(line):
+                        lines.append(line)
+                        if len(lines) >= sizer.size:
+                            yield [file_index, line_number], b'\n'.join(lines), len(lines)
+                            lines = []
+            if lines or line_number:
+                yield [file_index, line_number], b'\n'.join(lines), len(lines)
+
+# Resumable progress of one backfill job in a JSON file shared by jobs. Batches
+# complete out of order across writers, so the stored position is the last one
+# before which every batch has been written; resuming from it may resend a few
+# batches, which InfluxDB overwrites with identical points.
+class Checkpoint:
+    def __init__(self, path, key, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.key = key
+        self.interval = interval
+        self.position = self._load().get(key, {}).get('position')
+        self.points = 0
+        self.bytes = 0
+        self._issued = {}
+        self._done = set()
+        self._next = 0
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def issue(self, sequence, position):
+        with self._lock:
+            self._issued[sequence] = position
+
+    def complete(self, sequence, points, wire_bytes):
+        with self._lock:
+            self.points += points
+            self.bytes += wire_bytes
+            self._done.add(sequence)
+            while self._next in self._done:
+                self._done.remove(self._next)
+                self.position = self._issued.pop(self._next)
+                self._next += 1
+            if time.monotonic() - self._saved_at >= self.interval:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        jobs = self._load()
+        jobs[self.key] = {'position': self.position,
+                          'updated': datetime.datetime.now(datetime.timezone.utc).strftime(TIME_FORMAT)}
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(jobs, file, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+        self._saved_at = time.monotonic()
+
+    def clear(self):
+        jobs = self._load()
+        if jobs.pop(self.key, None) is not None:
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(jobs, file, indent=1)
+            os.replace(self.path + '.tmp', self.path)
+        self.position = None
+
+# Replay one source to InfluxDB. The calling thread reads and serializes batches
+# of the current adaptive size into a short queue; `writers` threads, each with
+# its own keep-alive connection, compress them, take their points and bytes from
+# the token buckets and POST them, retrying 429/5xx and connection errors with
+# backoff (or Retry-After). A batch InfluxDB refuses as malformed stops the run
+# with the checkpoint still in front of it.
+class Backfill:
+    def __init__(self, source, influx_config, checkpoint, sizer, writers=DEFAULT_WRITERS, points_per_second=None,
+                 bytes_per_second=None, compresslevel=DEFAULT_COMPRESSLEVEL, dry_run=False,
+                 initial_backoff=1, max_backoff=60):
+        self.source = source
+        self.influx_config = influx_config
+        self.checkpoint = checkpoint
+        self.sizer = sizer
+        self.writers = writers
+        self.points = TokenBucket(points_per_second)
+        self.bytes = TokenBucket(bytes_per_second)
+        self.compresslevel = compresslevel
+        self.dry_run = dry_run
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0.0
+        self.error = None
+        self._stop = threading.Event()
+        self._queue = queue.Queue(maxsize=writers * 2)
+
+    def _post(self, sender, body):
+        delay = self.initial_backoff
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                with telemetry.timer('backfill_write_seconds'):
+                    response = sender.post(body)
+                self.requests += 1
+                if 200 <= response.status < 300:
+                    return time.monotonic() - started
+                if 400 <= response.status < 500 and response.status not in (408, 429):
+                    raise BackfillError(f"InfluxDB rejected a batch with status {response.status}")
+                retry_after = response.getheader('Retry-After')
+                error = SpoolSendError(f"InfluxDB returned status {response.status}",
+                                       retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+            except SpoolSendError as e:
+                error = e
+            self.retries += 1
+            telemetry.count('backfill_retries')
+            self.sizer.failed()
+            wait = error.retry_after if error.retry_after is not None else delay * random.uniform(0.5, 1.0)
+            logging.warning(f"{error}; retrying in {wait:.1f}s")
+            self._stop.wait(wait)
+            delay = min(delay * 2, self.max_backoff)
+        return None
+
+    def _write(self):
+        sender = SpoolSender(None, self.influx_config)
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    return
+                sequence, payload, points = batch
+                if not points:
+                    # Nothing in range, but the position still moves past it
+                    self.checkpoint.complete(sequence, 0, 0)
+                    continue
+                try:
+                    body = gzip.compress(payload, compresslevel=self.compresslevel, mtime=0)
+                    self.throttled += self.points.acquire(points) + self.bytes.acquire(len(body))
+                    latency = 0.0 if self.dry_run else self._post(sender, body)
+                except Exception as e:
+                    self.error = self.error or e
+                    self._stop.set()
+                    continue
+                if latency is None:
+                    continue
+                self.sizer.observe(latency, points)
+                telemetry.count('backfill_points', points)
+                telemetry.count('backfill_bytes', len(body))
+                self.checkpoint.complete(sequence, points, len(body))
+        finally:
+            sender.close()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self, progress_interval=10):
+        threads = [threading.Thread(target=self._write, name=f'backfill-writer-{index}', daemon=True)
+                   for index in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        started = reported_at = time.monotonic()
+        try:
+            for sequence, (position, payload, points) in enumerate(
+                    self.source.batches(self.sizer, self.checkpoint.position)):
+                if self._stop.is_set():
+                    break
+                self.checkpoint.issue(sequence, position)
+                self._put((sequence, payload, points))
+                if time.monotonic() - reported_at >= progress_interval:
+                    reported_at = time.monotonic()
+                    logging.info(f"Backfilled {self.checkpoint.points} points "
+                                 f"({self.checkpoint.points / (reported_at - started):.0f}/s), "
+                                 f"batch size {self.sizer.size}, position {self.checkpoint.position}")
+                    telemetry.publish_if_due()
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            # Writers finish what is queued, unless the run is stopping and it is dropped
+            if self._stop.is_set():
+                while True:
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+            for _ in threads:
+                self._queue.put(None)
+            for thread in threads:
+                thread.join()
+            self.checkpoint.save()
+        if self.error:
+            raise self.error
+        return time.monotonic() - started
+
+    def stop(self):
+        self._stop.set()
+
+def _parse_time(value):
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a time range of collected rows or line protocol files to '
+                                                 'InfluxDB, rate limited and resumable')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--db', help='Collector database to read, e.g. a copy of sqlite.ping_path')
+    source.add_argument('--file', nargs='+', help='Line protocol files (.lp, or .gz like spool batches)')
+    parser.add_argument('--table', choices=sorted(TABLES), help='Collector table to replay from --db')
+    parser.add_argument('--start', type=_parse_time, help='UTC, e.g. 2024-05-01 or "2024-05-01 12:00"')
+    parser.add_argument('--end', type=_parse_time, help='UTC, exclusive')
+    parser.add_argument('--location-name', help='location_name tag for --db rows (default: from config.yml)')
+    parser.add_argument('--bucket', help='Target bucket (default: influx_db.bucket)')
+    parser.add_argument('--writers', type=int, help='Concurrent writers')
+    parser.add_argument('--points-per-second', type=float, help='Point rate limit (default: none)')
+    parser.add_argument('--bytes-per-second', type=float, help='Compressed bytes rate limit (default: none)')
+    parser.add_argument('--batch-size', type=int, help='Initial points per batch')
+    parser.add_argument('--target-latency', type=float, help='Write latency the batch size adapts to, in seconds')
+    parser.add_argument('--checkpoint', help='Progress file (default: backfill-checkpoint.json)')
+    parser.add_argument('--restart', action='store_true', help='Ignore saved progress and start from the beginning')
+    parser.add_argument('--dry-run', action='store_true', help='Read, serialize and rate limit without writing')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args()
+
+    backfill_config = config.get('backfill') or {}
+    def setting(name, default):
+        value = getattr(args, name)
+        return value if value is not None else backfill_config.get(name, default)
+
+    if args.db:
+        if not args.table:
+            parser.error('--db needs --table')
+        source = TableSource(args.db, args.table, args.location_name or config['location_name'], args.start, args.end)
+    else:
+        source = FileSource(args.file, args.start, args.end)
+    influx_config = dict(config['influx_db'], bucket=args.bucket or config['influx_db']['bucket'])
+    key = f"{source.key}|{args.start or ''}|{args.end or ''}|{influx_config['bucket']}"
+    checkpoint = Checkpoint(setting('checkpoint', DEFAULT_CHECKPOINT), key)
+    if args.restart:
+        checkpoint.clear()
+    elif checkpoint.position is not None:
+        logging.info(f"Resuming {key} after position {checkpoint.position}")
+    batch_size = setting('batch_size', DEFAULT_BATCH_SIZE)
+    sizer = BatchSizer(batch_size, min(batch_size, backfill_config.get('min_batch_size', DEFAULT_MIN_BATCH_SIZE)),
+                       max(batch_size, backfill_config.get('max_batch_size', DEFAULT_MAX_BATCH_SIZE)),
+                       setting('target_latency', DEFAULT_TARGET_LATENCY))
+    telemetry.configure(config, job='backfill')
+
+    backfill = Backfill(source, influx_config, checkpoint, sizer, writers=setting('writers', DEFAULT_WRITERS),
+                        points_per_second=setting('points_per_second', None),
+                        bytes_per_second=setting('bytes_per_second', None),
+                        compresslevel=backfill_config.get('compresslevel', DEFAULT_COMPRESSLEVEL),
+                        dry_run=args.dry_run or config['dry_run'])
+    try:
+        seconds = backfill.run()
+    except KeyboardInterrupt:
+        backfill.stop()
+        logging.warning(f"Interrupted; progress saved at position {checkpoint.position}")
+        raise SystemExit(130)
+    except BackfillError:
+        logging.error(f"Backfill stopped; progress saved at position {checkpoint.position}", exc_info=True)
+        raise SystemExit(1)
+    finally:
+        telemetry.publish()
+
+    summary = {'points': checkpoint.points, 'wire_bytes': checkpoint.bytes, 'requests': backfill.requests,
+               'retries': backfill.retries, 'seconds': round(seconds, 3),
+               'points_per_s': round(checkpoint.points / seconds) if seconds else 0,
+               'throttled_seconds': round(backfill.throttled, 3), 'final_batch_size': sizer.size,
+               'position': checkpoint.position}
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        logging.info(f"Backfilled {summary['points']} points ({summary['wire_bytes']} bytes) in {seconds:.2f}s, "
+                     f"{summary['points_per_s']} points/s, {summary['retries']} retries, "
+                     f"final batch size {sizer.size}.")
+
+if __name__ == "__main__":
+    main()
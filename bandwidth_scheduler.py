@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import random
+import sqlite3
+import time
+from config_loader import load_config
+from mwan3 import Mwan3Wrapper
+
+DEFAULT_INTERVAL = 60 * 60
+DEFAULT_JITTER = 300
+DEFAULT_DURATION = 10
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime(TIME_FORMAT)
+
+async def _run(command, timeout):
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"{command[0]} exited with {process.returncode}: {stderr.decode().strip()}")
+    return stdout.decode()
+
+# Run one iperf3 test and return a Performance row (speed in Mbit/s)
+async def run_iperf(test):
+    duration = test.get('duration', DEFAULT_DURATION)
+    command = [test.get('command', 'iperf3'), '-c', test['server'], '-p', str(test.get('port', 5201)),
+               '-t', str(duration), '-J']
+    if test.get('direction', 'download') == 'download':
+        command.append('-R')
+    if test.get('bandwidth_limit'):
+        command += ['-b', f"{test['bandwidth_limit']}M"]
+    if test.get('device'):
+        command += ['--bind-dev', test['device']]
+    if test.get('source'):
+        command += ['-B', test['source']]
+    timestamp = _now()
+    result = json.loads(await _run(command, duration + 30))
+    if 'error' in result:
+        raise RuntimeError(f"iperf3: {result['error']}")
+    speed = result['end']['sum_received']['bits_per_second'] / 1e6
+    return (test['server'], timestamp, test.get('direction', 'download'), test.get('bandwidth_limit'), speed)
+
+# Run one Ookla speedtest and return a SpeedtestResults row (Mbit/s and ms)
+async def run_speedtest(test):
+    command = [test.get('command', 'speedtest'), '--format=json', '--accept-license', '--accept-gdpr']
+    if test.get('device'):
+        command.append(f"--interface={test['device']}")
+    if test.get('source'):
+        command.append(f"--ip={test['source']}")
+    if test.get('server_id'):
+        command.append(f"--server-id={test['server_id']}")
+    timestamp = _now()
+    result = json.loads(await _run(command, test.get('timeout', 180)))
+    # Ookla reports bandwidth in bytes per second
+    return (test['interface'], timestamp, result['download']['bandwidth'] * 8 / 1e6,
+            result['upload']['bandwidth'] * 8 / 1e6, float(result['ping']['latency']))
+
+# test type -> (runner, sqlite config key, table, columns of the runner's rows, schema)
+TEST_TYPES = {
+    'iperf': (run_iperf, 'iperf_path', 'Performance',
+              ('server_ip', 'timestamp', 'direction', 'bandwidth_limit', 'speed'),
+              "CREATE TABLE IF NOT EXISTS Performance (id INTEGER PRIMARY KEY, server_ip TEXT, timestamp TEXT, "
+              "direction TEXT, bandwidth_limit INTEGER, speed REAL)"),
+    'speedtest': (run_speedtest, 'speedtest_path', 'SpeedtestResults',
+                  ('interface', 'timestamp', 'download_speed', 'upload_speed', 'ping_latency'),
+                  "CREATE TABLE IF NOT EXISTS SpeedtestResults (id INTEGER PRIMARY KEY, interface TEXT, "
+                  "timestamp TEXT, download_speed REAL, upload_speed REAL, ping_latency REAL)"),
+}
+
+def insert_result(db_path, table, schema, columns, row):
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        with connection:
+            connection.execute(schema)
+            connection.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                               f"VALUES ({', '.join('?' * len(columns))})", row)
+    finally:
+        connection.close()
+
+# Runs the configured iperf3 and speedtest jobs on their own jittered schedules.
+#
+# Each interface has one lock, so at most one bandwidth test runs per WAN at a
+# time and queued tests on it run in the order they became due, while tests on
+# different interfaces run in parallel. Interfaces mwan3 reports offline are
+# skipped until their next slot. Results go straight into the Performance and
+# SpeedtestResults tables that iperf.py and speedtest.py export.
+class BandwidthScheduler:
+    def __init__(self, config):
+        scheduler_config = config.get('bandwidth_tests') or {}
+        self.sqlite = config['sqlite']
+        self.tests = scheduler_config.get('tests', [])
+        self.jitter = scheduler_config.get('jitter', DEFAULT_JITTER)
+        self.check_mwan3 = scheduler_config.get('check_mwan3', True)
+        self.mwan3 = Mwan3Wrapper(status_ttl=5)
+        self._locks = {}
+
+    def _lock(self, interface):
+        if interface not in self._locks:
+            self._locks[interface] = asyncio.Lock()
+        return self._locks[interface]
+
+    async def _is_online(self, interface):
+        if not self.check_mwan3:
+            return True
+        try:
+            states = await self.mwan3.interface_states_async()
+        except Exception:
+            logging.warning(f"Could not read mwan3 status; testing {interface} anyway.", exc_info=True)
+            return True
+        return states.get(interface, False)
+
+    async def run_test(self, test):
+        interface = test['interface']
+        test_type = test.get('type', 'iperf')
+        run, path_key, table, columns, schema = TEST_TYPES[test_type]
+        async with self._lock(interface):
+            # Checked once the interface is free, as it may have gone down while queued
+            if not await self._is_online(interface):
+                logging.info(f"Skipping {test_type} test on {interface}: interface is offline.")
+                return None
+            started = time.monotonic()
+            try:
+                row = await run(test)
+            except Exception:
+                logging.error(f"{test_type} test on {interface} failed", exc_info=True)
+                return None
+        logging.info(f"{test_type} test on {interface} finished in {time.monotonic() - started:.1f}s: {row}")
+        await asyncio.get_running_loop().run_in_executor(None, insert_result, self.sqlite[path_key], table, schema,
+                                                           columns, row)
+        return row
+
+    async def _schedule(self, test):
+        interval = test.get('interval', DEFAULT_INTERVAL)
+        jitter = test.get('jitter', self.jitter)
+        # Spread the first runs so tests sharing an interval do not all queue up at once
+        due = time.monotonic() + random.uniform(0, jitter)
+        while True:
+            await asyncio.sleep(max(0, due - time.monotonic()))
+            await self.run_test(test)
+            due = max(due + interval, time.monotonic()) + random.uniform(0, jitter)
+
+    async def run_once(self):
+        return await asyncio.gather(*(self.run_test(test) for test in self.tests))
+
+    async def run(self):
+        logging.info(f"Scheduling {len(self.tests)} bandwidth tests on "
+                     f"{len({test['interface'] for test in self.tests})} interfaces.")
+        await asyncio.gather(*(self._schedule(test) for test in self.tests))
+
+def main():
+    parser = argparse.ArgumentParser(description='Bandwidth test scheduler')
+    parser.add_argument('--once', action='store_true', help='Run every configured test once and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    scheduler = BandwidthScheduler(load_config('config.yml'))
+    asyncio.run(scheduler.run_once() if args.once else scheduler.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from archive import Archive, ArchiveTable
+
+TABLE = ArchiveTable("ping_metrics", tags={"server_ip": 1, "interface": 2},
+                     fields={"min_latency": 3, "max_latency": 4, "avg_latency": 5, "success_rate": 6}, time_index=7)
+START = datetime.datetime(2024, 5, 1)
+
+# PingResults rows for every (server, interface) pair every interval seconds, in collection order
+def ping_rows(days, servers, interfaces, interval):
+    row_id = 0
+    for step in range(days * 86400 // interval):
+        timestamp = (START + datetime.timedelta(seconds=step * interval)).strftime('%Y-%m-%d %H:%M:%S')
+        for server in range(servers):
+            for interface in range(interfaces):
+                row_id += 1
+                latency = 10.0 + (row_id % 89) / 7
+                yield (row_id, f"192.0.2.{server + 1}", f"wan{interface}", latency - 1.5, latency + 4.25, latency,
+                       100.0 if row_id % 50 else 80.0, timestamp)
+
+def build(workdir, args):
+    db_path = os.path.join(workdir, 'ping.db')
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE PingResults (id INTEGER PRIMARY KEY, server_ip TEXT, interface TEXT, "
+                       "min_latency REAL, max_latency REAL, avg_latency REAL, success_rate REAL, timestamp TEXT)")
+    archive = Archive(os.path.join(workdir, 'archive'))
+    chunk = []
+    rows = 0
+    append_seconds = 0.0
+    for row in ping_rows(args.days, args.servers, args.interfaces, args.interval):
+        chunk.append(row)
+        if len(chunk) == args.chunk_size:
+            connection.executemany("INSERT INTO PingResults VALUES (?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+            started = time.perf_counter()
+            archive.append(TABLE, chunk)
+            append_seconds += time.perf_counter() - started
+            rows += len(chunk)
+            chunk = []
+    if chunk:
+        connection.executemany("INSERT INTO PingResults VALUES (?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+        started = time.perf_counter()
+        archive.append(TABLE, chunk)
+        append_seconds += time.perf_counter() - started
+        rows += len(chunk)
+    connection.commit()
+    connection.close()
+    return db_path, archive, rows, append_seconds
+
+def best(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the columnar archive with SQLite for ping history.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--interfaces", type=int, default=2)
+    parser.add_argument("--interval", type=int, default=10, help="Seconds between pings of one series")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows per archive append, like an export chunk")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per query; the best is reported")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-archive-')
+    try:
+        db_path, archive, rows, append_seconds = build(workdir, args)
+        connection = sqlite3.connect(db_path)
+        month = (int(START.replace(tzinfo=datetime.timezone.utc).timestamp()), 2 ** 62)
+        day_start = month[0] + (args.days // 2) * 86400
+        results = {
+            "rows": rows,
+            "series": args.servers * args.interfaces,
+            "sqlite_bytes": os.path.getsize(db_path),
+            "archive_bytes": archive.size(),
+            "append_rows_per_s": round(rows / append_seconds),
+        }
+        results["archive_ratio"] = round(results["archive_bytes"] / results["sqlite_bytes"], 3)
+        for name, (start, end) in (("all", month), ("day", (day_start, day_start + 86400))):
+            seconds, result = best(lambda: Archive(archive.root).query(
+                "ping_metrics", start, end, server_ip="192.0.2.1", interface="wan0"), args.repeat)
+            sql_start = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S') \
+                if end != month[1] else '0'
+            sql_end = datetime.datetime.fromtimestamp(end, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S') \
+                if end != month[1] else '9'
+            sql_seconds, sql_rows = best(lambda: connection.execute(
+                "SELECT timestamp, min_latency, max_latency, avg_latency, success_rate FROM PingResults "
+                "WHERE server_ip = ? AND interface = ? AND timestamp >= ? AND timestamp < ?",
+                ("192.0.2.1", "wan0", sql_start, sql_end)).fetchall(), args.repeat)
+            results[f"query_{name}_rows"] = len(result["time"])
+            results[f"query_{name}_archive_ms"] = round(seconds * 1000, 2)
+            results[f"query_{name}_sqlite_ms"] = round(sql_seconds * 1000, 2)
+            assert len(sql_rows) == len(result["time"]), (len(sql_rows), len(result["time"]))
+        connection.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key, value in results.items():
+            print(f"{key:<24} {value}")
+
+if __name__ == "__main__":
+    main()
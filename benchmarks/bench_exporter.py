@@ -0,0 +1,204 @@
+import argparse
+import datetime
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Collector tables as the collectors create them, with a synthetic row per index
+START = datetime.datetime(2024, 1, 1)
+SERVERS = ['192.0.2.1', '198.51.100.7', '203.0.113.42']
+INTERFACES = ['wan', 'wanb', 'wanc', 'wan6']
+
+def _timestamp(index):
+    return (START + datetime.timedelta(seconds=index * 10)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _performance_row(index):
+    return (SERVERS[index % 3], _timestamp(index), 'download' if index % 2 else 'upload',
+            (index % 4) * 100, 50.0 + (index % 997) / 10)
+
+def _ping_row(index):
+    latency = 10.0 + (index % 89) / 7
+    return (SERVERS[index % 3], INTERFACES[index % 4], latency - 1.5, latency + 4.25, latency,
+            100.0 if index % 50 else 80.0, _timestamp(index))
+
+def _speedtest_row(index):
+    return (INTERFACES[index % 4], _timestamp(index), 200.0 + (index % 311) / 3, 20.0 + (index % 97) / 5,
+            8.0 + (index % 13) / 4)
+
+# exporter module -> (sqlite config key, table, schema, row generator)
+EXPORTERS = {
+    'iperf': ('iperf_path', 'Performance',
+              "CREATE TABLE Performance (id INTEGER PRIMARY KEY, server_ip TEXT, timestamp TEXT, "
+              "direction TEXT, bandwidth_limit INTEGER, speed REAL)", _performance_row),
+    'ping': ('ping_path', 'PingResults',
+             "CREATE TABLE PingResults (id INTEGER PRIMARY KEY, server_ip TEXT, interface TEXT, min_latency REAL, "
+             "max_latency REAL, avg_latency REAL, success_rate REAL, timestamp TEXT)", _ping_row),
+    'speedtest': ('speedtest_path', 'SpeedtestResults',
+                  "CREATE TABLE SpeedtestResults (id INTEGER PRIMARY KEY, interface TEXT, timestamp TEXT, "
+                  "download_speed REAL, upload_speed REAL, ping_latency REAL)", _speedtest_row),
+}
+STAGES = ['fetch', 'serialize', 'upload', 'acknowledge']
+
+# Build a database once per (table, size); every run exports a fresh copy of it
+def template_database(directory, exporter, rows):
+    _, table, schema, make_row = EXPORTERS[exporter]
+    path = os.path.join(directory, f"{table}-{rows}.db")
+    if os.path.exists(path):
+        return path
+    connection = sqlite3.connect(path + '.tmp')
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute(schema)
+        placeholders = ', '.join('?' * (schema.count(',') + 1))
+        for start in range(0, rows, 100000):
+            connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})",
+                                   ((None, *make_row(index)) for index in range(start, min(rows, start + 100000))))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(path + '.tmp', path)
+    return path
+
+# Fake InfluxDB /api/v2/write: answers 204 and counts what arrives on the wire
+class FakeInflux(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    stats = {}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        payload = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+        with self.lock:
+            self.stats['requests'] = self.stats.get('requests', 0) + 1
+            self.stats['bytes'] = self.stats.get('bytes', 0) + len(body)
+            self.stats['points'] = self.stats.get('points', 0) + len(payload.splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def start_fake_influx():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeInflux)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def write_config(workdir, exporter, db_path, port, args):
+    config = {
+        'dry_run': False,
+        'location_name': 'bench',
+        'chunk_size': args.chunk_size,
+        'serializer': args.serializer,
+        # speedtest.py sleeps this long after its export
+        'sleep_interval': 0,
+        'influx_db': {'url': f'http://127.0.0.1:{port}', 'token': 't', 'org': 'o', 'bucket': 'b'},
+        'sqlite': {EXPORTERS[exporter][0]: db_path},
+        # Stage timings come back through the telemetry textfile; nothing extra goes on the wire
+        'telemetry': {'enabled': True, 'textfile_dir': workdir, 'influx': False},
+    }
+    path = os.path.join(workdir, 'config.json')
+    with open(path, 'w') as file:
+        json.dump(config, file)
+    return path
+
+def stage_seconds(prom_path):
+    seconds = dict.fromkeys(STAGES, 0.0)
+    if not os.path.exists(prom_path):
+        return seconds
+    with open(prom_path) as file:
+        for line in file:
+            match = re.match(r'guardsman_(\w+)_seconds_sum\{[^}]*\} (\S+)', line)
+            if match and match.group(1) in seconds:
+                seconds[match.group(1)] += float(match.group(2))
+    return seconds
+
+# Export one fresh copy of the template end to end in a child interpreter
+def run_exporter(tree, exporter, template, rows, server, args):
+    workdir = tempfile.mkdtemp(prefix=f'bench-{exporter}-', dir=args.workdir)
+    try:
+        db_path = os.path.join(workdir, os.path.basename(template))
+        shutil.copyfile(template, db_path)
+        config_path = write_config(workdir, exporter, db_path, server.server_address[1], args)
+        FakeInflux.stats.clear()
+        env = dict(os.environ, GUARDSMAN_CONFIG=config_path, GUARDSMAN_CONFIG_CACHE=workdir, PYTHONPATH=tree)
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(tree, f'{exporter}.py')], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        # wait4 gives this child's own peak RSS, not the maximum over every child so far
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            raise RuntimeError(f"{exporter} exited with {process.returncode}: {stderr.decode()[-2000:]}")
+        remaining = sqlite3.connect(db_path).execute(f"SELECT COUNT(*) FROM {EXPORTERS[exporter][1]}").fetchone()[0]
+        stats = dict(FakeInflux.stats)
+        stages = stage_seconds(os.path.join(workdir, f'{exporter}.prom'))
+        return {
+            'exporter': exporter,
+            'rows': rows,
+            'serializer': args.serializer,
+            'chunk_size': args.chunk_size,
+            'seconds': round(seconds, 3),
+            'rows_per_s': round(rows / seconds),
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+            'wire_bytes': stats.get('bytes', 0),
+            'bytes_per_row': round(stats.get('bytes', 0) / rows, 1),
+            'requests': stats.get('requests', 0),
+            'points': stats.get('points', 0),
+            'rows_left': remaining,
+            # Startup, imports and everything not in a timed stage
+            'stages': {**{stage: round(value, 3) for stage, value in stages.items()},
+                       'other': round(seconds - sum(stages.values()), 3)},
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the exporters end to end against a fake InfluxDB.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000],
+                        help="Table sizes to export (e.g. 10000 1000000 10000000)")
+    parser.add_argument("--exporters", nargs="+", choices=sorted(EXPORTERS), default=sorted(EXPORTERS))
+    parser.add_argument("--serializer", choices=['point', 'line_protocol'], default='line_protocol')
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=1, help="Runs per exporter and size; the fastest is reported")
+    parser.add_argument("--tree", default=ROOT, help="Source tree to benchmark (default: this checkout)")
+    parser.add_argument("--workdir", help="Where generated databases are kept between invocations")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per exporter and size")
+    args = parser.parse_args()
+
+    keep_workdir = args.workdir is not None
+    workdir = args.workdir = args.workdir or tempfile.mkdtemp(prefix='bench-exporter-')
+    os.makedirs(workdir, exist_ok=True)
+    server = start_fake_influx()
+    try:
+        for exporter in args.exporters:
+            for rows in args.rows:
+                template = template_database(workdir, exporter, rows)
+                result = min((run_exporter(os.path.abspath(args.tree), exporter, template, rows, server, args)
+                              for _ in range(args.runs)), key=lambda result: result['seconds'])
+                if args.json:
+                    print(json.dumps(result), flush=True)
+                else:
+                    stages = ' '.join(f"{stage}={value:.2f}s" for stage, value in result['stages'].items())
+                    print(f"{exporter:<10} {rows:>9} rows {result['seconds']:>8.2f}s {result['rows_per_s']:>9} rows/s "
+                          f"{result['peak_rss_mb']:>7.1f} MB rss {result['wire_bytes']:>12} bytes  {stages}",
+                          flush=True)
+    finally:
+        server.shutdown()
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
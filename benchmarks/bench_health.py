@@ -0,0 +1,112 @@
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from health import HealthEngine
+
+START = 1714521600  # 2024-05-01 00:00:00 UTC
+
+# One probe per second through one interface to one target. Every fourth
+# interface has a bad hour in the afternoon: most probes lost and twenty
+# times the latency.
+def samples(interface, seconds, seed):
+    rnd = random.Random(seed)
+    degraded = interface % 4 == 3
+    base = 15.0 + interface % 7 * 5
+    latencies = []
+    losses = []
+    for second in range(seconds):
+        bad = degraded and 14 * 3600 <= second < 15 * 3600
+        if rnd.random() < (0.7 if bad else 0.005):
+            latencies.append(None)
+            losses.append(1.0)
+        else:
+            latencies.append(base * (20 if bad else 1) + rnd.random() * base * 0.2)
+            losses.append(0.0)
+    return latencies, losses
+
+# Feed batch seconds of every link at a time and evaluate after each batch, as
+# the watchdog does once per poll; returns (seconds, interfaces due a power cycle)
+def run_engine(series, seconds, batch):
+    engine = HealthEngine({})
+    due = set()
+    times = list(range(START, START + seconds))
+    started = time.perf_counter()
+    for first in range(0, seconds, batch):
+        last = min(seconds, first + batch)
+        for (interface, target), (latencies, losses) in series.items():
+            engine.add_samples(interface, target, times[first:last], latencies[first:last], losses[first:last])
+        now = START + last
+        engine.evaluate(now)
+        due.update(name for name in engine.interfaces if engine.should_power_cycle(name, now))
+    return time.perf_counter() - started, due
+
+# The same statistics recomputed from the whole window at every evaluation
+def run_recompute(series, seconds, batch, window, alpha=0.1):
+    windows = {key: collections.deque(maxlen=window) for key in series}
+    started = time.perf_counter()
+    for first in range(0, seconds, batch):
+        last = min(seconds, first + batch)
+        for key, (latencies, losses) in series.items():
+            ring = windows[key]
+            ring.extend(zip(latencies[first:last], losses[first:last]))
+            answered = [latency for latency, _ in ring if latency is not None]
+            ewma = answered[0] if answered else 0.0
+            jitter = 0.0
+            for previous, latency in zip(answered, answered[1:]):
+                ewma += alpha * (latency - ewma)
+                jitter += (abs(latency - previous) - jitter) / 16
+            sum(loss for _, loss in ring) / len(ring)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the link health engine on synthetic 1 Hz probe data.")
+    parser.add_argument("--interfaces", type=int, default=36)
+    parser.add_argument("--targets", type=int, default=1, help="Probe targets per interface")
+    parser.add_argument("--seconds", type=int, default=86400, help="Seconds of 1 Hz samples per link")
+    parser.add_argument("--batch", type=int, nargs="+", default=[86400, 3600, 60, 10],
+                        help="Seconds of samples added per link between evaluations")
+    parser.add_argument("--recompute", action="store_true", help="Also time recomputing each window from scratch")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per batch size")
+    args = parser.parse_args()
+
+    series = {}
+    for interface in range(args.interfaces):
+        for target in range(args.targets):
+            series[(f"wan{interface}", f"192.0.2.{target + 1}")] = samples(interface, args.seconds,
+                                                                             seed=interface * 100 + target)
+    count = args.seconds * len(series)
+    expected = {f"wan{interface}" for interface in range(args.interfaces) if interface % 4 == 3}
+    for batch in args.batch:
+        seconds, due = run_engine(series, args.seconds, batch)
+        result = {
+            "links": len(series),
+            "samples": count,
+            "batch": batch,
+            "seconds": round(seconds, 3),
+            "samples_per_s": round(count / seconds),
+            "ns_per_sample": round(seconds / count * 1e9, 1),
+            "degraded": len(expected),
+            # Interfaces whose score stayed below cycle_below for hold seconds at some evaluation;
+            # only batches shorter than the hold can see that happen
+            "flagged": len(due),
+            "false_positives": len(due - expected),
+        }
+        if args.recompute:
+            recompute_seconds = run_recompute(series, args.seconds, batch, HealthEngine({}).window)
+            result["recompute_seconds"] = round(recompute_seconds, 3)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            extra = f" recompute {result['recompute_seconds']:.3f}s" if args.recompute else ""
+            print(f"batch {batch:>6}s {result['samples']:>9} samples {result['seconds']:>8.3f}s "
+                  f"{result['ns_per_sample']:>8.1f} ns/sample flagged {result['flagged']}/{result['degraded']} "
+                  f"({result['false_positives']} false){extra}", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mwan3 import parse_status
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Time parse_status() over recorded `mwan3 status` outputs
+def bench(path, repeat, number):
+    with open(path, 'r') as file:
+        raw_output = file.read()
+    status = parse_status(raw_output)
+    best = min(timeit.repeat(lambda: parse_status(raw_output), repeat=repeat, number=number)) / number
+    return {
+        "fixture": os.path.basename(path),
+        "lines": raw_output.count("\n"),
+        "interfaces": len(status.interfaces),
+        "policies": len(status.ipv4_policies) + len(status.ipv6_policies),
+        "rules": len(status.ipv4_rules) + len(status.ipv6_rules),
+        "parse_us": round(best * 1e6, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing of mwan3 status output.")
+    parser.add_argument("fixtures", nargs="*", help="mwan3 status captures (default: benchmarks/fixtures)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per fixture; the best is reported")
+    parser.add_argument("--number", type=int, default=200, help="Parses per timing run")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per fixture")
+    args = parser.parse_args()
+
+    paths = args.fixtures or sorted(glob.glob(os.path.join(FIXTURES, 'mwan3_status_*.txt')))
+    for path in paths:
+        result = bench(path, args.repeat, args.number)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['fixture']:<32} {result['lines']:>6} lines {result['interfaces']:>3} interfaces "
+                  f"{result['policies']:>4} policies {result['rules']:>4} rules {result['parse_us']:>10.1f} us/snapshot")
+
+if __name__ == "__main__":
+    main()
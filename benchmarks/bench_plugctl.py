@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_kasa_strip import FakeStrip
+from plugctl import PlugController, Strip
+
+# The pattern plugctl replaces: every socket gets its own connection, a fresh
+# get_sysinfo and one request per relay change
+async def per_socket_cycle(targets):
+    async def cycle(host, socket):
+        for on in (False, True):
+            host_name, _, port = host.partition(':')
+            strip = Strip(host_name, int(port), state_ttl=0)
+            try:
+                await strip.set_state([socket], on)
+            finally:
+                await strip.close()
+    await asyncio.gather(*(cycle(host, socket) for host, socket in targets))
+
+async def batched_cycle(targets):
+    controller = PlugController()
+    try:
+        results = await controller.power_cycle(targets, off_time=0)
+    finally:
+        await controller.close()
+    errors = [error for error in results.values() if error is not None]
+    if errors:
+        raise errors[0]
+
+async def bench(strip_count, sockets, latency, repeat):
+    strips = [FakeStrip(sockets=sockets, latency=latency) for _ in range(strip_count)]
+    hosts = [f"127.0.0.1:{await strip.start('127.0.0.1', 0)}" for strip in strips]
+    targets = [(host, f"Plug {index + 1}") for host in hosts for index in range(sockets)]
+    results = []
+    try:
+        for name, run in (("per_socket", per_socket_cycle), ("batched", batched_cycle)):
+            timings = []
+            for _ in range(repeat):
+                for strip in strips:
+                    strip.requests = 0
+                start = time.perf_counter()
+                await run(targets)
+                timings.append(time.perf_counter() - start)
+            results.append({
+                "mode": name,
+                "strips": strip_count,
+                "sockets": len(targets),
+                "latency_ms": latency * 1000,
+                "requests": sum(strip.requests for strip in strips),
+                "best_ms": round(min(timings) * 1000, 2),
+            })
+    finally:
+        for strip in strips:
+            strip.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark power cycling against local fake Kasa strips.")
+    parser.add_argument("--strips", type=int, default=2, help="Fake strips to start")
+    parser.add_argument("--sockets", type=int, default=6, help="Sockets per strip, all of them cycled")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds each fake request takes")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per mode; the best is reported")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per mode")
+    args = parser.parse_args()
+
+    for result in asyncio.run(bench(args.strips, args.sockets, args.latency, args.repeat)):
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['mode']:<12} {result['strips']:>3} strips {result['sockets']:>4} sockets "
+                  f"{result['requests']:>5} requests {result['best_ms']:>10.2f} ms")
+
+if __name__ == "__main__":
+    main()
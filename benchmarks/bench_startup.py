@@ -0,0 +1,113 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry points timed by importing them, which runs their module-level setup
+# (config, logging, argument parsing) but not main(). mwan_monitor is left out
+# because it polls mwan3 at import time.
+ENTRY_POINTS = ['iperf', 'ping', 'speedtest', 'exporter_daemon', 'exporter_fan_in', 'spool',
+                'mwan_checker', 'ookla', 'bandwidth_scheduler', 'prober']
+HEAVY_MODULES = ['influxdb_client', 'reactivex', 'kasa', 'yaml']
+
+def write_fixtures(directory):
+    yaml_config = os.path.join(directory, 'config.yml')
+    with open(yaml_config, 'w') as file:
+        file.write(f"""dry_run: true
+location_name: bench
+influx_db: {{url: 'http://127.0.0.1:8086', token: t, org: o, bucket: b}}
+sqlite:
+  iperf_path: {directory}/iperf.db
+  ping_path: {directory}/ping.db
+  speedtest_path: {directory}/speedtest.db
+  mwan3_path: {directory}/mwan3.db
+smart_plug: {{ip: 127.0.0.1}}
+interfaces:
+  - {{name: wan, smartplug_alias: Plug 1}}
+  - {{name: wanb, smartplug_alias: Plug 2}}
+""")
+    json_config = os.path.join(directory, 'config.json')
+    with open(json_config, 'w') as file:
+        json.dump({"interfaces": {"wan": {"strip_ip": "127.0.0.1", "socket_index": 0}}}, file)
+    return {'ookla': json_config}, yaml_config
+
+def export_revision(revision, directory):
+    archive = subprocess.run(['git', '-C', ROOT, 'archive', revision], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return directory
+
+# Median wall time of a fresh interpreter importing module from tree, plus the heavy modules it loaded
+def time_import(tree, module, workdir, config_path, runs):
+    env = dict(os.environ, PYTHONPATH=tree, GUARDSMAN_CONFIG=config_path)
+    code = (f"import sys; sys.argv = ['{module}']; import {module}; "
+            f"print('\\nheavy:', *(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    command = [sys.executable, '-c', code]
+    loaded = None
+    timings = []
+    # The first run also warms the page cache and the parsed config cache
+    for run in range(runs + 1):
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'
+        # Entry points may print while importing; the last line is ours
+        loaded = result.stdout.rstrip('\n').rsplit('\n', 1)[-1][len('heavy:'):].strip()
+        if run:
+            timings.append(elapsed)
+    return statistics.median(timings), loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interpreter startup of each entry point.")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs per entry point; the median is reported")
+    parser.add_argument("--baseline", help="Git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per entry point")
+    parser.add_argument("entry_points", nargs="*", help=f"Modules to time (default: {' '.join(ENTRY_POINTS)})")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configs, default_config = write_fixtures(workdir)
+        baseline = export_revision(args.baseline, os.path.join(workdir, 'baseline')) if args.baseline else None
+        interpreter, _ = time_import(ROOT, 'sys', workdir, default_config, args.runs)
+
+        for module in args.entry_points or ENTRY_POINTS:
+            config_path = configs.get(module, default_config)
+            current, loaded = time_import(ROOT, module, workdir, config_path, args.runs)
+            result = {"entry_point": module,
+                      "startup_ms": round(current * 1000, 1) if current is not None else None,
+                      "interpreter_ms": round(interpreter * 1000, 1),
+                      "heavy_imports": loaded.split() if current is not None else None}
+            if current is None:
+                result["error"] = loaded
+            if baseline:
+                before, before_loaded = time_import(baseline, module, workdir, config_path, args.runs)
+                result["baseline_ms"] = round(before * 1000, 1) if before is not None else None
+                result["baseline_heavy_imports"] = before_loaded.split() if before is not None else None
+                if before is None:
+                    result["baseline_error"] = before_loaded
+
+            if args.json:
+                print(json.dumps(result))
+                continue
+            line = f"{module:<20} {result['startup_ms'] if current is not None else 'failed':>8} ms"
+            if baseline:
+                if before is not None and current is not None:
+                    line += f"  baseline {result['baseline_ms']:>8} ms  {before / current:5.2f}x"
+                else:
+                    line += f"  baseline {'failed':>8}"
+            line += f"  heavy: {' '.join(result['heavy_imports'] or []) or '-'}"
+            print(line)
+        if not args.json:
+            print(f"{'(bare interpreter)':<20} {round(interpreter * 1000, 1):>8} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import json
+import marshal
+import os
+from stat import S_IMODE
+
+# Environment variable that overrides every script's default config path
+CONFIG_ENV = 'GUARDSMAN_CONFIG'
+# Set to a directory to keep parsed configs there instead of next to the config file
+CACHE_DIR_ENV = 'GUARDSMAN_CONFIG_CACHE'
+_CACHE_VERSION = 1
+
+# Required keys per kind of script, as dotted paths mapped to the expected type
+EXPORTER_SCHEMA = {
+    'location_name': str,
+    'dry_run': bool,
+    'influx_db': dict,
+    'influx_db.url': str,
+    'influx_db.token': str,
+    'influx_db.org': str,
+    'influx_db.bucket': str,
+    'sqlite': dict,
+}
+MWAN_SCHEMA = {
+    'sqlite.mwan3_path': str,
+    'smart_plug.ip': str,
+    'interfaces': list,
+}
+OOKLA_SCHEMA = {
+    'interfaces': dict,
+}
+
+class ConfigError(ValueError):
+    pass
+
+def _lookup(config, dotted_key):
+    value = config
+    for part in dotted_key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+# Check every key of schema and report all problems at once
+def validate(config, schema, path='config'):
+    if not isinstance(config, dict):
+        raise ConfigError(f"{path}: expected a mapping at the top level")
+    problems = []
+    for key, expected in schema.items():
+        value, present = _lookup(config, key)
+        if not present:
+            problems.append(f"missing '{key}'")
+        elif not isinstance(value, expected):
+            problems.append(f"'{key}' should be {expected.__name__}, not {type(value).__name__}")
+    if problems:
+        raise ConfigError(f"{path}: " + "; ".join(problems))
+
+def _parse(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    if path.endswith('.json'):
+        return json.loads(data)
+    # PyYAML costs tens of milliseconds to import, so only YAML configs pay for it
+    import yaml
+    return yaml.safe_load(data)
+
+def _cache_path(path):
+    directory = os.environ.get(CACHE_DIR_ENV)
+    if directory:
+        return os.path.join(directory, os.path.abspath(path).strip(os.sep).replace(os.sep, '_') + '.cache')
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.cache")
+
+def _read_cache(cache_path, signature):
+    try:
+        with open(cache_path, 'rb') as file:
+            version, cached_signature, config, validated = marshal.load(file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None, ()
+    if version != _CACHE_VERSION or cached_signature != signature:
+        return None, ()
+    return config, validated
+
+# The cache holds the whole config, tokens included, so it gets the source file's
+# permissions: created owner-only, then given exactly the mode of config.yml
+def _write_cache(cache_path, signature, config, validated, mode):
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file:
+            os.chmod(temp_path, mode)
+            marshal.dump((_CACHE_VERSION, signature, config, tuple(validated)), file)
+        os.replace(temp_path, cache_path)
+    except (OSError, ValueError):
+        # Unwritable directory, or values marshal cannot store (e.g. YAML dates); just parse next time
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+_loaded = {}
+
+# Load a YAML or JSON config (by extension), validated against schema.
+#
+# path defaults to $GUARDSMAN_CONFIG, then to the script's own default. The
+# parsed and validated result is cached on disk keyed on the file's mtime and
+# size, so cron runs after the first skip both parsing and validation until the
+# file changes; within a process repeated loads return the same dict.
+def load_config(default_path='config.yml', schema=None, path=None):
+    path = path or os.environ.get(CONFIG_ENV) or default_path
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    schema_key = repr(sorted((key, expected.__name__) for key, expected in schema.items())) if schema else None
+
+    loaded = _loaded.get(path)
+    if loaded and loaded[0] == signature and (schema_key is None or schema_key in loaded[2]):
+        return loaded[1]
+
+    cache_path = _cache_path(path)
+    config, validated = _read_cache(cache_path, signature)
+    validated = set(validated)
+    dirty = config is None
+    if config is None:
+        config = _parse(path)
+        validated = set()
+    if schema_key is not None and schema_key not in validated:
+        validate(config, schema, path)
+        validated.add(schema_key)
+        dirty = True
+    if dirty:
+        _write_cache(cache_path, signature, config, validated, S_IMODE(stat.st_mode))
+    _loaded[path] = (signature, config, validated)
+    return config
@@ -0,0 +1,195 @@
+import contextlib
+import logging
+import sqlite3
+import time
+import telemetry
+from spool import SpoolWriter, open_spool
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Per-table high-water mark of the last rowid acknowledged by InfluxDB. It lives
+# in the collector database itself so it commits atomically with the rows it covers.
+def _ensure_cursor_table(connection):
+    connection.execute("CREATE TABLE IF NOT EXISTS export_cursor ("
+                       "table_name TEXT PRIMARY KEY, "
+                       "last_rowid INTEGER NOT NULL)")
+
+def _read_cursor(connection, table):
+    row = connection.execute("SELECT last_rowid FROM export_cursor WHERE table_name = ?", (table,)).fetchone()
+    return row[0] if row else 0
+
+# Rowids of an exported table only grow, as with AUTOINCREMENT: once the rows up
+# to the cursor are deleted SQLite hands out rowids from 1 again, so a row
+# inserted at or below the cursor is moved above it. The cursor never has to go
+# back, and an acknowledgement still in flight never matches new rows.
+def _ensure_rowid_floor(connection, table):
+    cursor = f"(SELECT last_rowid FROM export_cursor WHERE table_name = '{table}')"
+    connection.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_rowid_floor AFTER INSERT ON {table} "
+                       f"WHEN NEW.rowid <= {cursor} "
+                       f"BEGIN UPDATE {table} SET rowid = NEW.rowid + {cursor} WHERE rowid = NEW.rowid; END")
+
+# Move a table's cursor forward to last_rowid, never back. Returns the cursor as stored.
+def advance_cursor(connection, table, last_rowid):
+    _ensure_cursor_table(connection)
+    _ensure_rowid_floor(connection, table)
+    connection.execute("INSERT INTO export_cursor (table_name, last_rowid) VALUES (?, ?) "
+                       "ON CONFLICT (table_name) DO UPDATE SET last_rowid = MAX(last_rowid, excluded.last_rowid)",
+                       (table, last_rowid))
+    return _read_cursor(connection, table)
+
+# Yield the not yet acknowledged rows of a collector table in fixed-size chunks,
+# starting after the persisted cursor unless after_rowid is given.
+#
+# Rows are paged by rowid with a fresh short read per chunk, so memory stays
+# bounded by chunk_size and the collector is never locked out for the whole
+# export. The rowid is appended as the last column of every row, which keeps
+# the positional indexes used by the format functions unchanged.
+def fetch_chunks(db_path, table, chunk_size=DEFAULT_CHUNK_SIZE, after_rowid=None):
+    connection = sqlite3.connect(db_path)
+    try:
+        with connection:
+            _ensure_cursor_table(connection)
+            _ensure_rowid_floor(connection, table)
+        cursor = connection.cursor()
+        last_rowid = _read_cursor(connection, table) if after_rowid is None else after_rowid
+        while True:
+            with telemetry.timer('fetch_seconds', table=table):
+                cursor.execute(f"SELECT *, rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                               (last_rowid, chunk_size))
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            telemetry.count('rows_fetched', len(rows), table=table)
+            last_rowid = rows[-1][-1]
+            yield rows
+    finally:
+        connection.close()
+
+# Record that every row up to last_rowid has been uploaded, deleting that range
+# unless retain is set. Rows inserted by the collector in the meantime sit above
+# last_rowid and are left for the next run. Returns the cursor as stored.
+def acknowledge_rows(db_path, table, last_rowid, retain=False):
+    connection = sqlite3.connect(db_path)
+    try:
+        with telemetry.timer('acknowledge_seconds', table=table), connection:
+            if not retain:
+                connection.execute(f"DELETE FROM {table} WHERE rowid <= ?", (last_rowid,))
+            return advance_cursor(connection, table, last_rowid)
+    finally:
+        connection.close()
+
+# influxdb_client pulls in reactivex and takes a large share of startup time on
+# the router, so it is only imported once a run actually talks to InfluxDB
+def connect_to_influx(influx_config, **kwargs):
+    from influxdb_client import InfluxDBClient
+    return InfluxDBClient(url=influx_config['url'],
+                          token=influx_config['token'],
+                          org=influx_config['org'],
+                          **kwargs)
+
+# Yield the write API the exporters upload through: the on-disk spool when
+# config.yml has a spool section, otherwise a synchronous InfluxDB client.
+@contextlib.contextmanager
+def open_write_api(config):
+    if config.get('spool'):
+        yield SpoolWriter(open_spool(config['spool']))
+        return
+    from influxdb_client.client.write_api import SYNCHRONOUS
+    with connect_to_influx(config['influx_db']) as client:
+        yield client.write_api(write_options=SYNCHRONOUS)
+
+# Buffers formatted records from any number of sources and writes them with a
+# single client once batch_size records are pending or flush_interval seconds
+# have passed. Each buffered chunk carries callbacks so the rows behind it are
+# only acknowledged after the write that contains them has succeeded.
+class BatchWriter:
+    def __init__(self, write_api, bucket, batch_size=DEFAULT_CHUNK_SIZE, flush_interval=10, dry_run=False):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dry_run = dry_run
+        self._records = []
+        self._callbacks = []
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    # count is the number of points in records when they are pre-serialized payloads
+    def write(self, records, count=None, on_written=None, on_failed=None):
+        self._records.extend(records)
+        self._callbacks.append((on_written, on_failed))
+        self._count += len(records) if count is None else count
+        if self._count >= self.batch_size:
+            self.flush()
+
+    def next_flush_time(self):
+        return self._last_flush + self.flush_interval
+
+    def flush_if_due(self):
+        if time.monotonic() >= self.next_flush_time():
+            self.flush()
+
+    def flush(self):
+        records, callbacks, count = self._records, self._callbacks, self._count
+        self._records, self._callbacks, self._count = [], [], 0
+        self._last_flush = time.monotonic()
+        if not callbacks:
+            return
+
+        if self.dry_run:
+            logging.info(f"Dry run: Data prepared for upload Length: {count}")
+            for _, on_failed in callbacks:
+                if on_failed:
+                    on_failed()
+            return
+
+        if records:
+            try:
+                with telemetry.timer('upload_seconds'):
+                    self.write_api.write(bucket=self.bucket, record=records)
+                telemetry.count('points_uploaded', count)
+            except Exception:
+                for _, on_failed in callbacks:
+                    if on_failed:
+                        on_failed()
+                raise
+        for on_written, _ in callbacks:
+            if on_written:
+                on_written()
+
+# A collector table exported to Influx: where its rows come from, how they are
+# formatted and how uploaded rows are acknowledged. archive, when given, is
+# called with every chunk of rows once it has been uploaded, before it is
+# acknowledged.
+class ExportSource:
+    def __init__(self, name, fetch, format_rows, acknowledge, interval=60, archive=None):
+        self.name = name
+        self.fetch = fetch
+        self.format_rows = format_rows
+        self.acknowledge = acknowledge
+        self.interval = interval
+        self.archive = archive
+        # Last rowid handed to a writer; None means resume from the persisted cursor
+        self.position = None
+
+    # Hand every row above the current position to the writer, returning the row count
+    def poll(self, writer, chunk_size=DEFAULT_CHUNK_SIZE):
+        total = 0
+        for rows in self.fetch(chunk_size, self.position):
+            last_rowid = rows[-1][-1]
+            self.position = last_rowid
+            with telemetry.timer('serialize_seconds', source=self.name):
+                records = self.format_rows(rows)
+            writer.write(records, count=len(rows),
+                         on_written=lambda rows=rows, last_rowid=last_rowid: self._written(rows, last_rowid),
+                         on_failed=self.rewind)
+            total += len(rows)
+        return total
+
+    def rewind(self):
+        self.position = None
+
+    def _written(self, rows, last_rowid):
+        if self.archive is not None:
+            self.archive(rows)
+        self.acknowledge(last_rowid)
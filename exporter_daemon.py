@@ -0,0 +1,84 @@
+import importlib
+import logging
+import threading
+import time
+import telemetry
+from config_loader import EXPORTER_SCHEMA, load_config
+from exporter import DEFAULT_CHUNK_SIZE, BatchWriter, open_write_api
+from maintenance import Maintenance
+from spool import make_sender
+
+config = load_config('config.yml', EXPORTER_SCHEMA)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Sources hosted when config.yml has no exporter.sources section
+DEFAULT_SOURCES = {'iperf': {}, 'ping': {}, 'speedtest': {}}
+
+# Each source is a module exposing an ExportSource named `source`; the module
+# defaults to the source name and the poll interval can be overridden per source.
+def load_sources(exporter_config):
+    sources = []
+    for name, options in (exporter_config.get('sources') or DEFAULT_SOURCES).items():
+        options = options or {}
+        source = importlib.import_module(options.get('module', name)).source
+        source.interval = options.get('interval', source.interval)
+        sources.append(source)
+        logging.info(f"Loaded export source {source.name} polling every {source.interval}s")
+    return sources
+
+def poll_source(source, writer, chunk_size):
+    try:
+        rows = source.poll(writer, chunk_size)
+        if rows:
+            logging.info(f"Queued {rows} rows from {source.name} for upload.")
+    except Exception:
+        logging.error(f"Export from {source.name} failed", exc_info=True)
+
+def run(sources, writer, chunk_size, maintenance=None):
+    next_poll = {source.name: time.monotonic() for source in sources}
+    while True:
+        for source in sources:
+            if time.monotonic() >= next_poll[source.name]:
+                poll_source(source, writer, chunk_size)
+                next_poll[source.name] = time.monotonic() + source.interval
+
+        try:
+            telemetry.publish_if_due(writer)
+            writer.flush_if_due()
+        except Exception:
+            logging.error("Upload to InfluxDB failed", exc_info=True)
+
+        # Retention and vacuum run between export cycles, never during one
+        if maintenance is not None:
+            maintenance.run_if_due()
+
+        wake_at = min(min(next_poll.values()), writer.next_flush_time())
+        time.sleep(max(0, wake_at - time.monotonic()))
+
+def main():
+    exporter_config = config.get('exporter') or {}
+    chunk_size = config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    telemetry.configure(config, job='exporter_daemon')
+    sources = load_sources(exporter_config)
+
+    # With a spool configured, batches are spooled and a background sender drains them
+    if config.get('spool'):
+        sender = make_sender(config)
+        threading.Thread(target=sender.run, kwargs={'poll_interval': config['spool'].get('poll_interval', 5)},
+                         name='spool-sender', daemon=True).start()
+
+    # One write API for the life of the process keeps its HTTP connections alive between uploads
+    with open_write_api(config) as write_api:
+        writer = BatchWriter(write_api, config['influx_db']['bucket'],
+                             batch_size=exporter_config.get('batch_size', chunk_size),
+                             flush_interval=exporter_config.get('flush_interval', 10),
+                             dry_run=config['dry_run'])
+        try:
+            run(sources, writer, chunk_size, Maintenance(config) if config.get('maintenance') else None)
+        finally:
+            writer.flush()
+
+if __name__ == "__main__":
+    main()
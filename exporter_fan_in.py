@@ -0,0 +1,261 @@
+import argparse
+import collections
+import glob
+import importlib
+import logging
+import os
+import sqlite3
+import time
+import telemetry
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from config_loader import EXPORTER_SCHEMA, load_config
+from exporter import DEFAULT_CHUNK_SIZE, BatchWriter, acknowledge_rows, fetch_chunks, open_write_api
+
+config = load_config('config.yml', EXPORTER_SCHEMA)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Collector tables and the exporter module whose serializer_for() formats them
+TABLES = {'Performance': 'iperf', 'PingResults': 'ping', 'SpeedtestResults': 'speedtest'}
+# Keys of a site entry naming the database of a single table, as in config['sqlite']
+TABLE_PATH_KEYS = {'iperf_path': 'Performance', 'ping_path': 'PingResults', 'speedtest_path': 'SpeedtestResults'}
+DEFAULT_CHUNKS_PER_TASK = 4
+
+# Expand fan_in.sites into (location_name, table, db_path) jobs. A site either
+# names one database holding any of the collector tables under `path`, which may
+# be a glob, or one path per table like config['sqlite']. location_name may use
+# {stem} and {parent} of the matched path and defaults to the file name stem.
+def expand_sites(sites):
+    jobs = []
+    for site in sites:
+        if 'path' in site:
+            paths = sorted(glob.glob(site['path'])) if glob.has_magic(site['path']) else [site['path']]
+            for path in paths:
+                location_name = site.get('location_name', '{stem}').format(
+                    stem=os.path.splitext(os.path.basename(path))[0],
+                    parent=os.path.basename(os.path.dirname(os.path.abspath(path))))
+                jobs.extend((location_name, table, path) for table in TABLES)
+        else:
+            jobs.extend((site['location_name'], table, site[key]) for key, table in TABLE_PATH_KEYS.items() if key in site)
+    return jobs
+
+_serializers = {}
+
+def _serializer(table, location_name):
+    key = (table, location_name)
+    if key not in _serializers:
+        _serializers[key] = importlib.import_module(TABLES[table]).serializer_for(location_name)
+    return _serializers[key]
+
+# Runs in a pool worker: read up to max_rows unacknowledged rows of one table
+# after after_rowid and serialize them to one line protocol payload. Returns
+# (payload, rows, last_rowid, more, seconds); a missing table yields no rows.
+def serialize_table(db_path, table, location_name, after_rowid, chunk_size, max_rows):
+    started = time.perf_counter()
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                    (table,)).fetchone()
+    finally:
+        connection.close()
+    if not exists:
+        return b'', 0, after_rowid, False, time.perf_counter() - started
+
+    serializer = _serializer(table, location_name)
+    payload = bytearray()
+    rows = 0
+    last_rowid = after_rowid
+    for chunk in fetch_chunks(db_path, table, chunk_size, after_rowid):
+        payload += serializer.serialize(chunk)
+        rows += len(chunk)
+        last_rowid = chunk[-1][-1]
+        if rows >= max_rows:
+            break
+    return bytes(payload), rows, last_rowid, rows >= max_rows, time.perf_counter() - started
+
+class SiteStats:
+    __slots__ = ('rows', 'bytes', 'busy', 'started', 'finished', 'error')
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+
+# Export many site databases in one run. Tables are read and serialized in a
+# process pool with at most `workers` tasks in flight, each task covering up to
+# chunks_per_task chunks so a large site is interleaved with the others instead
+# of holding a worker. Payloads go through one BatchWriter, and each table's
+# rows are acknowledged in its own database once the writes containing them and
+# every earlier payload of the table have succeeded. A failing database, a
+# failed upload or a crashed worker is logged and fails only the sites involved:
+# their later results are dropped and nothing more of them is acknowledged, so
+# rows that never reached InfluxDB stay in place. The rest continue, with a
+# fresh pool if a worker died.
+def run(jobs, writer, workers, chunk_size, chunks_per_task=DEFAULT_CHUNKS_PER_TASK, retain=False):
+    stats = {}
+    pending = collections.deque((location_name, table, db_path, None) for location_name, table, db_path in jobs)
+    failed = set()
+    crashed = set()
+    inflight = {}
+    # Payloads handed to the writer per (db_path, table), oldest first, as [last_rowid, written]
+    unwritten = collections.defaultdict(collections.deque)
+
+    def fail(location_name, db_path, error):
+        failed.add(db_path)
+        stats[(location_name, db_path)].error = error
+
+    # Acknowledge up to the newest payload of the table with no unwritten payload before it
+    def written(location_name, db_path, table, payload):
+        payload[1] = True
+        queue = unwritten[(db_path, table)]
+        last_rowid = None
+        while queue and queue[0][1]:
+            last_rowid = queue.popleft()[0]
+        if last_rowid is None or db_path in failed:
+            return
+        try:
+            acknowledge_rows(db_path, table, last_rowid, retain=retain)
+        except Exception as e:
+            logging.error(f"Could not acknowledge {table} rows in {db_path}", exc_info=True)
+            fail(location_name, db_path, str(e))
+
+    # Every task in flight when a worker dies fails with BrokenProcessPool, and so
+    # does every later submit to that pool, so the next submit starts a new one.
+    # Those tasks are retried once, as only one of them killed the worker.
+    pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(*args):
+        nonlocal pool
+        try:
+            return pool.submit(serialize_table, *args)
+        except BrokenProcessPool:
+            logging.warning("A worker process died; starting a new process pool")
+            pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=workers)
+            return pool.submit(serialize_table, *args)
+
+    def write(location_name, *args, **kwargs):
+        try:
+            writer.write(*args, **kwargs)
+        except Exception:
+            # The writer already failed every site in the batch through its on_failed callback
+            logging.error(f"Upload to InfluxDB failed; leaving the rows of {location_name} and the other "
+                          f"sites in the batch unacknowledged", exc_info=True)
+
+    try:
+        while pending or inflight:
+            while pending and len(inflight) < workers:
+                # A retried task runs alone, so a second crash can only be its own
+                if pending[0] in crashed and inflight:
+                    break
+                location_name, table, db_path, after_rowid = job = pending.popleft()
+                if db_path in failed:
+                    continue
+                if (location_name, db_path) not in stats:
+                    stats[(location_name, db_path)] = SiteStats()
+                inflight[submit(db_path, table, location_name, after_rowid,
+                                chunk_size, chunk_size * chunks_per_task)] = job
+                if job in crashed:
+                    break
+            if not inflight:
+                break
+
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                location_name, table, db_path, after_rowid = job = inflight.pop(future)
+                site = stats[(location_name, db_path)]
+                try:
+                    payload, rows, last_rowid, more, seconds = future.result()
+                except BrokenProcessPool as e:
+                    if job in crashed or db_path in failed:
+                        logging.error(f"Skipping site {location_name} ({db_path}): {e}")
+                        fail(location_name, db_path, str(e))
+                    else:
+                        crashed.add(job)
+                        pending.append(job)
+                    continue
+                except Exception as e:
+                    if db_path not in failed:
+                        logging.error(f"Skipping site {location_name} ({db_path}): {e}")
+                    fail(location_name, db_path, str(e))
+                    continue
+                if db_path in failed:
+                    continue
+
+                site.busy += seconds
+                site.finished = time.monotonic()
+                if not rows:
+                    continue
+                site.rows += rows
+                site.bytes += len(payload)
+                telemetry.count('rows_fetched', rows, table=table, site=location_name)
+                # A dry run never writes, so it must not stop the site's remaining tasks
+                on_failed = None if writer.dry_run else lambda args=(location_name, db_path, "write failed"): fail(*args)
+                entry = [last_rowid, False]
+                unwritten[(db_path, table)].append(entry)
+                write(location_name, [payload], count=rows,
+                      on_written=lambda args=(location_name, db_path, table, entry): written(*args),
+                      on_failed=on_failed)
+                if more:
+                    # Continue after this task's rows; the cursor only moves once they are written
+                    pending.append((location_name, table, db_path, last_rowid))
+        try:
+            writer.flush()
+        except Exception:
+            logging.error("Upload to InfluxDB failed; leaving the rows of the last batch unacknowledged",
+                          exc_info=True)
+    finally:
+        pool.shutdown()
+    return stats
+
+def report(stats):
+    for (location_name, db_path), site in sorted(stats.items()):
+        if site.error:
+            logging.error(f"{location_name}: failed ({site.error}) after {site.rows} rows from {db_path}")
+            continue
+        elapsed = (site.finished or site.started) - site.started
+        rate = site.rows / elapsed if elapsed > 0 else 0.0
+        logging.info(f"{location_name}: {site.rows} rows, {site.bytes} bytes in {elapsed:.2f}s "
+                     f"({rate:.0f} rows/s, {site.busy:.2f}s worker time) from {db_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Export many site databases to InfluxDB in one run')
+    parser.add_argument('paths', nargs='*', help='Site databases or globs; location_name is the file name stem')
+    parser.add_argument('--workers', type=int, help='Process pool size (default: fan_in.workers or CPU count)')
+    args = parser.parse_args()
+
+    fan_in_config = config.get('fan_in') or {}
+    sites = fan_in_config.get('sites', []) + [{'path': path} for path in args.paths]
+    jobs = expand_sites(sites)
+    workers = args.workers or fan_in_config.get('workers') or os.cpu_count()
+    chunk_size = config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    telemetry.configure(config, job='exporter_fan_in')
+    logging.info(f"Exporting {len({job[2] for job in jobs})} site databases with {workers} workers.")
+
+    started = time.monotonic()
+    with open_write_api(config) as write_api:
+        writer = BatchWriter(write_api, config['influx_db']['bucket'],
+                             batch_size=fan_in_config.get('batch_size', chunk_size), dry_run=config['dry_run'])
+        try:
+            stats = run(jobs, writer, workers, chunk_size,
+                        chunks_per_task=fan_in_config.get('chunks_per_task', DEFAULT_CHUNKS_PER_TASK),
+                        retain=config.get('retain_exported_rows', False))
+            telemetry.publish(writer)
+            writer.flush()
+        except Exception:
+            logging.error("Upload to InfluxDB failed", exc_info=True)
+            raise
+    report(stats)
+    total = sum(site.rows for site in stats.values())
+    logging.info(f"Exported {total} rows from {len(stats)} sites in {time.monotonic() - started:.2f}s; "
+                 f"{sum(1 for site in stats.values() if site.error)} failed.")
+
+if __name__ == "__main__":
+    main()
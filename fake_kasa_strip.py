@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import struct
+import time
+from kasa.transports import XorEncryption
+
+DEFAULT_PORT = 9999
+
+async def read_message(reader):
+    length = struct.unpack('>I', await reader.readexactly(4))[0]
+    return json.loads(XorEncryption.decrypt(await reader.readexactly(length)))
+
+def write_message(writer, message):
+    writer.write(XorEncryption.encrypt(json.dumps(message, separators=(',', ':'))))
+
+# Local stand-in for a Kasa power strip (HS300/KP303 style) speaking the
+# legacy smarthome protocol on TCP, for testing and benchmarking plugctl
+# without hardware. It answers get_sysinfo, set_relay_state and the time
+# module python-kasa reads on update (anything else is "not supported"),
+# honours the context.child_ids of multi-socket requests, keeps connections
+# open between requests like the real devices and can add a per-request
+# latency.
+class FakeStrip:
+    def __init__(self, sockets=6, alias_prefix='Plug', latency=0.0, device_id=None):
+        self.device_id = device_id or ''.join(random.choice('0123456789ABCDEF') for _ in range(40))
+        self.mac = ':'.join(self.device_id[i:i + 2] for i in range(0, 12, 2))
+        self.latency = latency
+        self.children = [{"id": f"{self.device_id}{index:02d}", "alias": f"{alias_prefix} {index + 1}",
+                          "state": 1, "on_time": 0, "next_action": {"type": -1}}
+                         for index in range(sockets)]
+        self.requests = 0
+        # (child id, state) of every relay change, in order
+        self.switches = []
+        self._server = None
+
+    def sysinfo(self):
+        return {"sw_ver": "1.0.0 Build 000000 Rel.000000", "hw_ver": "1.0", "model": "HS300(US)",
+                "deviceId": self.device_id, "mac": self.mac, "alias": "Fake strip", "mic_type": "IOT.SMARTPLUGSWITCH",
+                "child_num": len(self.children), "children": self.children, "err_code": 0}
+
+    def handle(self, request):
+        child_ids = (request.get("context") or {}).get("child_ids")
+        response = {}
+        for module, methods in request.items():
+            if module == "context":
+                continue
+            for method, params in methods.items():
+                if module == "system" and method == "get_sysinfo":
+                    result = self.sysinfo()
+                elif module == "time" and method == "get_time":
+                    now = time.localtime()
+                    result = {"year": now.tm_year, "month": now.tm_mon, "mday": now.tm_mday,
+                              "hour": now.tm_hour, "min": now.tm_min, "sec": now.tm_sec, "err_code": 0}
+                elif module == "time" and method == "get_timezone":
+                    result = {"index": 39, "err_code": 0}
+                elif module == "system" and method == "set_relay_state":
+                    targets = [child for child in self.children if child_ids is None or child["id"] in child_ids]
+                    if child_ids and len(targets) != len(child_ids):
+                        result = {"err_code": -14, "err_msg": "entry not exist"}
+                    else:
+                        for child in targets:
+                            child["state"] = int(params["state"])
+                            self.switches.append((child["id"], child["state"]))
+                        result = {"err_code": 0}
+                else:
+                    result = {"err_code": -2, "err_msg": "member not support"}
+                response.setdefault(module, {})[method] = result
+        return response
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request = await read_message(reader)
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                write_message(writer, self.handle(request))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Clients hang up between requests; open connections are cancelled on shutdown
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+async def serve(host, port, sockets, latency):
+    strip = FakeStrip(sockets=sockets, latency=latency)
+    port = await strip.start(host, port)
+    logging.info(f"Fake strip with {sockets} sockets listening on {host}:{port}")
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Kasa power strip")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--sockets", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port, args.sockets, args.latency))
+
+if __name__ == "__main__":
+    main()
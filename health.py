@@ -0,0 +1,358 @@
+import argparse
+import json
+import logging
+import math
+import sqlite3
+import time
+from array import array
+from config_loader import load_config
+from line_protocol import TIME_FORMAT, epoch_seconds
+
+# Defaults used when the health section of config.yml leaves them out
+DEFAULT_WINDOW = 60
+DEFAULT_ALPHA = 0.1
+DEFAULT_JITTER_GAIN = 1 / 16
+DEFAULT_GOOD_LATENCY = 50.0
+DEFAULT_BAD_LATENCY = 500.0
+DEFAULT_GOOD_JITTER = 5.0
+DEFAULT_BAD_JITTER = 100.0
+DEFAULT_BAD_LOSS = 0.5
+DEFAULT_WEIGHTS = {'latency': 0.25, 'jitter': 0.15, 'loss': 0.6}
+DEFAULT_CYCLE_BELOW = 30.0
+DEFAULT_RECOVER_ABOVE = 60.0
+DEFAULT_HOLD = 120
+DEFAULT_STALE_AFTER = 120
+DEFAULT_HISTORY = 3600
+DEFAULT_EVALUATE_INTERVAL = 10
+
+def _rounded(value, digits):
+    return None if value is None else round(value, digits)
+
+def _penalty(value, good, bad):
+    if value <= good:
+        return 0.0
+    if value >= bad:
+        return 1.0
+    return (value - good) / (bad - good)
+
+# Write values into a ring at index, returning the new running sum and index.
+# Whole runs are copied by slice assignment; the sum starts again from an exact
+# fsum whenever the ring wraps, so rounding never accumulates.
+def _push(ring, index, total, values):
+    window = len(ring)
+    if len(values) >= window:
+        ring[:] = array('d', values[-window:])
+        return math.fsum(ring), 0
+    first = min(len(values), window - index)
+    evicted = math.fsum(ring[index:index + first])
+    ring[index:index + first] = array('d', values[:first])
+    rest = len(values) - first
+    if rest or index + first == window:
+        ring[:rest] = array('d', values[first:])
+        return math.fsum(ring), rest
+    return total + math.fsum(values) - evicted, index + first
+
+# Probe history of one (interface, target) pair in two fixed-size rings, the
+# loss of every sample and the latency of every answered one, with running sums
+# for the window means. Latency is also followed by an EWMA, and jitter by the
+# RFC 3550 estimator, J += (|D| - J) / 16 over consecutive latencies, so adding
+# a sample is O(1) whatever the window size.
+#
+# Both filters forget geometrically: after `horizon` samples the state they
+# started from weighs less than one unit in the last place of a double. A
+# batch longer than that (a replayed day, say) only runs them over its last
+# horizon latencies, which gives the same result to float precision.
+class LinkHealth:
+    __slots__ = ('alpha', 'jitter_gain', 'horizon', 'losses', 'loss_index', 'loss_count', 'loss_sum',
+                 'latencies', 'latency_index', 'latency_count', 'latency_sum',
+                 'ewma', 'jitter', 'previous', 'last_time')
+
+    def __init__(self, window=DEFAULT_WINDOW, alpha=DEFAULT_ALPHA, jitter_gain=DEFAULT_JITTER_GAIN):
+        self.alpha = alpha
+        self.jitter_gain = jitter_gain
+        self.horizon = math.ceil(math.log(2.0 ** -53) / math.log(1.0 - min(alpha, jitter_gain)))
+        self.losses = array('d', bytes(8 * window))
+        self.loss_index = 0
+        self.loss_count = 0
+        self.loss_sum = 0.0
+        self.latencies = array('d', bytes(8 * window))
+        self.latency_index = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.ewma = None
+        self.jitter = 0.0
+        self.previous = None
+        self.last_time = None
+
+    # Add samples in time order: latencies in ms, None when nothing came back,
+    # and the lost fraction of the probes behind each sample (0 to 1)
+    def add(self, times, latencies, losses):
+        if not times:
+            return
+        window = len(self.losses)
+        self.loss_sum, self.loss_index = _push(self.losses, self.loss_index, self.loss_sum, losses)
+        self.loss_count = min(window, self.loss_count + len(losses))
+        self.last_time = times[-1]
+        answered = [latency for latency in latencies if latency is not None]
+        if not answered:
+            return
+        self.latency_sum, self.latency_index = _push(self.latencies, self.latency_index, self.latency_sum, answered)
+        self.latency_count = min(window, self.latency_count + len(answered))
+
+        if len(answered) > self.horizon:
+            answered = answered[-self.horizon:]
+        alpha = self.alpha
+        jitter_gain = self.jitter_gain
+        ewma = self.ewma
+        jitter = self.jitter
+        previous = self.previous
+        if previous is None:
+            ewma = previous = answered[0]
+        for latency in answered:
+            ewma += alpha * (latency - ewma)
+            difference = latency - previous
+            jitter += jitter_gain * ((difference if difference >= 0 else -difference) - jitter)
+            previous = latency
+        self.ewma = ewma
+        self.jitter = jitter
+        self.previous = previous
+
+    @property
+    def loss_rate(self):
+        return self.loss_sum / self.loss_count if self.loss_count else None
+
+    @property
+    def mean_latency(self):
+        return self.latency_sum / self.latency_count if self.latency_count else None
+
+# An interface: its links, one per probe target, a ring of mwan3 online/offline
+# polls and the unhealthy state its score moves in and out of with hysteresis
+class InterfaceHealth:
+    __slots__ = ('links', 'online', 'online_index', 'online_count', 'online_sum', 'score', 'unhealthy_since')
+
+    def __init__(self, window):
+        self.links = {}
+        self.online = bytearray(window)
+        self.online_index = 0
+        self.online_count = 0
+        self.online_sum = 0
+        self.score = None
+        self.unhealthy_since = None
+
+    def add_status(self, is_online):
+        value = 1 if is_online else 0
+        self.online_sum += value - self.online[self.online_index]
+        self.online[self.online_index] = value
+        self.online_index = (self.online_index + 1) % len(self.online)
+        self.online_count = min(len(self.online), self.online_count + 1)
+
+    @property
+    def online_fraction(self):
+        return self.online_sum / self.online_count if self.online_count else None
+
+# Link health of every interface from PingResults rows (or any probe samples)
+# and mwan3 polls, kept up to date incrementally instead of re-reading tables.
+#
+# A link's score runs from 100 down to 0 as its latency EWMA, jitter and loss
+# rate move from their good towards their bad values, weighted. An interface
+# scores as its best link that has reported within stale_after seconds, times
+# the fraction of recent mwan3 polls that saw it online; with no fresh link,
+# the mwan3 fraction alone. An interface turns unhealthy when its score drops
+# below cycle_below and healthy again only once it is back above
+# recover_above, and it is due a power cycle after staying unhealthy for hold
+# seconds. The score is evaluated by evaluate(), once per poll, and tail()
+# replays a fresh engine's history in evaluate_interval steps, so a one-shot
+# process reaches the same decision a long-running one would.
+#
+# health:
+#   window: 60               # samples per link and polls per interface
+#   alpha: 0.1               # latency EWMA weight of a new sample
+#   good_latency: 50         # ms
+#   bad_latency: 500
+#   good_jitter: 5
+#   bad_jitter: 100
+#   bad_loss: 0.5
+#   weights: {latency: 0.25, jitter: 0.15, loss: 0.6}
+#   cycle_below: 30
+#   recover_above: 60
+#   hold: 120
+#   stale_after: 120
+#   history: 3600            # seconds of PingResults read on the first tail()
+#   ping_path: ...           # default sqlite.ping_path
+class HealthEngine:
+    def __init__(self, config):
+        health_config = config.get('health') or {}
+        self.window = health_config.get('window', DEFAULT_WINDOW)
+        self.alpha = health_config.get('alpha', DEFAULT_ALPHA)
+        self.good_latency = health_config.get('good_latency', DEFAULT_GOOD_LATENCY)
+        self.bad_latency = health_config.get('bad_latency', DEFAULT_BAD_LATENCY)
+        self.good_jitter = health_config.get('good_jitter', DEFAULT_GOOD_JITTER)
+        self.bad_jitter = health_config.get('bad_jitter', DEFAULT_BAD_JITTER)
+        self.bad_loss = health_config.get('bad_loss', DEFAULT_BAD_LOSS)
+        weights = dict(DEFAULT_WEIGHTS, **health_config.get('weights', {}))
+        total = sum(weights.values())
+        self.weights = {key: value / total for key, value in weights.items()}
+        self.cycle_below = health_config.get('cycle_below', DEFAULT_CYCLE_BELOW)
+        self.recover_above = health_config.get('recover_above', DEFAULT_RECOVER_ABOVE)
+        self.hold = health_config.get('hold', DEFAULT_HOLD)
+        self.stale_after = health_config.get('stale_after', DEFAULT_STALE_AFTER)
+        self.history = health_config.get('history', DEFAULT_HISTORY)
+        self.evaluate_interval = health_config.get('evaluate_interval', DEFAULT_EVALUATE_INTERVAL)
+        self.ping_path = health_config.get('ping_path') or config.get('sqlite', {}).get('ping_path')
+        self.interfaces = {}
+        self.last_rowid = None
+        self._day_seconds = {}
+
+    def interface(self, name):
+        interface = self.interfaces.get(name)
+        if interface is None:
+            interface = self.interfaces[name] = InterfaceHealth(self.window)
+        return interface
+
+    def link(self, interface, target):
+        links = self.interface(interface).links
+        link = links.get(target)
+        if link is None:
+            link = links[target] = LinkHealth(self.window, self.alpha)
+        return link
+
+    def add_samples(self, interface, target, times, latencies, losses):
+        self.link(interface, target).add(times, latencies, losses)
+
+    # PingResults rows as (server_ip, interface, avg_latency, success_rate, timestamp)
+    def add_ping_rows(self, rows):
+        series = {}
+        for server_ip, interface, avg_latency, success_rate, timestamp, *_ in rows:
+            samples = series.get((interface, server_ip))
+            if samples is None:
+                samples = series[(interface, server_ip)] = ([], [], [])
+            samples[0].append(epoch_seconds(timestamp, self._day_seconds))
+            # summarize() stores 0 latency for a round without replies
+            samples[1].append(avg_latency if success_rate else None)
+            samples[2].append(1.0 - (success_rate or 0.0) / 100)
+        for (interface, server_ip), (times, latencies, losses) in series.items():
+            self.add_samples(interface, server_ip, times, latencies, losses)
+
+    # One mwan3 poll, {interface: is_online}
+    def add_status(self, statuses):
+        for name, is_online in statuses.items():
+            self.interface(name).add_status(is_online)
+
+    def link_score(self, link):
+        if link.ewma is None and not link.loss_count:
+            return None
+        weights = self.weights
+        penalty = weights['loss'] * min(1.0, link.loss_rate / self.bad_loss) if link.loss_count else 0.0
+        if link.ewma is None:
+            # Nothing ever came back
+            penalty += weights['latency'] + weights['jitter']
+        else:
+            penalty += weights['latency'] * _penalty(link.ewma, self.good_latency, self.bad_latency)
+            penalty += weights['jitter'] * _penalty(link.jitter, self.good_jitter, self.bad_jitter)
+        return 100.0 * (1.0 - penalty)
+
+    def interface_score(self, interface, now):
+        scores = [self.link_score(link) for link in interface.links.values()
+                  if link.last_time is not None and now - link.last_time <= self.stale_after]
+        scores = [score for score in scores if score is not None]
+        online_fraction = interface.online_fraction
+        if not scores:
+            return None if online_fraction is None else 100.0 * online_fraction
+        return max(scores) * (1.0 if online_fraction is None else online_fraction)
+
+    # Score every interface at now (Unix seconds) and move it through the hysteresis
+    def evaluate(self, now):
+        scores = {}
+        for name, interface in self.interfaces.items():
+            score = interface.score = self.interface_score(interface, now)
+            scores[name] = score
+            if score is None:
+                continue
+            if interface.unhealthy_since is None:
+                if score < self.cycle_below:
+                    interface.unhealthy_since = now
+            elif score >= self.recover_above:
+                interface.unhealthy_since = None
+        return scores
+
+    def should_power_cycle(self, name, now):
+        interface = self.interfaces.get(name)
+        return (interface is not None and interface.unhealthy_since is not None
+                and now - interface.unhealthy_since >= self.hold)
+
+    # A power cycle starts the hold over, so a modem still coming up is given time
+    def power_cycled(self, name, now):
+        interface = self.interfaces.get(name)
+        if interface is not None and interface.unhealthy_since is not None:
+            interface.unhealthy_since = now
+
+    # Add the PingResults rows collected since the last call, reading only the
+    # last `history` seconds the first time. The exporter deletes exported rows
+    # and an emptied table restarts its rowids, which is caught by the newest
+    # rowid going backwards. Returns how many rows were added.
+    def tail(self, db_path=None):
+        db_path = db_path or self.ping_path
+        if not db_path:
+            return 0
+        connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            newest = connection.execute("SELECT max(rowid) FROM PingResults").fetchone()[0] or 0
+            replay = self.last_rowid is None
+            if replay or newest < self.last_rowid:
+                since = time.strftime(TIME_FORMAT, time.gmtime(time.time() - self.history))
+                self.last_rowid = 0
+            else:
+                since = ''
+            rows = connection.execute("SELECT server_ip, interface, avg_latency, success_rate, timestamp, rowid "
+                                      "FROM PingResults WHERE rowid > ? AND timestamp >= ? ORDER BY rowid",
+                                      (self.last_rowid, since)).fetchall()
+        finally:
+            connection.close()
+        if not rows:
+            return 0
+        self.last_rowid = rows[-1][-1]
+        if replay:
+            # Step through history so the hysteresis sees it as it happened
+            rows.sort(key=lambda row: row[4])
+            step_end = None
+            start = 0
+            for index, row in enumerate(rows):
+                moment = epoch_seconds(row[4], self._day_seconds)
+                if step_end is None:
+                    step_end = moment + self.evaluate_interval
+                elif moment >= step_end:
+                    self.add_ping_rows(rows[start:index])
+                    self.evaluate(step_end)
+                    start = index
+                    step_end = moment + self.evaluate_interval
+            self.add_ping_rows(rows[start:])
+        else:
+            self.add_ping_rows(rows)
+        return len(rows)
+
+    def snapshot(self):
+        return {name: {'score': _rounded(interface.score, 1),
+                       'unhealthy_since': interface.unhealthy_since,
+                       'online_fraction': _rounded(interface.online_fraction, 3),
+                       'links': {target: {'score': _rounded(self.link_score(link), 1),
+                                          'latency_ewma': _rounded(link.ewma, 2),
+                                          'jitter': round(link.jitter, 2),
+                                          'loss_rate': _rounded(link.loss_rate, 4),
+                                          'samples': link.loss_count}
+                                 for target, link in interface.links.items()}}
+                for name, interface in self.interfaces.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='Score link health from the recent PingResults history')
+    parser.add_argument('--config', default='config.yml')
+    parser.add_argument('--db', help='PingResults database (default: health.ping_path or sqlite.ping_path)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    engine = HealthEngine(load_config(args.config))
+    engine.tail(args.db)
+    engine.evaluate(time.time())
+    print(json.dumps(engine.snapshot(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,21 @@
-import sqlite3
-import yaml
 import logging
 from datetime import datetime
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+import telemetry
+from archive import ArchiveTable, archive_writer
+from line_protocol import LineProtocolSerializer
+from config_loader import EXPORTER_SCHEMA, load_config
+from exporter import DEFAULT_CHUNK_SIZE, BatchWriter, ExportSource, acknowledge_rows, fetch_chunks, open_write_api
 
-# Load configuration from YAML file
-def load_config(file_path):
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
-
-config = load_config('config.yml')
+config = load_config('config.yml', EXPORTER_SCHEMA)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-def fetch_data():
-    connection = sqlite3.connect(config['sqlite']['iperf_path'])
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM Performance")
-    rows = cursor.fetchall()
-    connection.close()
-    return rows
+def fetch_data(chunk_size=DEFAULT_CHUNK_SIZE, after_rowid=None):
+    return fetch_chunks(config['sqlite']['iperf_path'], "Performance", chunk_size, after_rowid)
 
 def format_data_for_influx(rows):
+    from influxdb_client import Point
     influx_data = []
     for row in rows:
         point = Point("performance_metrics") \
@@ -36,32 +28,52 @@ def format_data_for_influx(rows):
         influx_data.append(point)
     return influx_data
 
-def upload_to_influx(data):
-    with InfluxDBClient(url=config['influx_db']['url'],
-                        token=config['influx_db']['token'],
-                        org=config['influx_db']['org']) as client:
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-        write_api.write(bucket=config['influx_db']['bucket'], record=data)
+# Line protocol serializer producing the same bytes as format_data_for_influx() for a site
+def serializer_for(location_name):
+    return LineProtocolSerializer("performance_metrics",
+                                  constant_tags={"location_name": location_name},
+                                  row_tags={"server_ip": 1, "direction": 3},
+                                  fields=[("bandwidth_limit", 4, None), ("speed", 5, float)],
+                                  time_index=2)
+
+line_protocol = serializer_for(config['location_name'])
+
+# Uploaded rows also go to the local archive when config.yml has an archive section
+archive_table = ArchiveTable("performance_metrics", tags={"server_ip": 1, "direction": 3},
+                             fields={"bandwidth_limit": 4, "speed": 5}, time_index=2)
+
+def format_data_as_line_protocol(rows):
+    payload = line_protocol.serialize(rows)
+    return [payload] if payload else []
 
-def clear_database():
-    connection = sqlite3.connect(config['sqlite']['iperf_path'])
-    cursor = connection.cursor()
-    cursor.execute("DELETE FROM Performance")
-    connection.commit()
-    connection.close()
+def clear_database(last_rowid):
+    return acknowledge_rows(config['sqlite']['iperf_path'], "Performance", last_rowid,
+                            retain=config.get('retain_exported_rows', False))
+
+def select_formatter():
+    if config.get('serializer', 'point') == 'line_protocol':
+        return format_data_as_line_protocol
+    return format_data_for_influx
+
+source = ExportSource("iperf", fetch_data, select_formatter(), clear_database, interval=60,
+                      archive=archive_writer(config, archive_table))
 
 def main():
     dry_run = config['dry_run']
+    chunk_size = config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    telemetry.configure(config, job='iperf')
+
+    # Stream unacknowledged rows chunk by chunk, acknowledging each one once it is uploaded or spooled
+    with open_write_api(config) as write_api:
+        writer = BatchWriter(write_api, config['influx_db']['bucket'], batch_size=chunk_size, dry_run=dry_run)
+        total = source.poll(writer, chunk_size)
+        writer.flush()
+        telemetry.publish(writer)
+        writer.flush()
 
-    rows = fetch_data()
-    if rows:
-        influx_data = format_data_for_influx(rows)
+    if total:
         if not dry_run:
-            upload_to_influx(influx_data)
-            clear_database()
-            logging.info("Data uploaded to InfluxDB.")
-        else:
-            logging.info(f"Dry run: Data prepared for upload Length: {len(influx_data)}")
+            logging.info(f"Data uploaded to InfluxDB. Rows: {total}")
     else:
         logging.info("No new data to upload.")
 
@@ -0,0 +1,125 @@
+import math
+from datetime import datetime
+
+# Escaping rules used by influxdb_client's Point, so both paths emit the same bytes
+_ESCAPE_MEASUREMENT = str.maketrans({',': r'\,', ' ': r'\ ', '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+_ESCAPE_KEY = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+_ESCAPE_STRING = str.maketrans({'"': r'\"', '\\': r'\\'})
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def escape_tag_value(value):
+    escaped = str(value).translate(_ESCAPE_KEY)
+    if escaped.endswith('\\'):
+        escaped += ' '
+    return escaped
+
+def format_field_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        text = repr(value)
+        return text[:-2] if text.endswith('.0') else text
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, str):
+        return f'"{value.translate(_ESCAPE_STRING)}"'
+    raise ValueError(f"Type: '{type(value)}' of field is not supported.")
+
+# Days since the Unix epoch for a proleptic Gregorian date (Howard Hinnant's days_from_civil)
+def _days_from_civil(year, month, day):
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+# Unix seconds of a UTC timestamp in TIME_FORMAT, parsing each distinct day only
+# once: day_seconds caches the epoch seconds of midnight per date prefix
+def epoch_seconds(value, day_seconds):
+    if not isinstance(value, str) or len(value) != 19:
+        moment = datetime.strptime(value, TIME_FORMAT)
+        return _days_from_civil(moment.year, moment.month, moment.day) * 86400 + \
+            moment.hour * 3600 + moment.minute * 60 + moment.second
+    day = value[:10]
+    midnight = day_seconds.get(day)
+    if midnight is None:
+        moment = datetime.strptime(value, TIME_FORMAT)
+        midnight = day_seconds[day] = _days_from_civil(moment.year, moment.month, moment.day) * 86400
+    return midnight + int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+
+# Serializes SQLite rows straight to InfluxDB line protocol, matching what
+# Point(...).to_line_protocol() produces for the same row byte for byte.
+#
+# Constant tags are escaped once up front, per-row tag values are escaped once
+# per distinct value, and timestamps in TIME_FORMAT are converted with integer
+# arithmetic and a per-day cache instead of datetime.strptime(). Every chunk is
+# assembled in the same bytearray.
+class LineProtocolSerializer:
+    def __init__(self, measurement, constant_tags, row_tags, fields, time_index):
+        self._measurement = measurement.translate(_ESCAPE_MEASUREMENT)
+        # Point writes tags sorted by key; a tag is either pre-rendered text or a row index
+        tags = [(key, escape_tag_value(value)) for key, value in constant_tags.items() if value is not None]
+        tags += list(row_tags.items())
+        self._tags = []
+        for key, value in sorted(tags):
+            escaped_key = key.translate(_ESCAPE_KEY)
+            if isinstance(value, str):
+                if value:
+                    self._tags.append((f"{escaped_key}={value}", None))
+            else:
+                self._tags.append((f"{escaped_key}=", value))
+        # Fields are sorted by key as well
+        self._fields = [(f"{key.translate(_ESCAPE_KEY)}=", index, convert) for key, index, convert in sorted(fields)]
+        self._time_index = time_index
+        self._tag_values = {}
+        self._day_seconds = {}
+        self._buffer = bytearray()
+
+    def _escaped_tag_value(self, value):
+        escaped = self._tag_values.get(value)
+        if escaped is None:
+            escaped = self._tag_values[value] = escape_tag_value(value)
+        return escaped
+
+    def format_row(self, row):
+        tags = []
+        for text, index in self._tags:
+            if index is None:
+                tags.append(text)
+            else:
+                value = row[index]
+                if value is not None:
+                    value = self._escaped_tag_value(value)
+                    if value:
+                        tags.append(text + value)
+
+        fields = []
+        for prefix, index, convert in self._fields:
+            value = row[index]
+            value = format_field_value(convert(value) if convert else value)
+            if value is not None:
+                fields.append(prefix + value)
+        if not fields:
+            return ''
+
+        tag_text = ',' + ','.join(tags) if tags else ''
+        timestamp = epoch_seconds(row[self._time_index], self._day_seconds)
+        return f"{self._measurement}{tag_text} {','.join(fields)} {timestamp * 1000000000}"
+
+    # Serialize a chunk of rows into one newline separated line protocol payload
+    def serialize(self, rows):
+        buffer = self._buffer
+        del buffer[:]
+        for row in rows:
+            line = self.format_row(row)
+            if line:
+                if buffer:
+                    buffer += b'\n'
+                buffer += line.encode('utf-8')
+        return bytes(buffer)
@@ -0,0 +1,280 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+import telemetry
+from config_loader import load_config
+from exporter import advance_cursor
+from state_store import format_time
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_INTERVAL = 3600
+DEFAULT_MAX_AGE_DAYS = 30
+# Free pages handed back to the filesystem per run; small steps keep each run's writes short
+DEFAULT_VACUUM_PAGES = 256
+# Share of the largest table dropped per step while a database is over its size cap
+CAP_STEP = 0.1
+_MAX_CAP_STEPS = 20
+
+# Tables kept per sqlite config key as (table, time column, how time is stored, pruning strategy).
+# Time is stored as 'text' (UTC, TIME_FORMAT), 'epoch' (Unix seconds) or 'local' (StateStore's
+# local-time format with microseconds). Strategies:
+#   rows         append-only collector rows, oldest first by rowid
+#   events       mwan3_events, only cut at a checkpoint so past states stay reconstructable
+#   transitions  interface_transitions, keeping each interface's last row before the cutoff
+#                so its cumulative downtime totals stay exact
+#   age          small tables where only age applies (stale interfaces, rollup buckets)
+TABLES = {
+    'iperf_path': [('Performance', 'timestamp', 'text', 'rows')],
+    'ping_path': [('PingResults', 'timestamp', 'text', 'rows')],
+    'speedtest_path': [('SpeedtestResults', 'timestamp', 'text', 'rows')],
+    'mwan3_path': [('mwan3_events', 'event_time', 'text', 'events'),
+                   ('interface_transitions', 'event_time', 'epoch', 'transitions'),
+                   ('downtime_rollup', 'bucket_start', 'epoch', 'age'),
+                   ('mwan3_status', 'last_checked_time', 'local', 'age')],
+}
+
+def _file_bytes(db_path):
+    return sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))
+
+def _table_exists(connection, table):
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table,)).fetchone() is not None
+
+def _export_cursor(connection, table):
+    if not _table_exists(connection, 'export_cursor'):
+        return None
+    row = connection.execute("SELECT last_rowid FROM export_cursor WHERE table_name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+def _pragma(connection, name):
+    return connection.execute(f"PRAGMA {name}").fetchone()[0]
+
+def _used_bytes(connection):
+    return (_pragma(connection, 'page_count') - _pragma(connection, 'freelist_count')) * _pragma(connection, 'page_size')
+
+def _prune_rows(connection, table, column, cutoff, max_rows):
+    deleted = 0
+    if cutoff is not None:
+        deleted += connection.execute(f"DELETE FROM {table} WHERE {column} < ?", (cutoff,)).rowcount
+    if max_rows is not None:
+        row = connection.execute(f"SELECT rowid FROM {table} ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                                 (max_rows,)).fetchone()
+        if row:
+            deleted += connection.execute(f"DELETE FROM {table} WHERE rowid <= ?", (row[0],)).rowcount
+    return deleted
+
+def _prune_transitions(connection, table, column, cutoff, max_rows):
+    deleted = 0
+    if max_rows is not None:
+        row = connection.execute(f"SELECT {column} FROM {table} ORDER BY id DESC LIMIT 1 OFFSET ?",
+                                 (max_rows,)).fetchone()
+        if row and (cutoff is None or row[0] > cutoff):
+            cutoff = row[0]
+    if cutoff is not None:
+        deleted += connection.execute(
+            f"DELETE FROM {table} WHERE {column} < ? AND id NOT IN "
+            f"(SELECT MAX(id) FROM {table} WHERE {column} < ? GROUP BY interface_name)", (cutoff, cutoff)).rowcount
+    return deleted
+
+def _prune_events(connection, table, column, cutoff, max_rows):
+    if not _table_exists(connection, 'mwan3_checkpoints'):
+        return 0
+    # Everything from the chosen checkpoint on is kept; the latest checkpoint is never dropped
+    candidates = []
+    if cutoff is not None:
+        candidates.append(connection.execute(
+            "SELECT id, first_event_id FROM mwan3_checkpoints WHERE event_time <= ? "
+            "ORDER BY event_time DESC, id DESC LIMIT 1", (cutoff,)).fetchone())
+    if max_rows is not None:
+        last_id = connection.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+        candidates.append(connection.execute(
+            "SELECT id, first_event_id FROM mwan3_checkpoints WHERE first_event_id > ? ORDER BY id LIMIT 1",
+            (last_id - max_rows,)).fetchone() or connection.execute(
+            "SELECT id, first_event_id FROM mwan3_checkpoints ORDER BY id DESC LIMIT 1").fetchone())
+    candidates = [candidate for candidate in candidates if candidate]
+    if not candidates:
+        return 0
+    checkpoint_id, first_event_id = max(candidates)
+    connection.execute("DELETE FROM mwan3_checkpoints WHERE id < ?", (checkpoint_id,))
+    return connection.execute(f"DELETE FROM {table} WHERE id < ?", (first_event_id,)).rowcount
+
+def _prune_age(connection, table, column, cutoff, max_rows):
+    if cutoff is None:
+        return 0
+    return connection.execute(f"DELETE FROM {table} WHERE {column} < ?", (cutoff,)).rowcount
+
+PRUNERS = {'rows': _prune_rows, 'events': _prune_events, 'transitions': _prune_transitions, 'age': _prune_age}
+
+# Retention, size cap and incremental vacuum for the collector databases.
+#
+# The databases live on router flash, so a run only writes when something is
+# due: DELETEs that match nothing write nothing, freed pages are handed back
+# in vacuum_pages steps per run instead of a full VACUUM, and a database is
+# cut further only while its live pages exceed max_bytes. Rows are dropped by
+# age and count whether or not they were exported (in dry-run or while Influx
+# is unreachable nothing else ever deletes them); dropped rows the exporter had
+# not reached yet are counted as unexported in the report.
+#
+# maintenance:
+#   interval: 3600            # seconds between runs in exporter_daemon
+#   max_age_days: 30
+#   max_rows: 500000          # per table
+#   max_bytes: 50000000       # per database file
+#   vacuum_pages: 256
+#   tables: {PingResults: {max_age_days: 7}}
+#   databases: {ping_path: {max_bytes: 20000000}}
+class Maintenance:
+    def __init__(self, config):
+        self.settings = config.get('maintenance') or {}
+        self.interval = self.settings.get('interval', DEFAULT_INTERVAL)
+        self.vacuum_pages = self.settings.get('vacuum_pages', DEFAULT_VACUUM_PAGES)
+        # Several config keys may point at the same file
+        self.databases = {}
+        for key, path in (config.get('sqlite') or {}).items():
+            if key in TABLES:
+                self.databases.setdefault(path, []).append(key)
+        self._next_run = 0.0
+
+    def _policy(self, table):
+        options = (self.settings.get('tables') or {}).get(table) or {}
+        return (options.get('max_age_days', self.settings.get('max_age_days', DEFAULT_MAX_AGE_DAYS)),
+                options.get('max_rows', self.settings.get('max_rows')))
+
+    def _max_bytes(self, keys):
+        databases = self.settings.get('databases') or {}
+        caps = [databases[key]['max_bytes'] for key in keys if (databases.get(key) or {}).get('max_bytes')]
+        return min(caps) if caps else self.settings.get('max_bytes')
+
+    def _prune(self, connection, spec, cutoff, max_rows, report):
+        table, column, _, strategy = spec
+        # Exported tables: rows above the cursor have not reached Influx yet
+        export_cursor = pending = last_rowid = None
+        if strategy in ('rows', 'events'):
+            export_cursor = _export_cursor(connection, table) or 0
+            pending = connection.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (export_cursor,)).fetchone()[0]
+            last_rowid = connection.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+        deleted = PRUNERS[strategy](connection, table, column, cutoff, max_rows)
+        if not deleted:
+            return 0
+        report['rows_deleted'][table] = report['rows_deleted'].get(table, 0) + deleted
+        if pending is not None:
+            report['unexported_dropped'] += pending - connection.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (export_cursor,)).fetchone()[0]
+            # An emptied table would hand out its rowids again. With the cursor past every
+            # deleted row, new rows are numbered above anything an exporter still in flight
+            # may acknowledge
+            if connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+                advance_cursor(connection, table, last_rowid)
+        return deleted
+
+    # Drop the oldest rows of the largest table until the live pages fit under max_bytes
+    def _enforce_cap(self, connection, specs, max_bytes, report):
+        for _ in range(_MAX_CAP_STEPS):
+            if _used_bytes(connection) <= max_bytes:
+                return
+            sizes = [(connection.execute(f"SELECT COUNT(*) FROM {spec[0]}").fetchone()[0], spec)
+                     for spec in specs if spec[3] != 'age']
+            count, spec = max(sizes, default=(0, None), key=lambda size: size[0])
+            with connection:
+                if not count or not self._prune(connection, spec, None, int(count * (1 - CAP_STEP)), report):
+                    break
+        logging.warning(f"Database is over its {max_bytes} byte cap and nothing more can be pruned.")
+
+    def _vacuum(self, connection, pages):
+        if _pragma(connection, 'auto_vacuum') != 2:
+            # Incremental vacuum needs the mode set and one full rewrite to take effect
+            logging.info("Switching database to incremental auto_vacuum (one-time full VACUUM).")
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("VACUUM")
+        elif _pragma(connection, 'freelist_count'):
+            # The pragma frees one page per step and execute() only steps a row-less statement
+            # once, so it goes through executescript, which runs it to completion
+            connection.executescript(f"PRAGMA incremental_vacuum({pages or 0});")
+        if _pragma(connection, 'journal_mode') == 'wal':
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    def maintain(self, db_path, keys, now=None):
+        now = now or time.time()
+        report = {'database': db_path, 'rows_deleted': {}, 'unexported_dropped': 0,
+                  'bytes_before': _file_bytes(db_path)}
+        connection = sqlite3.connect(db_path, timeout=30)
+        try:
+            specs = [spec for key in keys for spec in TABLES[key] if _table_exists(connection, spec[0])]
+            with connection:
+                for spec in specs:
+                    max_age_days, max_rows = self._policy(spec[0])
+                    cutoff = None
+                    if max_age_days:
+                        cutoff = now - max_age_days * 86400
+                        if spec[2] == 'text':
+                            cutoff = datetime.datetime.fromtimestamp(cutoff, datetime.timezone.utc).strftime(TIME_FORMAT)
+                        elif spec[2] == 'local':
+                            cutoff = format_time(datetime.datetime.fromtimestamp(cutoff))
+                    self._prune(connection, spec, cutoff, max_rows, report)
+            max_bytes = self._max_bytes(keys)
+            if max_bytes:
+                self._enforce_cap(connection, specs, max_bytes, report)
+            # Over the cap every free page goes back at once; otherwise in small steps
+            over_cap = max_bytes and _file_bytes(db_path) > max_bytes
+            self._vacuum(connection, None if over_cap else self.vacuum_pages)
+            report['freelist_pages'] = _pragma(connection, 'freelist_count')
+        finally:
+            connection.close()
+        report['bytes_after'] = _file_bytes(db_path)
+        report['bytes_reclaimed'] = max(0, report['bytes_before'] - report['bytes_after'])
+        for table, deleted in report['rows_deleted'].items():
+            telemetry.count('maintenance_rows_deleted', deleted, table=table)
+        telemetry.count('maintenance_bytes_reclaimed', report['bytes_reclaimed'], database=os.path.basename(db_path))
+        return report
+
+    def run(self):
+        reports = []
+        for db_path, keys in self.databases.items():
+            if not os.path.exists(db_path):
+                continue
+            try:
+                with telemetry.timer('maintenance_seconds', database=os.path.basename(db_path)):
+                    report = self.maintain(db_path, keys)
+            except sqlite3.Error:
+                logging.error(f"Maintenance of {db_path} failed", exc_info=True)
+                continue
+            if report['unexported_dropped']:
+                logging.warning(f"Retention dropped {report['unexported_dropped']} rows of {db_path} "
+                                f"that were never exported.")
+            logging.info(f"Maintained {db_path}: deleted {sum(report['rows_deleted'].values())} rows, "
+                         f"reclaimed {report['bytes_reclaimed']} bytes, {report['bytes_after']} bytes on disk.")
+            reports.append(report)
+        return reports
+
+    # For long-running scripts: run at most once per interval
+    def run_if_due(self):
+        if time.monotonic() >= self._next_run:
+            self._next_run = time.monotonic() + self.interval
+            return self.run()
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply retention and reclaim space in the collector databases')
+    parser.add_argument('--once', action='store_true', help='Run once and exit')
+    parser.add_argument('--json', action='store_true', help='Print one JSON report per database')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config('config.yml')
+    telemetry.configure(config, job='maintenance')
+    maintenance = Maintenance(config)
+    while True:
+        for report in maintenance.run():
+            if args.json:
+                print(json.dumps(report), flush=True)
+        telemetry.publish()
+        if args.once:
+            break
+        time.sleep(maintenance.interval)
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,208 @@
+import asyncio
 import subprocess
 import re
+import time
+import telemetry
+from dataclasses import dataclass, field
+
+@dataclass(slots=True)
+class InterfaceStatus:
+    name: str
+    state: str
+    online_time: str = ""
+    uptime: str = ""
+    tracking: str = ""
+
+    @property
+    def is_online(self):
+        return self.state == "online"
+
+@dataclass(slots=True)
+class PolicyMember:
+    interface: str
+    # Share of traffic in percent; None for entries such as "unreachable" or "default"
+    percent: int = None
+
+@dataclass(slots=True)
+class Policy:
+    name: str
+    members: list = field(default_factory=list)
+
+@dataclass(slots=True)
+class Network:
+    prefix: str
+
+@dataclass(slots=True)
+class Rule:
+    packets: str
+    bytes: str
+    sticky: bool
+    policy: str
+    protocol: str
+    source: str
+    destination: str
+    options: str = ""
+
+@dataclass(slots=True)
+class Mwan3Status:
+    interfaces: dict = field(default_factory=dict)
+    ipv4_policies: dict = field(default_factory=dict)
+    ipv6_policies: dict = field(default_factory=dict)
+    ipv4_networks: list = field(default_factory=list)
+    ipv6_networks: list = field(default_factory=list)
+    ipv4_rules: list = field(default_factory=list)
+    ipv6_rules: list = field(default_factory=list)
+
+_INTERFACE_RE = re.compile(r'interface (\S+) is (\S+)(?: (\d+h:\d+m:\d+s))?(?:, uptime (\S+))?(?: and tracking is (\S+))?')
+_MEMBER_RE = re.compile(r'(\S+) \((\d+)%\)')
+
+# Section headers of `mwan3 status` mapped to the Mwan3Status attribute they fill
+_SECTIONS = {
+    "Interface status:": "interfaces",
+    "Current ipv4 policies:": "ipv4_policies",
+    "Current ipv6 policies:": "ipv6_policies",
+    "Directly connected ipv4 networks:": "ipv4_networks",
+    "Directly connected ipv6 networks:": "ipv6_networks",
+    "Active ipv4 user rules:": "ipv4_rules",
+    "Active ipv6 user rules:": "ipv6_rules",
+}
+
+def _parse_rule(line):
+    # iptables -v columns: pkts bytes [S|-] target prot opt in out source destination [options]
+    parts = line.split(None, 10)
+    if len(parts) < 10:
+        return None
+    return Rule(packets=parts[0], bytes=parts[1], sticky=parts[2] == "S", policy=parts[3],
+                protocol=parts[4], source=parts[8], destination=parts[9],
+                options=parts[10].strip() if len(parts) > 10 else "")
+
+# Parse `mwan3 status` output in one pass over its lines. Sections are recognised
+# by their headers rather than their position, so missing, reordered or unknown
+# sections and stray lines are skipped instead of raising.
+def parse_status(raw_output):
+    status = Mwan3Status()
+    section = None
+    target = None
+    policy = None
+    for line in raw_output.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if not line[0].isspace() and stripped.endswith(":"):
+            name = _SECTIONS.get(stripped)
+            if name is not None:
+                section = name
+                target = getattr(status, name)
+                policy = None
+                continue
+            if " " in stripped:
+                # A header this parser does not know about; ignore its body
+                section = target = policy = None
+                continue
+            if section == "ipv4_policies" or section == "ipv6_policies":
+                policy = target[stripped[:-1]] = Policy(stripped[:-1])
+                continue
+
+        if section == "interfaces":
+            match = _INTERFACE_RE.match(stripped)
+            if match:
+                name, state, online_time, uptime, tracking = match.groups()
+                target[name] = InterfaceStatus(name, state, online_time or "", uptime or "", tracking or "")
+        elif section == "ipv4_policies" or section == "ipv6_policies":
+            if policy is not None:
+                match = _MEMBER_RE.fullmatch(stripped)
+                if match:
+                    policy.members.append(PolicyMember(match.group(1), int(match.group(2))))
+                else:
+                    policy.members.append(PolicyMember(stripped))
+        elif section == "ipv4_networks" or section == "ipv6_networks":
+            target.append(Network(stripped))
+        elif section == "ipv4_rules" or section == "ipv6_rules":
+            rule = _parse_rule(stripped)
+            if rule is not None:
+                target.append(rule)
+    return status
 
 class Mwan3Wrapper:
-    def __init__(self):
+    def __init__(self, status_ttl=2.0, timeout=10):
         self.mwan3_command = "mwan3"
+        # Callers within status_ttl seconds of each other share one parsed snapshot
+        self.status_ttl = status_ttl
+        self.timeout = timeout
+        self._status = None
+        self._status_time = 0.0
+        self._status_inflight = None
 
+    # A failing mwan3 raises CalledProcessError rather than handing its stderr to
+    # the parser, which would read it as a status without any interfaces
     def _run_command(self, command):
-        try:
+        with telemetry.timer('mwan3_command_seconds', command=command):
             result = subprocess.run([self.mwan3_command] + command.split(),
-                                    capture_output=True, text=True, check=True)
-            return result.stdout
-        except subprocess.CalledProcessError as e:
-            return e.stderr
+                                    capture_output=True, text=True, check=True, timeout=self.timeout)
+        return result.stdout
+
+    async def _run_command_async(self, command):
+        with telemetry.timer('mwan3_command_seconds', command=command):
+            return await self._communicate(command)
+
+    async def _communicate(self, command):
+        process = await asyncio.create_subprocess_exec(self.mwan3_command, *command.split(),
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, [self.mwan3_command] + command.split(),
+                                                stdout.decode(), stderr.decode())
+        return stdout.decode()
+
+    def _cached_status(self):
+        if self._status is not None and time.monotonic() - self._status_time < self.status_ttl:
+            return self._status
+        return None
+
+    def _store_status(self, status):
+        self._status = status
+        self._status_time = time.monotonic()
+        return status
 
     def status(self):
+        cached = self._cached_status()
+        if cached is not None:
+            return cached
         raw_output = self._run_command("status")
-        return self._parse_status(raw_output)
+        return self._store_status(self._parse_status(raw_output))
+
+    # Concurrent callers await the same in-flight `mwan3 status` instead of spawning their own
+    async def status_async(self):
+        cached = self._cached_status()
+        if cached is not None:
+            return cached
+        if self._status_inflight is None:
+            self._status_inflight = asyncio.ensure_future(self._refresh_status_async())
+        return await asyncio.shield(self._status_inflight)
+
+    async def _refresh_status_async(self):
+        try:
+            raw_output = await self._run_command_async("status")
+            return self._store_status(self._parse_status(raw_output))
+        finally:
+            self._status_inflight = None
+
+    # Map each interface name to whether mwan3 reports it online
+    def interface_states(self, status=None):
+        if status is None:
+            status = self.status()
+        return {name: interface.is_online for name, interface in status.interfaces.items()}
+
+    async def interface_states_async(self):
+        return self.interface_states(await self.status_async())
 
     def _parse_status(self, raw_output):
-        sections = raw_output.split("\n\n")
-        status_dict = {
-            "interfaces": self._parse_interface_status(sections[0]),
-            "Current ipv4 policies": self._parse_policies(sections[1]),
-            "Current ipv6 policies": self._parse_policies(sections[2]),
-            "Directly connected ipv4 networks": self._parse_networks(sections[3]),
-            "Directly connected ipv6 networks": self._parse_networks(sections[4]),
-            "Active ipv4 user rules": self._parse_rules(sections[5]),
-            "Active ipv6 user rules": self._parse_rules(sections[6])
-        }
-        return status_dict
-
-    def _parse_interface_status(self, section):
-        status_lines = section.split("\n")[1:]  # Skip the first line (title)
-        interface_status = {}
-        for line in status_lines:
-            parts = re.split(r' is |\, ', line)
-            interface_name = parts[0].strip()
-            online_status = parts[1].strip() if len(parts) > 1 else ""
-            time_online = parts[2].strip() if len(parts) > 2 else ""
-            uptime = parts[3].strip() if len(parts) > 3 else ""
-            tracking_status = parts[4].strip() if len(parts) > 4 else ""
-
-            interface_status[interface_name] = {
-                "online_status": online_status,
-                "time_online": time_online,
-                "uptime": uptime,
-                "tracking_status": tracking_status
-            }
-        return interface_status
-
-    def _parse_policies(self, section):
-        lines = section.split("\n")[1:]  # Skip the first line (title)
-        policies = {}
-        current_policy = None
-        for line in lines:
-            if line.endswith(":"):
-                current_policy = line[:-1]
-                policies[current_policy] = []
-            else:
-                policies[current_policy].append(line.strip())
-        return policies
-
-    def _parse_networks(self, section):
-        return section.split("\n")[1:]  # Skip the first line (title)
-
-    def _parse_rules(self, section):
-        return section.split("\n")[1:]  # Skip the first line (title)
+        with telemetry.timer('mwan3_parse_seconds'):
+            return parse_status(raw_output)
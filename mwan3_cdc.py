@@ -0,0 +1,226 @@
+import argparse
+import datetime
+import logging
+import sqlite3
+import time
+from config_loader import load_config
+from mwan3 import Mwan3Wrapper
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_POLL_INTERVAL = 10
+DEFAULT_CHECKPOINT_INTERVAL = 24 * 60 * 60
+
+# Value of keys whose presence is the whole state (networks, rules, members without a weight)
+PRESENT = 'present'
+
+def _rule_item(rule):
+    text = f"{rule.protocol} {rule.source} -> {rule.destination}"
+    if rule.options:
+        text += f" {rule.options}"
+    return text + (" sticky" if rule.sticky else "")
+
+# Reduce a Mwan3Status to {(entity, family, name, item): value} with only the
+# structural state: uptimes and packet/byte counters change on every poll and
+# are left out, so equal snapshots mean nothing worth publishing happened.
+def flatten_status(status):
+    flat = {}
+    for name, interface in status.interfaces.items():
+        flat[('interface', None, name, 'state')] = interface.state
+        flat[('interface', None, name, 'tracking')] = interface.tracking or PRESENT
+    for family, policies in (('ipv4', status.ipv4_policies), ('ipv6', status.ipv6_policies)):
+        for name, policy in policies.items():
+            for member in policy.members:
+                flat[('policy', family, name, member.interface)] = \
+                    str(member.percent) if member.percent is not None else PRESENT
+    for family, networks in (('ipv4', status.ipv4_networks), ('ipv6', status.ipv6_networks)):
+        for network in networks:
+            flat[('network', family, network.prefix, None)] = PRESENT
+    for family, rules in (('ipv4', status.ipv4_rules), ('ipv6', status.ipv6_rules)):
+        seen = {}
+        for rule in rules:
+            # Identical rules may repeat; number the copies so each one is its own key
+            item = _rule_item(rule)
+            occurrence = seen[(rule.policy, item)] = seen.get((rule.policy, item), 0) + 1
+            if occurrence > 1:
+                item += f" #{occurrence}"
+            flat[('rule', family, rule.policy, item)] = PRESENT
+    return flat
+
+# Structural delta between two flattened snapshots as (key, change, old, new)
+def diff_snapshots(previous, current):
+    events = []
+    for key, value in current.items():
+        old = previous.get(key)
+        if old is None:
+            events.append((key, 'added', None, value))
+        elif old != value:
+            events.append((key, 'changed', old, value))
+    for key, old in previous.items():
+        if key not in current:
+            events.append((key, 'removed', old, None))
+    return events
+
+def _format_time(moment):
+    return moment.strftime(TIME_FORMAT)
+
+# Change log of mwan3's structural state in SQLite.
+#
+# mwan3_snapshot holds the last seen state, so each poll is diffed against it
+# and only changed keys are written. Every change becomes one mwan3_events row,
+# the table mwan3_changes.py exports to Influx. Every checkpoint_interval a
+# full copy of the state is appended to mwan3_events as 'checkpoint' rows and
+# indexed in mwan3_checkpoints, so the state at any time can be rebuilt from
+# the nearest checkpoint before it plus the events after it, in SQLite or from
+# the same rows in Influx.
+class Mwan3ChangeLog:
+    def __init__(self, db_path, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, timeout=10):
+        self.checkpoint_interval = checkpoint_interval
+        # The stored snapshot, read once and then kept in step with every write
+        self._state = None
+        self.connection = sqlite3.connect(db_path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS mwan3_snapshot ("
+                                    "entity TEXT NOT NULL, "
+                                    "family TEXT NOT NULL, "
+                                    "name TEXT NOT NULL, "
+                                    "item TEXT NOT NULL, "
+                                    "value TEXT NOT NULL, "
+                                    "PRIMARY KEY (entity, family, name, item)) WITHOUT ROWID")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS mwan3_events ("
+                                    "id INTEGER PRIMARY KEY, "
+                                    "event_time TEXT NOT NULL, "
+                                    "entity TEXT NOT NULL, "
+                                    "family TEXT, "
+                                    "name TEXT NOT NULL, "
+                                    "item TEXT, "
+                                    "change TEXT NOT NULL, "
+                                    "old_value TEXT, "
+                                    "new_value TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS mwan3_checkpoints ("
+                                    "id INTEGER PRIMARY KEY, "
+                                    "event_time TEXT NOT NULL, "
+                                    "first_event_id INTEGER NOT NULL, "
+                                    "last_event_id INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS mwan3_checkpoints_by_time "
+                                    "ON mwan3_checkpoints (event_time)")
+
+    # SQLite primary keys treat NULLs as distinct, so the snapshot stores them as ''
+    def snapshot(self):
+        return {(entity, family or None, name, item or None): value for entity, family, name, item, value in
+                self.connection.execute("SELECT entity, family, name, item, value FROM mwan3_snapshot")}
+
+    def _last_checkpoint_time(self):
+        row = self.connection.execute("SELECT MAX(event_time) FROM mwan3_checkpoints").fetchone()
+        return datetime.datetime.strptime(row[0], TIME_FORMAT) if row[0] else None
+
+    def _append_events(self, event_time, events):
+        self.connection.executemany(
+            "INSERT INTO mwan3_events (event_time, entity, family, name, item, change, old_value, new_value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(event_time, *key, change, old, new) for key, change, old, new in events])
+
+    # Diff a Mwan3Status against the stored state and record the changes.
+    # Returns the number of change events written (checkpoint rows not included).
+    #
+    # mwan3 always lists its interfaces, so a status without any is output that
+    # failed to parse rather than a real state; recording it would mark every key
+    # removed and the next good poll would add them all back.
+    def record(self, status, now=None):
+        if not status.interfaces:
+            logging.warning("Ignoring an mwan3 status without interfaces.")
+            return 0
+        now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        current = flatten_status(status)
+        if self._state is None:
+            self._state = self.snapshot()
+        previous = self._state
+        events = diff_snapshots(previous, current)
+        last_checkpoint = self._last_checkpoint_time()
+        checkpoint_due = last_checkpoint is None or \
+            (now - last_checkpoint).total_seconds() >= self.checkpoint_interval
+        if not events and not checkpoint_due:
+            return 0
+
+        event_time = _format_time(now)
+        with self.connection:
+            if events:
+                # The very first state is fully described by its checkpoint
+                if previous or not checkpoint_due:
+                    self._append_events(event_time, events)
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO mwan3_snapshot (entity, family, name, item, value) VALUES (?, ?, ?, ?, ?)",
+                    [(entity, family or '', name, item or '', new)
+                     for (entity, family, name, item), change, old, new in events if change != 'removed'])
+                self.connection.executemany(
+                    "DELETE FROM mwan3_snapshot WHERE entity = ? AND family = ? AND name = ? AND item = ?",
+                    [(entity, family or '', name, item or '')
+                     for (entity, family, name, item), change, old, new in events if change == 'removed'])
+            if checkpoint_due:
+                self._checkpoint(event_time, current)
+        self._state = current
+        return len(events)
+
+    def _checkpoint(self, event_time, state):
+        events = [(key, 'checkpoint', None, value) for key, value in sorted(
+            state.items(), key=lambda item: tuple(part or '' for part in item[0]))]
+        self._append_events(event_time, events)
+        # Read back after the insert: the export cursor's trigger may number the rows above it
+        last_event_id = self.connection.execute("SELECT MAX(id) FROM mwan3_events").fetchone()[0] or 0
+        first_event_id = last_event_id - len(events) + 1
+        self.connection.execute("INSERT INTO mwan3_checkpoints (event_time, first_event_id, last_event_id) "
+                                "VALUES (?, ?, ?)", (event_time, first_event_id, last_event_id))
+
+    # Rebuild the flattened state as of a UTC datetime (default: now) from the
+    # latest checkpoint at or before it and the change events that follow it
+    def reconstruct(self, at=None):
+        at_text = _format_time(at) if at else '9999-12-31 23:59:59'
+        checkpoint = self.connection.execute(
+            "SELECT first_event_id, last_event_id FROM mwan3_checkpoints WHERE event_time <= ? "
+            "ORDER BY event_time DESC, id DESC LIMIT 1", (at_text,)).fetchone()
+        if checkpoint is None:
+            return None
+        state = {}
+        rows = self.connection.execute(
+            "SELECT entity, family, name, item, change, new_value FROM mwan3_events "
+            "WHERE id >= ? AND event_time <= ? ORDER BY id", (checkpoint[0], at_text))
+        for entity, family, name, item, change, new in rows:
+            key = (entity, family, name, item)
+            if change == 'removed':
+                state.pop(key, None)
+            else:
+                state[key] = new
+        return state
+
+    def close(self):
+        self.connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Record mwan3 policy, rule and interface changes')
+    parser.add_argument('--once', action='store_true', help='Record one snapshot and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config('config.yml')
+    cdc_config = config.get('mwan3_cdc') or {}
+    poll_interval = cdc_config.get('poll_interval', DEFAULT_POLL_INTERVAL)
+    change_log = Mwan3ChangeLog(config['sqlite']['mwan3_path'],
+                                checkpoint_interval=cdc_config.get('checkpoint_interval', DEFAULT_CHECKPOINT_INTERVAL))
+    mwan3 = Mwan3Wrapper(status_ttl=0)
+    try:
+        while True:
+            try:
+                changes = change_log.record(mwan3.status())
+                if changes:
+                    logging.info(f"Recorded {changes} mwan3 changes.")
+            except Exception:
+                logging.error("Error recording mwan3 status", exc_info=True)
+            if args.once:
+                break
+            time.sleep(poll_interval)
+    finally:
+        change_log.close()
+
+if __name__ == "__main__":
+    main()
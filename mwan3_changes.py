@@ -0,0 +1,54 @@
+import logging
+import telemetry
+from line_protocol import LineProtocolSerializer
+from config_loader import EXPORTER_SCHEMA, load_config
+from exporter import DEFAULT_CHUNK_SIZE, BatchWriter, ExportSource, acknowledge_rows, fetch_chunks, open_write_api
+
+config = load_config('config.yml', EXPORTER_SCHEMA)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+def fetch_data(chunk_size=DEFAULT_CHUNK_SIZE, after_rowid=None):
+    return fetch_chunks(config['sqlite']['mwan3_path'], "mwan3_events", chunk_size, after_rowid)
+
+# One point per change or checkpoint row written by mwan3_cdc.py
+def serializer_for(location_name):
+    return LineProtocolSerializer("mwan3_changes",
+                                  constant_tags={"location_name": location_name},
+                                  row_tags={"entity": 2, "family": 3, "name": 4, "item": 5, "change": 6},
+                                  fields=[("old_value", 7, None), ("new_value", 8, None), ("event_id", 0, None)],
+                                  time_index=1)
+
+line_protocol = serializer_for(config['location_name'])
+
+def format_data_as_line_protocol(rows):
+    payload = line_protocol.serialize(rows)
+    return [payload] if payload else []
+
+# Events are kept after upload: mwan3_cdc.py rebuilds past states from them
+def clear_database(last_rowid):
+    return acknowledge_rows(config['sqlite']['mwan3_path'], "mwan3_events", last_rowid, retain=True)
+
+source = ExportSource("mwan3_changes", fetch_data, format_data_as_line_protocol, clear_database, interval=60)
+
+def main():
+    dry_run = config['dry_run']
+    chunk_size = config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    telemetry.configure(config, job='mwan3_changes')
+
+    with open_write_api(config) as write_api:
+        writer = BatchWriter(write_api, config['influx_db']['bucket'], batch_size=chunk_size, dry_run=dry_run)
+        total = source.poll(writer, chunk_size)
+        writer.flush()
+        telemetry.publish(writer)
+        writer.flush()
+
+    if total:
+        if not dry_run:
+            logging.info(f"mwan3 changes uploaded to InfluxDB. Rows: {total}")
+    else:
+        logging.info("No new data to upload.")
+
+if __name__ == "__main__":
+    main()
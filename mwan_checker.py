@@ -1,19 +1,16 @@
-import sqlite3
 import datetime
 import logging
-import yaml
 import asyncio
-from kasa import SmartStrip
+import sqlite3
 import time
-
-# Load configuration from YAML file
-def load_config(file_path):
-    print("Loading configuration file.")
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
+import plugctl
+import telemetry
+from config_loader import MWAN_SCHEMA, load_config
+from health import HealthEngine
+from state_store import StateStore
 
 print("Loading configuration file.")
-config = load_config('/root/ctrl-guardsman-beryl/config.yml')
+config = load_config('/root/ctrl-guardsman-beryl/config.yml', MWAN_SCHEMA)
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -22,99 +19,102 @@ logging.basicConfig(level=logging.DEBUG)
 db_path = config['sqlite']['mwan3_path']
 print(f"Database path set to {db_path}")
 
+# One connection to the shared state store for the whole run
+store = StateStore(db_path)
+
 # Function to check if an interface has been offline for more than five minutes
-def check_interface_offline(interface_name):
+def check_interface_offline(interface_name, state):
     print(f"Checking if interface {interface_name} has been offline for more than five minutes.")
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-
-    cursor.execute("SELECT last_online_time FROM mwan3_status WHERE interface_name = ?", (interface_name,))
-    result = cursor.fetchone()
-    cursor.close()
-    connection.close()
-
-    if result and result[0]:
-        last_online_time = datetime.datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S.%f')
+    if state and state.last_online_time:
         now = datetime.datetime.now()
-        offline_duration = now - last_online_time
+        offline_duration = now - state.last_online_time
         is_offline = offline_duration.total_seconds() > 300
         print(f"Interface {interface_name} offline status: {is_offline}")
         return is_offline
     print(f"No last online time found for interface {interface_name}")
     return False
 
-def get_last_power_cycle_time(interface_name):
+# Link health over the recent PingResults history, when config.yml has a health section
+def load_health(states):
+    health = HealthEngine(config)
+    try:
+        health.tail()
+    except sqlite3.Error as e:
+        print(f"Could not read ping results for link health: {e}")
+    health.add_status({name: state.is_online for name, state in states.items()})
+    health.evaluate(time.time())
+    return health
+
+def get_last_power_cycle_time(interface_name, state):
     print(f"Fetching last power cycle time for interface {interface_name}.")
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
+    return state.last_power_cycle_time if state else None
 
-    cursor.execute("SELECT last_power_cycle_time FROM mwan3_status WHERE interface_name = ?", (interface_name,))
-    result = cursor.fetchone()
-    cursor.close()
-    connection.close()
-
-    if result and result[0]:
-        return datetime.datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S.%f')
-    return None
+# One controller for the whole process: a kept-alive connection and a short-lived state cache per strip
+controller = plugctl.from_config(config)
 
 async def toggle_plug(ip_address, plug_alias, turn_off):
     print(f"Toggling plug {plug_alias} at {ip_address}. Turn off: {turn_off}")
-    strip = SmartStrip(ip_address)
-
-    try:
-        await strip.update()
-        for plug in strip.children:
-            if plug.alias == plug_alias:
-                if turn_off:
-                    await plug.turn_off()
-                    print(f"Plug '{plug_alias}' turned OFF.")
-                else:
-                    await plug.turn_on()
-                    print(f"Plug '{plug_alias}' turned ON.")
-                return
-    except Exception as e:
-        print(f"Error connecting to the power strip at {ip_address}: {e}")
+    error = (await controller.set_state([(ip_address, plug_alias)], not turn_off))[ip_address]
+    if error is not None:
+        print(f"Error connecting to the power strip at {ip_address}: {error}")
+    else:
+        print(f"Plug '{plug_alias}' turned {'OFF' if turn_off else 'ON'}.")
+
+# Turn a socket off and back on without blocking the event loop
+async def cycle_socket(ip_address, plug_alias, off_time=5):
+    await cycle_sockets(ip_address, [plug_alias], off_time)
+
+# Power cycle several sockets of the strip together: one request off, one wait, one request on
+async def cycle_sockets(ip_address, plug_aliases, off_time=5):
+    print(f"Power cycling plugs {', '.join(plug_aliases)} at {ip_address}")
+    error = (await controller.power_cycle([(ip_address, alias) for alias in plug_aliases], off_time))[ip_address]
+    if error is not None:
+        print(f"Error connecting to the power strip at {ip_address}: {error}")
 
 def update_last_power_cycle_time(interface_name):
     print(f"Updating last power cycle time for interface {interface_name}.")
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-
-    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
-    cursor.execute("UPDATE mwan3_status SET last_power_cycle_time = ? WHERE interface_name = ?",
-                   (now, interface_name))
-
-    connection.commit()
-    cursor.close()
-    connection.close()
-
+    store.record_power_cycle(interface_name)
 
-async def power_cycle_plug(ip_address, plug_alias, interface_name):
-    print(f"Power cycling plug {plug_alias} at {ip_address}")
-    await toggle_plug(ip_address, plug_alias, turn_off=True)
-    time.sleep(5)
-    await toggle_plug(ip_address, plug_alias, turn_off=False)
-    update_last_power_cycle_time(interface_name)
 
 # Main routine
 async def main():
+    telemetry.configure(config, job='mwan_checker')
+
+    # Read every interface's state in a single query
+    states = store.load_states()
+    health = load_health(states) if config.get('health') else None
+
+    # Every interface due for a power cycle is cycled in one batch
+    cycles = {}
     for interface in config['interfaces']:
         interface_name = interface['name']
         plug_alias = interface['smartplug_alias']
+        state = states.get(interface_name)
 
-        if check_interface_offline(interface_name):
-            last_power_cycle_time = get_last_power_cycle_time(interface_name)
+        unhealthy = health is not None and health.should_power_cycle(interface_name, time.time())
+        if unhealthy:
+            print(f"Interface {interface_name} link health has been below {health.cycle_below} for {health.hold} seconds.")
+
+        if check_interface_offline(interface_name, state) or unhealthy:
+            last_power_cycle_time = get_last_power_cycle_time(interface_name, state)
             now = datetime.datetime.now()
 
             if last_power_cycle_time and (now - last_power_cycle_time).total_seconds() < 1200:  # 1200 seconds = 20 minutes
                 print(f"Interface {interface_name} was power cycled less than 20 minutes ago. Skipping power cycle.")
                 continue
 
-            print(f"Interface {interface_name} has been offline for more than five minutes. Power cycling plug {plug_alias}.")
-            await power_cycle_plug(config['smart_plug']['ip'], plug_alias, interface_name)
+            print(f"Interface {interface_name} is offline or unhealthy. Power cycling plug {plug_alias}.")
+            cycles[interface_name] = plug_alias
         else:
             print(f"Interface {interface_name} is online or no data available.")
 
+    if cycles:
+        await cycle_sockets(config['smart_plug']['ip'], list(cycles.values()))
+        for interface_name in cycles:
+            update_last_power_cycle_time(interface_name)
+    await controller.close()
+    telemetry.publish()
+
 if __name__ == "__main__":
     print("Starting main routine.")
     asyncio.run(main())
@@ -1,87 +1,50 @@
-import sqlite3
-import subprocess
-import datetime
-import yaml
 import logging
+import subprocess
+import sys
+import telemetry
+from config_loader import MWAN_SCHEMA, load_config
+from mwan3 import Mwan3Wrapper
+from state_store import StateStore
 
-# Load configuration from YAML file
-def load_config(file_path):
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
-
-config = load_config('/root/ctrl-guardsman-beryl/config.yml')
+config = load_config('/root/ctrl-guardsman-beryl/config.yml', MWAN_SCHEMA)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
+telemetry.configure(config, job='mwan_monitor')
+
 # Database configuration
 db_path = config['sqlite']['mwan3_path']
 
 # Function to parse interface status
 def parse_interface_status():
-    result = subprocess.run(['mwan3', 'interfaces'], capture_output=True, text=True)
-    lines = result.stdout.split('\n')
-    status_dict = {}
-    for line in lines:
-        if 'interface' in line:
-            parts = line.split()
-            interface_name = parts[1].replace('is', '').strip()
-            is_online = 'online' in line
-            status_dict[interface_name] = is_online
-    return status_dict
+    return Mwan3Wrapper().interface_states()
 
 # Function to update database
-def update_database(interface_name, is_online):
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-
-    # Create or update the table structure
-    cursor.execute("CREATE TABLE IF NOT EXISTS mwan3_status ("
-                   "interface_name TEXT PRIMARY KEY, "
-                   "is_online INTEGER, "
-                   "last_online_time TEXT, "
-                   "last_checked_time TEXT, "
-                   "last_power_cycle_time TEXT)")
-
-    now = datetime.datetime.now()
-
-    cursor.execute("SELECT last_online_time, last_power_cycle_time FROM mwan3_status WHERE interface_name = ?", (interface_name,))
-    record = cursor.fetchone()
-    last_online_time = record[0] if record else None
-    last_power_cycle_time = record[1] if record else None
-
-    if is_online:
-        cursor.execute("INSERT OR REPLACE INTO mwan3_status (interface_name, is_online, last_online_time, last_checked_time, last_power_cycle_time) "
-                       "VALUES (?, ?, ?, ?, ?)",
-                       (interface_name, is_online, now, now, last_power_cycle_time))
-    else:
-        cursor.execute("INSERT OR REPLACE INTO mwan3_status (interface_name, is_online, last_online_time, last_checked_time, last_power_cycle_time) "
-                       "VALUES (?, ?, ?, ?, ?)",
-                       (interface_name, is_online, last_online_time, now, last_power_cycle_time))
+def update_database(store, interface_statuses):
+    with telemetry.timer('state_store_write_seconds'):
+        store.record_tick(interface_statuses)
 
-    connection.commit()
-    cursor.close()
-    connection.close()
+store = StateStore(db_path)
 
-# Parse interface status
-interface_statuses = parse_interface_status()
+# Parse interface status; a failed mwan3 run says nothing about the interfaces, so record nothing
+try:
+    interface_statuses = parse_interface_status()
+except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+    logging.error(f"Could not read mwan3 status: {e} {getattr(e, 'stderr', '') or ''}".strip())
+    sys.exit(1)
 
-# Update database for each interface
-for interface, status in interface_statuses.items():
-    update_database(interface, status)
+# Update the database for every interface in one transaction
+update_database(store, interface_statuses)
 
 # Output a snapshot of the database
 def print_database_snapshot():
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM mwan3_status")
-    snapshot = cursor.fetchall()
     print("Database snapshot:")
-    for row in snapshot:
-        print(row)
-    cursor.close()
-    connection.close()
+    for state in store.load_states().values():
+        print(state)
 
 print_database_snapshot()
+store.close()
+telemetry.publish()
 
 print("Database updated successfully.")
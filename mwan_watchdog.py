@@ -0,0 +1,231 @@
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import sqlite3
+import stat
+import time
+import plugctl
+import telemetry
+from concurrent.futures import ThreadPoolExecutor
+from config_loader import MWAN_SCHEMA, load_config
+from health import HealthEngine
+from mwan3 import Mwan3Wrapper
+from state_store import InterfaceState, StateStore
+
+# Defaults used when config.yml leaves them out
+DEFAULT_OFFLINE_THRESHOLD = 300
+DEFAULT_POWER_CYCLE_COOLDOWN = 1200
+DEFAULT_POLL_INTERVAL = 10
+DEFAULT_FAST_POLL_INTERVAL = 1
+DEFAULT_FLAP_WINDOW = 120
+
+# Long-running replacement for the mwan_monitor + mwan_checker cron pair.
+#
+# Interface state is kept in memory and polled through Mwan3Wrapper, fast
+# while any interface has changed state within flap_window and slow otherwise.
+# Power cycles are started as soon as an interface crosses its offline
+# threshold, or, with a health section in config.yml, once its link health
+# score has stayed below health.cycle_below for health.hold seconds. State is
+# persisted to the shared StateStore in the background. A line written to the
+# hotplug FIFO or Unix socket (for example from /etc/mwan3.user) triggers an
+# immediate poll.
+class Watchdog:
+    def __init__(self, config):
+        watchdog_config = config.get('watchdog') or {}
+        self.db_path = config['sqlite']['mwan3_path']
+        self.strip_ip = config['smart_plug']['ip']
+        self.dry_run = config.get('dry_run', False)
+        self.interfaces = {interface['name']: interface for interface in config['interfaces']}
+        self.poll_interval = watchdog_config.get('poll_interval', DEFAULT_POLL_INTERVAL)
+        self.fast_poll_interval = watchdog_config.get('fast_poll_interval', DEFAULT_FAST_POLL_INTERVAL)
+        self.flap_window = watchdog_config.get('flap_window', DEFAULT_FLAP_WINDOW)
+        self.hotplug_fifo = watchdog_config.get('hotplug_fifo')
+        self.hotplug_socket = watchdog_config.get('hotplug_socket')
+
+        self.mwan3 = Mwan3Wrapper(status_ttl=0)
+        self.controller = plugctl.from_config(config)
+        self.health = HealthEngine(config) if config.get('health') else None
+        self.states = {}
+        self.last_transition = 0.0
+        self.power_cycling = set()
+        # Times of dry-run power cycles, kept only in memory so the cooldown still limits the logging
+        self.dry_run_cycles = {}
+        self._tasks = set()
+        self._wake = asyncio.Event()
+        self._dirty = asyncio.Event()
+        # SQLite connections are bound to their thread, so the store lives on one worker
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+        self._store = None
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _threshold(self, interface_name, key, default):
+        return self.interfaces.get(interface_name, {}).get(key, default)
+
+    async def _db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    async def poll(self):
+        try:
+            statuses = await self.mwan3.interface_states_async()
+        except Exception:
+            logging.error("Error polling mwan3 status", exc_info=True)
+            return
+
+        now = datetime.datetime.now()
+        for name, is_online in statuses.items():
+            state = self.states.get(name)
+            if state is None:
+                state = self.states[name] = InterfaceState(name, is_online)
+            elif state.is_online != is_online:
+                logging.info(f"Interface {name} went {'online' if is_online else 'offline'}.")
+                self.last_transition = time.monotonic()
+            state.is_online = is_online
+            state.last_checked_time = now
+            if is_online:
+                state.last_online_time = now
+        self._dirty.set()
+        if self.health is not None:
+            await self._update_health(statuses)
+
+        for name in self.interfaces:
+            if self._should_power_cycle(name, now):
+                self.power_cycling.add(name)
+                self._spawn(self._power_cycle(name))
+
+    async def _update_health(self, statuses):
+        self.health.add_status(statuses)
+        with telemetry.timer('health_update_seconds'):
+            try:
+                await self._db(self.health.tail)
+            except sqlite3.Error as e:
+                logging.warning(f"Could not read ping results for link health: {e}")
+            self.health.evaluate(time.time())
+
+    def _offline_too_long(self, name, state, now):
+        if state is None or state.is_online or not state.last_online_time:
+            return False
+        threshold = self._threshold(name, 'offline_threshold', DEFAULT_OFFLINE_THRESHOLD)
+        return (now - state.last_online_time).total_seconds() > threshold
+
+    def _should_power_cycle(self, name, now):
+        if name in self.power_cycling:
+            return False
+        state = self.states.get(name)
+        if not self._offline_too_long(name, state, now) and \
+                not (self.health is not None and self.health.should_power_cycle(name, time.time())):
+            return False
+        cooldown = self._threshold(name, 'power_cycle_cooldown', DEFAULT_POWER_CYCLE_COOLDOWN)
+        last_power_cycle_time = self.dry_run_cycles.get(name) if self.dry_run else state and state.last_power_cycle_time
+        if last_power_cycle_time and (now - last_power_cycle_time).total_seconds() < cooldown:
+            return False
+        return True
+
+    async def _power_cycle(self, name):
+        plug_alias = self.interfaces[name]['smartplug_alias']
+        try:
+            if self.health is None or self._offline_too_long(name, self.states.get(name), datetime.datetime.now()):
+                reason = "offline past its threshold"
+            else:
+                reason = f"link health below {self.health.cycle_below} for {self.health.hold}s"
+            # A dry run records nothing: no transition, no persisted cooldown and no health reset
+            if self.dry_run:
+                logging.info(f"Dry run: Would have power cycled plug {plug_alias} for interface {name} ({reason}).")
+                self.dry_run_cycles[name] = datetime.datetime.now()
+                return
+            logging.info(f"Interface {name} {reason}. Power cycling plug {plug_alias}.")
+            error = (await self.controller.power_cycle([(self.strip_ip, plug_alias)]))[self.strip_ip]
+            if error is not None:
+                logging.error(f"Error power cycling plug {plug_alias} at {self.strip_ip}: {error}")
+            now = datetime.datetime.now()
+            if self.health is not None:
+                self.health.power_cycled(name, time.time())
+            self.states.setdefault(name, InterfaceState(name, False)).last_power_cycle_time = now
+            await self._db(self._store.record_power_cycle, name, now, 'watchdog')
+            self._dirty.set()
+        finally:
+            self.power_cycling.discard(name)
+
+    # Write the in-memory states whenever they change, at most one write in flight
+    async def _persist_loop(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            states = [InterfaceState(s.interface_name, s.is_online, s.last_online_time,
+                                     s.last_checked_time, s.last_power_cycle_time) for s in self.states.values()]
+            try:
+                await self._db(self._store.save_states, states)
+            except Exception:
+                logging.error("Error persisting interface states", exc_info=True)
+
+    def _hotplug_event(self, message):
+        message = message.strip()
+        if message:
+            logging.info(f"Hotplug event: {message}")
+            self.last_transition = time.monotonic()
+            self._wake.set()
+
+    async def _listen_fifo(self, path):
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        elif not stat.S_ISFIFO(os.stat(path).st_mode):
+            raise ValueError(f"{path} exists and is not a FIFO")
+        # Opening read-write keeps the FIFO from reporting EOF between writers
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        buffer = b''
+
+        def on_readable():
+            nonlocal buffer
+            buffer += os.read(fd, 4096)
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                self._hotplug_event(line.decode(errors='replace'))
+
+        asyncio.get_running_loop().add_reader(fd, on_readable)
+
+    async def _listen_socket(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+
+        async def handle(reader, writer):
+            try:
+                async for line in reader:
+                    self._hotplug_event(line.decode(errors='replace'))
+            finally:
+                writer.close()
+
+        await asyncio.start_unix_server(handle, path=path)
+
+    def current_interval(self):
+        if time.monotonic() - self.last_transition < self.flap_window:
+            return self.fast_poll_interval
+        return self.poll_interval
+
+    async def run(self):
+        self._store = await self._db(StateStore, self.db_path)
+        self.states = await self._db(self._store.load_states)
+        self._spawn(self._persist_loop())
+        if self.hotplug_fifo:
+            await self._listen_fifo(self.hotplug_fifo)
+        if self.hotplug_socket:
+            await self._listen_socket(self.hotplug_socket)
+
+        while True:
+            await self.poll()
+            telemetry.publish_if_due()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.current_interval())
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    config = load_config('/root/ctrl-guardsman-beryl/config.yml', MWAN_SCHEMA)
+    telemetry.configure(config, job='mwan_watchdog')
+    asyncio.run(Watchdog(config).run())
@@ -1,12 +1,16 @@
 import sqlite3
 import datetime
-import json
 import logging
 import sys
 import argparse
-from kasa import SmartStrip
 import asyncio
-import subprocess
+import time
+import plugctl
+import telemetry
+from config_loader import OOKLA_SCHEMA, ConfigError, load_config
+from health import HealthEngine
+from mwan3 import Mwan3Wrapper
+from state_store import StateStore
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,147 +27,139 @@ logging.debug(f"Arguments parsed: {args}")
 logging.debug("Loading configuration file.")
 config_file_path = '/root/plug_script/config.json'
 try:
-    with open(config_file_path, 'r') as config_file:
-        config = json.load(config_file)
-        logging.debug(f"Configuration loaded: {config}")
-except FileNotFoundError:
-    logging.error(f"Configuration file not found at {config_file_path}")
+    config = load_config(config_file_path, OOKLA_SCHEMA)
+    logging.debug(f"Configuration loaded: {config}")
+except FileNotFoundError as e:
+    logging.error(f"Configuration file not found at {e.filename}")
+    sys.exit(1)
+except ConfigError as e:
+    logging.error(f"Invalid configuration: {e}")
     sys.exit(1)
 except Exception as e:
     logging.error("Unexpected error loading configuration file", exc_info=True)
     sys.exit(1)
 
-def check_internet_connection(interface):
+# One wrapper for the whole run so every interface check shares the same `mwan3 status` snapshot
+mwan3 = Mwan3Wrapper(timeout=10)
+
+# Strips are addressed by strip_ip, which may carry a port as host:port
+controller = plugctl.from_config(config)
+
+async def check_internet_connection(interface):
     logging.info(f"Checking internet connection for interface: {interface}")
     try:
         start_time = datetime.datetime.now()
-        result = subprocess.run(['mwan3', 'status'], capture_output=True, text=True, timeout=10)
+        states = await mwan3.interface_states_async()
         duration = (datetime.datetime.now() - start_time).total_seconds()
-        logging.info(f"Command executed in {duration} seconds. Return code: {result.returncode}")
-
-        if result.stdout:
-            logging.debug(f"Command stdout: {result.stdout}")
-        if result.stderr:
-            logging.debug(f"Command stderr: {result.stderr}")
-
-        if result.returncode != 0:
-            logging.error(f"mwan3 status command failed with exit code {result.returncode}")
-            return False
-    except subprocess.TimeoutExpired:
+        logging.info(f"mwan3 status snapshot obtained in {duration} seconds.")
+    except asyncio.TimeoutError:
         logging.warning(f"Command timed out after 10 seconds. Assuming interface {interface} is offline.")
         return False
     except Exception as e:
         logging.error("Error executing command", exc_info=True)
         return False
 
-    # Parse the command output to find the status of the specified interface
-    interface_status_line = next((line for line in result.stdout.split('\n') if line.strip().startswith(f"interface {interface} is")), None)
-    if interface_status_line:
-        is_online = "online" in interface_status_line
+    # Look up the status of the specified interface in the snapshot
+    if interface in states:
+        is_online = states[interface]
         logging.info(f"Interface {interface} is {'online' if is_online else 'offline'}.")
         return is_online
     else:
         logging.warning(f"Status of interface {interface} not found in mwan3 output.")
         return False
 
-async def power_cycle(strip_ip, socket_index):
-    logging.info(f"Initiating power cycle for socket {socket_index} on strip {strip_ip}.")
+# Link health over the recent PingResults history, when the config has a health section
+def load_health(online):
+    health = HealthEngine(config)
     try:
-        strip = SmartStrip(strip_ip)
-        logging.debug("Connecting to smart strip.")
-        await strip.update()  # Get the latest status
-        logging.debug(f"Strip status updated. Current status: {strip.is_on}")
-        socket = strip.children[socket_index]
-        logging.debug(f"Socket {socket_index} status: {socket.is_on}")
-        await socket.turn_off()
-        logging.info(f"Turned off socket {socket_index}.")
-        await asyncio.sleep(5)  # Wait for 5 seconds before turning back on
-        logging.info("Waiting 5 seconds before turning the socket back on.")
-        await socket.turn_on()
-        logging.info(f"Turned on socket {socket_index}. Power cycle complete.")
-    except Exception as e:
-        logging.error(f"Failed to power cycle socket {socket_index} on strip {strip_ip}", exc_info=True)
+        health.tail()
+    except sqlite3.Error as e:
+        logging.warning(f"Could not read ping results for link health: {e}")
+    health.add_status(online)
+    health.evaluate(time.time())
+    return health
+
+# Power cycle (strip_ip, socket_index) targets together: every socket of a strip is
+# switched in one request, strips are handled concurrently and the wait is shared
+async def power_cycle(targets):
+    for strip_ip, socket_index in targets:
+        logging.info(f"Initiating power cycle for socket {socket_index} on strip {strip_ip}.")
+    results = await controller.power_cycle(targets, off_time=5)
+    for strip_ip, error in results.items():
+        if error is not None:
+            logging.error(f"Failed to power cycle sockets on strip {strip_ip}", exc_info=error)
+        else:
+            logging.info(f"Power cycle of strip {strip_ip} complete.")
+    return results
 
-def main():
+async def main():
     logging.info("Starting main function of the script.")
+    telemetry.configure(config, job='ookla')
 
-    # Connect to SQLite database
+    # Open the shared state store
     db_file = '/root/plug_script/internet_status.db'
-    logging.debug(f"Attempting to connect to the database at {db_file}.")
+    logging.debug(f"Attempting to open the state store at {db_file}.")
     try:
-        conn = sqlite3.connect(db_file)
-        logging.info(f"Successfully connected to the database {db_file}.")
+        store = StateStore(db_file)
+        logging.info(f"Successfully opened the state store {db_file}.")
     except sqlite3.Error as e:
-        logging.error(f"Error connecting to the database {db_file}", exc_info=True)
+        logging.error(f"Error opening the state store {db_file}", exc_info=True)
         sys.exit(1)
 
-    c = conn.cursor()
+    # Read the previous state of every interface in a single query
+    states = store.load_states()
+    logging.info(f"Retrieved {len(states)} interfaces from the database.")
 
-    # Create table if it doesn't exist
-    logging.debug("Creating table 'status' if it doesn't exist.")
-    try:
-        c.execute('''CREATE TABLE IF NOT EXISTS status
-               (interface TEXT PRIMARY KEY, strip_ip TEXT, socket_index INTEGER, last_online DATETIME, last_checked DATETIME)''')
-        logging.info("Table 'status' checked/created successfully.")
-    except Exception as e:
-        logging.error("Error creating/checking table 'status'", exc_info=True)
-        conn.close()
-        sys.exit(1)
+    # Check every interface concurrently; they all share a single mwan3 invocation
+    interfaces = config['interfaces']
+    online_states = await asyncio.gather(*(check_internet_connection(interface) for interface in interfaces))
+    online = dict(zip(interfaces, online_states))
 
-    # Insert or update configuration data
-    logging.debug("Inserting/updating configuration data into the database.")
-    for interface, details in config['interfaces'].items():
-        try:
-            c.execute("INSERT OR REPLACE INTO status (interface, strip_ip, socket_index) VALUES (?, ?, ?)",
-                  (interface, details['strip_ip'], details['socket_index']))
-            logging.info(f"Inserted/updated data for interface: {interface}")
-        except Exception as e:
-            logging.error(f"Error inserting/updating data for interface: {interface}", exc_info=True)
-
-    conn.commit()
+    # Record the whole tick in one transaction
+    store.record_tick(online)
     logging.debug("Database changes committed.")
 
-    # Check the status of each interface
-    logging.debug("Checking the status of each interface.")
-    try:
-        c.execute("SELECT interface, strip_ip, socket_index, last_online, last_checked FROM status")
-        interfaces = c.fetchall()
-        logging.info(f"Retrieved {len(interfaces)} interfaces from the database.")
-    except Exception as e:
-        logging.error("Error retrieving interface data", exc_info=True)
-        conn.close()
-        sys.exit(1)
+    health = load_health(online) if config.get('health') else None
 
-    for interface, strip_ip, socket_index, last_online, last_checked in interfaces:
+    cycles = {}
+    for interface, details in interfaces.items():
         logging.info(f"Processing interface: {interface}")
-        is_online = check_internet_connection(interface)
-
-        if is_online:
-            logging.debug(f"Interface {interface} is online. Updating last online time.")
-            c.execute("UPDATE status SET last_online = ?, last_checked = ? WHERE interface = ?",
-                  (datetime.datetime.now(), datetime.datetime.now(), interface))
-        else:
-            logging.debug(f"Interface {interface} is offline. Updating last checked time.")
-            c.execute("UPDATE status SET last_checked = ? WHERE interface = ?",
-                  (datetime.datetime.now(), interface))
-            logging.debug(f"Last online time: {last_online}")
-            if last_online and (datetime.datetime.now() - datetime.datetime.fromisoformat(last_online)).total_seconds() > 300:
-                if not args.dry_run:
-                    logging.info(f"Initiating power cycle for interface: {interface}")
-                    asyncio.run(power_cycle(strip_ip, socket_index))
-                else:
-                    logging.info(f"Dry run: Would have power cycled socket {socket_index} on strip {strip_ip}.")
-
-    conn.commit()
-    logging.info("Final database changes committed.")
-    conn.close()
+        state = states.get(interface)
+        now = datetime.datetime.now()
+        # A link that stays up but keeps failing its pings is cycled too, unless it was
+        # cycled less than 20 minutes ago and may still be coming back
+        unhealthy = health is not None and health.should_power_cycle(interface, time.time())
+        if unhealthy and state and state.last_power_cycle_time and \
+                (now - state.last_power_cycle_time).total_seconds() < 1200:
+            logging.info(f"Interface {interface} was power cycled less than 20 minutes ago. Ignoring its link health.")
+            unhealthy = False
+        if unhealthy:
+            logging.info(f"Interface {interface} link health has been below {health.cycle_below} for {health.hold} seconds.")
+        elif online[interface]:
+            continue
+
+        strip_ip, socket_index = details['strip_ip'], details['socket_index']
+        last_online = state.last_online_time if state else None
+        logging.debug(f"Interface {interface} is {'online' if online[interface] else 'offline'}. "
+                      f"Last online time: {last_online}")
+        if unhealthy or (last_online and (now - last_online).total_seconds() > 300):
+            if not args.dry_run:
+                logging.info(f"Initiating power cycle for interface: {interface}")
+                cycles[interface] = (strip_ip, socket_index)
+            else:
+                logging.info(f"Dry run: Would have power cycled socket {socket_index} on strip {strip_ip}.")
+
+    if cycles:
+        await power_cycle(list(cycles.values()))
+        await controller.close()
+        for interface in cycles:
+            store.record_power_cycle(interface, cause='ookla')
+
+    store.close()
     logging.info("Database connection closed.")
+    telemetry.publish()
     logging.info("Script execution completed.")
 
 if __name__ == "__main__":
-    main()
-
-
-if __name__ == "__main__":
-  main()
+    asyncio.run(main())
 
@@ -1,29 +1,22 @@
-import sqlite3
-import yaml
 import logging
 from datetime import datetime
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+import telemetry
+from archive import ArchiveTable, archive_writer
+from line_protocol import LineProtocolSerializer
+from aggregation import aggregate_ping_rows, closed_window_chunks
+from config_loader import EXPORTER_SCHEMA, load_config
+from exporter import DEFAULT_CHUNK_SIZE, BatchWriter, ExportSource, acknowledge_rows, fetch_chunks, open_write_api
 
-# Load configuration from YAML file
-def load_config(file_path):
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
-
-config = load_config('config.yml')
+config = load_config('config.yml', EXPORTER_SCHEMA)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-def fetch_data():
-    connection = sqlite3.connect(config['sqlite']['ping_path'])
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM PingResults")
-    rows = cursor.fetchall()
-    connection.close()
-    return rows
+def fetch_data(chunk_size=DEFAULT_CHUNK_SIZE, after_rowid=None):
+    return fetch_chunks(config['sqlite']['ping_path'], "PingResults", chunk_size, after_rowid)
 
 def format_data_for_influx(rows):
+    from influxdb_client import Point
     influx_data = []
     for row in rows:
         point = Point("ping_metrics") \
@@ -37,32 +30,79 @@ def format_data_for_influx(rows):
         influx_data.append(point)
     return influx_data
 
-def upload_to_influx(data):
-    with InfluxDBClient(url=config['influx_db']['url'],
-                        token=config['influx_db']['token'],
-                        org=config['influx_db']['org']) as client:
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-        write_api.write(bucket=config['influx_db']['bucket'], record=data)
+# Line protocol serializer producing the same bytes as format_data_for_influx() for a site
+def serializer_for(location_name):
+    return LineProtocolSerializer("ping_metrics",
+                                  constant_tags={"location_name": location_name},
+                                  row_tags={"server_ip": 1},
+                                  fields=[("min_latency", 3, float), ("max_latency", 4, float),
+                                          ("avg_latency", 5, float), ("success_rate", 6, float)],
+                                  time_index=7)
+
+line_protocol = serializer_for(config['location_name'])
+
+# Uploaded rows also go to the local archive when config.yml has an archive section
+archive_table = ArchiveTable("ping_metrics", tags={"server_ip": 1, "interface": 2},
+                             fields={"min_latency": 3, "max_latency": 4, "avg_latency": 5, "success_rate": 6},
+                             time_index=7)
+
+def format_data_as_line_protocol(rows):
+    payload = line_protocol.serialize(rows)
+    return [payload] if payload else []
+
+# Optional windowed pre-aggregation, configured per measurement in config.yml
+aggregation_config = (config.get('aggregation') or {}).get('ping_metrics')
+if aggregation_config:
+    aggregation_window = aggregation_config.get('window', 60)
+    aggregation_percentiles = aggregation_config.get('percentiles', [50, 95, 99])
+    aggregated_line_protocol = LineProtocolSerializer(
+        aggregation_config.get('measurement', 'ping_metrics'),
+        constant_tags={"location_name": config['location_name']},
+        row_tags={"server_ip": 0},
+        fields=[("min_latency", 2, None), ("max_latency", 3, None), ("avg_latency", 4, None),
+                ("success_rate", 5, None), ("samples", 6, None)] +
+               [(f"p{p}_latency", 7 + i, None) for i, p in enumerate(aggregation_percentiles)],
+        time_index=1)
 
-def clear_database():
-    connection = sqlite3.connect(config['sqlite']['iperf_path'])
-    cursor = connection.cursor()
-    cursor.execute("DELETE FROM PingResults")
-    connection.commit()
-    connection.close()
+def fetch_closed_windows(chunk_size=DEFAULT_CHUNK_SIZE, after_rowid=None):
+    return closed_window_chunks(fetch_data(chunk_size, after_rowid), aggregation_window,
+                                grace=aggregation_config.get('grace', 30))
+
+def format_aggregated_data(rows):
+    payload = aggregated_line_protocol.serialize(aggregate_ping_rows(rows, aggregation_window, aggregation_percentiles))
+    return [payload] if payload else []
+
+def clear_database(last_rowid):
+    return acknowledge_rows(config['sqlite']['ping_path'], "PingResults", last_rowid,
+                            retain=config.get('retain_exported_rows', False))
+
+def select_formatter():
+    if aggregation_config:
+        return format_aggregated_data
+    if config.get('serializer', 'point') == 'line_protocol':
+        return format_data_as_line_protocol
+    return format_data_for_influx
+
+source = ExportSource("ping", fetch_closed_windows if aggregation_config else fetch_data,
+                      select_formatter(), clear_database, interval=60,
+                      archive=archive_writer(config, archive_table))
 
 def main():
     dry_run = config['dry_run']
+    chunk_size = config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    telemetry.configure(config, job='ping')
+
+    # Stream unacknowledged rows chunk by chunk, acknowledging each one once it is uploaded or spooled
+    with open_write_api(config) as write_api:
+        writer = BatchWriter(write_api, config['influx_db']['bucket'], batch_size=chunk_size, dry_run=dry_run)
+        total = source.poll(writer, chunk_size)
+        writer.flush()
+        telemetry.publish(writer)
+        writer.flush()
 
-    rows = fetch_data()
-    if rows:
-        influx_data = format_data_for_influx(rows)
+    if total:
         if not dry_run:
-            upload_to_influx(influx_data)
-            clear_database()
-            logging.info("Data uploaded to InfluxDB.")
-        else:
-            logging.info(f"Dry run: Data prepared for upload: {influx_data}")
+            logging.info(f"Data uploaded to InfluxDB. Rows: {total}")
     else:
         logging.info("No new data to upload.")
 
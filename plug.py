@@ -1,35 +1,22 @@
 import asyncio
-from kasa import SmartStrip
 import argparse
+from plugctl import PlugController
 
 async def toggle_plug(ip_address, plug_alias):
-    # Create a SmartStrip object with the specified IP address
-    strip = SmartStrip(ip_address)
+    controller = PlugController()
+    print(f"Searching for plug '{plug_alias}' on Power Strip at {ip_address}...")
 
-    try:
-        # Request the latest status
-        await strip.update()
-        print(f"Searching for plug '{plug_alias}' on Power Strip at {ip_address}...")
-
-        # Find the plug by alias and toggle its state
-        for plug in strip.children:
-            if plug.alias == plug_alias:
-                if plug.is_on:
-                    await plug.turn_off()
-                    print(f" - Plug '{plug_alias}' turned OFF.")
-                else:
-                    await plug.turn_on()
-                    print(f" - Plug '{plug_alias}' turned ON.")
-                return
-        else:
-            print(f"No plug found with alias '{plug_alias}'.")
-
-    except Exception as e:
-        print(f"Error connecting to the power strip at {ip_address}: {e}")
+    # Read the socket's state and flip it
+    result = (await controller.toggle([(ip_address, plug_alias)]))[ip_address]
+    await controller.close()
+    if isinstance(result, Exception):
+        print(f"Error connecting to the power strip at {ip_address}: {result}")
+    else:
+        print(f" - Plug '{plug_alias}' turned {'ON' if result[plug_alias] else 'OFF'}.")
 
 # Set up argument parser
 parser = argparse.ArgumentParser(description="Toggle a plug on a Kasa SmartStrip.")
-parser.add_argument("ip_address", type=str, help="IP address of the Kasa SmartStrip")
+parser.add_argument("ip_address", type=str, help="IP address of the Kasa SmartStrip, optionally as host:port")
 parser.add_argument("plug_alias", type=str, help="Alias of the plug to toggle")
 
 # Parse arguments
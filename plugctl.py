@@ -0,0 +1,201 @@
+import asyncio
+import time
+from kasa import Credentials, Device, DeviceConfig, Discover, KasaException
+from kasa.iot import IotStrip
+import telemetry
+
+DEFAULT_PORT = 9999
+DEFAULT_TIMEOUT = 5
+DEFAULT_STATE_TTL = 2.0
+
+class PlugError(Exception):
+    pass
+
+def _check(response, module, method):
+    result = response.get(module, {}).get(method)
+    if not isinstance(result, dict) or result.get('err_code', 0) != 0:
+        raise PlugError(f"{module}.{method} failed: {result}")
+    return result
+
+# A power strip's sockets, addressed by alias or by index, through python-kasa.
+# The device is connected once and kept; its state is refreshed at most every
+# state_ttl seconds. On legacy (port 9999) strips any number of sockets are
+# switched to the same state in one set_relay_state request.
+class Strip:
+    def __init__(self, host, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT, state_ttl=DEFAULT_STATE_TTL,
+                 credentials=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.state_ttl = state_ttl
+        self.credentials = credentials
+        self._device = None
+        self._updated = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        config = DeviceConfig(self.host, timeout=self.timeout, port_override=self.port, credentials=self.credentials)
+        try:
+            # Legacy firmware answers on port 9999 without discovery
+            return await Device.connect(config=config)
+        except KasaException:
+            # Newer firmware (KLAP, Tapo) announces its transport only through discovery
+            device = await Discover.discover_single(self.host, discovery_timeout=self.timeout, timeout=self.timeout,
+                                                    credentials=self.credentials)
+            if device is None:
+                raise
+            await device.update()
+            return device
+
+    async def device(self, refresh=False):
+        async with self._lock:
+            try:
+                if self._device is None:
+                    with telemetry.timer('kasa_seconds', op='connect'):
+                        self._device = await self._connect()
+                    self._updated = time.monotonic()
+                elif refresh or time.monotonic() - self._updated >= self.state_ttl:
+                    with telemetry.timer('kasa_seconds', op='update'):
+                        # Legacy sockets read alias and state from the strip's sysinfo, so
+                        # their per-socket module queries are skipped
+                        await self._device.update(update_children=not isinstance(self._device, IotStrip))
+                    self._updated = time.monotonic()
+            except (KasaException, OSError, asyncio.TimeoutError) as e:
+                raise PlugError(f"Strip {self.host}:{self.port} did not answer: {e!r}") from e
+            return self._device
+
+    # The strip's sockets as python-kasa child devices
+    async def children(self, refresh=False):
+        return (await self.device(refresh)).children
+
+    def _find(self, children, socket):
+        if isinstance(socket, int):
+            return children[socket] if 0 <= socket < len(children) else None
+        return next((child for child in children if child.alias == socket), None)
+
+    async def resolve(self, sockets):
+        children = await self.children()
+        found = [self._find(children, socket) for socket in sockets]
+        if None in found:
+            # An alias may have been renamed since the last update
+            children = await self.children(refresh=True)
+            found = [self._find(children, socket) for socket in sockets]
+        missing = [socket for socket, child in zip(sockets, found) if child is None]
+        if missing:
+            raise PlugError(f"No socket {', '.join(map(repr, missing))} on strip {self.host}")
+        return found
+
+    async def switch(self, children, on):
+        with telemetry.timer('kasa_seconds', op='turn_on' if on else 'turn_off'):
+            try:
+                if isinstance(self._device, IotStrip):
+                    # python-kasa sends one request per socket; context.child_ids switches them together
+                    request = {"context": {"child_ids": [child.child_id for child in children]},
+                               "system": {"set_relay_state": {"state": int(on)}}}
+                    _check(await self._device.protocol.query(request), 'system', 'set_relay_state')
+                else:
+                    await asyncio.gather(*(child.set_state(on) for child in children))
+            except (KasaException, OSError, asyncio.TimeoutError) as e:
+                raise PlugError(f"Switching sockets on strip {self.host} failed: {e!r}") from e
+            finally:
+                # The cached relay states are stale either way
+                self._updated = 0.0
+
+    async def set_state(self, sockets, on):
+        await self.switch(await self.resolve(sockets), on)
+
+    async def states(self, sockets):
+        return [child.is_on for child in await self.resolve(sockets)]
+
+    async def close(self):
+        if self._device is not None:
+            await self._device.disconnect()
+        self._device = None
+
+# Plug control shared by plug.py, mwan_checker and ookla.py. Targets are
+# (host, socket) pairs; operations are grouped per strip, strips are handled
+# concurrently, and the sockets of one strip are switched in a single request.
+class PlugController:
+    def __init__(self, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT, state_ttl=DEFAULT_STATE_TTL,
+                 username=None, password=None):
+        self.port = port
+        self.timeout = timeout
+        self.state_ttl = state_ttl
+        # KLAP and Tapo firmware needs the TP-Link cloud account
+        self.credentials = Credentials(username, password) if username else None
+        self._strips = {}
+        # Overlapping power cycles of the same socket are serialized
+        self._socket_locks = {}
+
+    def strip(self, host):
+        if host not in self._strips:
+            host_name, _, port = host.partition(':')
+            self._strips[host] = Strip(host_name, int(port) if port else self.port, self.timeout, self.state_ttl,
+                                      self.credentials)
+        return self._strips[host]
+
+    @staticmethod
+    def _group(targets):
+        groups = {}
+        for host, socket in targets:
+            sockets = groups.setdefault(host, [])
+            if socket not in sockets:
+                sockets.append(socket)
+        return groups
+
+    # Switch every target on or off; returns {host: None or the exception raised}
+    async def set_state(self, targets, on):
+        groups = self._group(targets)
+        results = await asyncio.gather(*(self.strip(host).set_state(sockets, on) for host, sockets in groups.items()),
+                                       return_exceptions=True)
+        return dict(zip(groups, results))
+
+    async def turn_off(self, targets):
+        return await self.set_state(targets, False)
+
+    async def turn_on(self, targets):
+        return await self.set_state(targets, True)
+
+    # Flip each target's current state, as plug.py does for a single socket
+    async def toggle(self, targets):
+        async def toggle_strip(host, sockets):
+            strip = self.strip(host)
+            children = await strip.resolve(sockets)
+            states = [child.is_on for child in children]
+            # At most two requests per strip: one for the sockets going off, one for those going on
+            for on in (False, True):
+                group = [child for child, state in zip(children, states) if state != on]
+                if group:
+                    await strip.switch(group, on)
+            return {socket: not state for socket, state in zip(sockets, states)}
+
+        groups = self._group(targets)
+        results = await asyncio.gather(*(toggle_strip(host, sockets) for host, sockets in groups.items()),
+                                       return_exceptions=True)
+        return dict(zip(groups, results))
+
+    # Turn all targets off, wait off_time once, and turn them back on
+    async def power_cycle(self, targets, off_time=5):
+        keys = sorted(set(targets), key=repr)
+        locks = [self._socket_locks.setdefault(key, asyncio.Lock()) for key in keys]
+        for lock in locks:
+            await lock.acquire()
+        try:
+            off = await self.turn_off(keys)
+            await asyncio.sleep(off_time)
+            # Sockets that could not be switched off are left alone
+            on = await self.turn_on([(host, socket) for host, socket in keys if off[host] is None])
+            return {host: off[host] if off[host] is not None else on.get(host) for host in off}
+        finally:
+            for lock in locks:
+                lock.release()
+
+    async def close(self):
+        await asyncio.gather(*(strip.close() for strip in self._strips.values()), return_exceptions=True)
+        self._strips.clear()
+
+# A controller for the smart_plug section of the config
+def from_config(config):
+    smart_plug = config.get('smart_plug', {})
+    return PlugController(port=smart_plug.get('port', DEFAULT_PORT), username=smart_plug.get('username'),
+                          password=smart_plug.get('password'))
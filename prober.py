@@ -0,0 +1,278 @@
+import asyncio
+import datetime
+import ipaddress
+import itertools
+import logging
+import os
+import socket
+import sqlite3
+import struct
+import time
+from config_loader import load_config
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTOCOL = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+UDP_PROBE_PORT = 33434
+SOL_RAW = 255
+ICMP_FILTER = 1
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+def _family(address):
+    return socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET
+
+# Create a non-blocking socket bound to a WAN's device and/or source address
+def _bound_socket(family, type, proto, device=None, source=None):
+    sock = socket.socket(family, type, proto)
+    try:
+        sock.setblocking(False)
+        if device:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, device.encode() + b'\0')
+        if source:
+            sock.bind((source, 0))
+        return sock
+    except Exception:
+        sock.close()
+        raise
+
+# An interface's source address for one address family; "source" may list one
+# IPv4 and one IPv6 address
+def _source(interface, family):
+    sources = interface.get('source') or []
+    if isinstance(sources, str):
+        sources = [sources]
+    return next((source for source in sources if _family(source) == family), None)
+
+# Spaces probes to one target at least 1/rate seconds apart, across all interfaces
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}
+
+    async def wait(self, target):
+        now = time.monotonic()
+        start = max(now, self._next.get(target, now))
+        self._next[target] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+# Echo requests for every target of one interface share one ICMP socket; replies
+# are matched to their probe by the sequence number and a per-probe token.
+class IcmpPinger:
+    def __init__(self, family, device=None, source=None):
+        self.family = family
+        self.identifier = os.getpid() & 0xffff
+        self._sequence = itertools.count()
+        self._waiters = {}
+        proto = ICMP_PROTOCOL[family]
+        try:
+            # Unprivileged "ping socket"; allowed by net.ipv4.ping_group_range
+            self.sock = _bound_socket(family, socket.SOCK_DGRAM, proto, device, source)
+            self.raw = False
+        except PermissionError:
+            self.sock = _bound_socket(family, socket.SOCK_RAW, proto, device, source)
+            self.raw = True
+            # A raw socket receives a copy of all ICMP traffic; drop everything but echo replies
+            if family == socket.AF_INET:
+                self.sock.setsockopt(SOL_RAW, ICMP_FILTER, struct.pack('I', ~(1 << ICMP_ECHO_REPLY[family]) & 0xffffffff))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if self.raw and self.family == socket.AF_INET:
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < 16 or data[0] != ICMP_ECHO_REPLY[self.family]:
+                continue
+            identifier, sequence = struct.unpack('!HH', data[4:8])
+            if self.raw and identifier != self.identifier:
+                continue
+            waiter = self._waiters.pop((sequence, data[8:16]), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter())
+
+    async def probe(self, target, timeout):
+        sequence = next(self._sequence) & 0xffff
+        token = os.urandom(8)
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST[self.family], 0, 0, self.identifier, sequence)
+        if self.family == socket.AF_INET:
+            # The kernel fills in the checksum for ICMPv6 and for ping sockets
+            header = header[:2] + struct.pack('!H', _checksum(header + token)) + header[4:]
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[(sequence, token)] = waiter
+        try:
+            started = time.perf_counter()
+            self.sock.sendto(header + token, (target, 0))
+            return (await asyncio.wait_for(waiter, timeout) - started) * 1000
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self._waiters.pop((sequence, token), None)
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+
+# TCP connect round trip; a refused connection still proves the path is up
+async def tcp_probe(target, port, timeout, device=None, source=None):
+    loop = asyncio.get_running_loop()
+    sock = _bound_socket(_family(target), socket.SOCK_STREAM, 0, device, source)
+    try:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (target, port)), timeout)
+        except ConnectionRefusedError:
+            pass
+        return (time.perf_counter() - started) * 1000
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        sock.close()
+
+# UDP round trip to a closed high port, answered by an ICMP port unreachable
+async def udp_probe(target, port, timeout, device=None, source=None):
+    loop = asyncio.get_running_loop()
+    sock = _bound_socket(_family(target), socket.SOCK_DGRAM, 0, device, source)
+    try:
+        sock.connect((target, port))
+        started = time.perf_counter()
+        sock.send(b'guardsman')
+        try:
+            await asyncio.wait_for(loop.sock_recv(sock, 64), timeout)
+        except ConnectionRefusedError:
+            pass
+        return (time.perf_counter() - started) * 1000
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        sock.close()
+
+def summarize(server_ip, interface, latencies, when):
+    replies = [latency for latency in latencies if latency is not None]
+    success_rate = 100.0 * len(replies) / len(latencies)
+    if not replies:
+        return (server_ip, interface, 0.0, 0.0, 0.0, success_rate, when)
+    return (server_ip, interface, min(replies), max(replies), sum(replies) / len(replies), success_rate, when)
+
+# Probes every target through every WAN concurrently from one process and
+# batch-inserts one PingResults row per (target, interface) and round, in the
+# schema ping.py exports.
+class Prober:
+    def __init__(self, config):
+        prober_config = config['prober']
+        self.db_path = config['sqlite']['ping_path']
+        self.targets = prober_config['targets']
+        self.interfaces = prober_config['interfaces']
+        self.method = prober_config.get('method', 'icmp')
+        self.interval = prober_config.get('interval', 10)
+        self.count = prober_config.get('count', 5)
+        self.timeout = prober_config.get('timeout', 1.0)
+        self.port = prober_config.get('port', 443 if self.method == 'tcp' else UDP_PROBE_PORT)
+        self.flush_interval = prober_config.get('flush_interval', self.interval)
+        self.limiter = RateLimiter(prober_config.get('rate_limit', 10))
+        self._inflight = asyncio.Semaphore(prober_config.get('max_inflight', 256))
+        self._pingers = {}
+        self._results = []
+
+    def _pinger(self, interface, family):
+        key = (interface['name'], family)
+        if key not in self._pingers:
+            self._pingers[key] = IcmpPinger(family, interface.get('device'), _source(interface, family))
+        return self._pingers[key]
+
+    # Fall back to TCP connects when ICMP sockets are not permitted at all
+    def _select_method(self):
+        if self.method != 'icmp':
+            return
+        try:
+            for interface in self.interfaces:
+                for target in self.targets:
+                    self._pinger(interface, _family(target))
+        except PermissionError:
+            logging.warning("ICMP sockets are not permitted; falling back to TCP connect probes.")
+            for pinger in self._pingers.values():
+                pinger.close()
+            self._pingers.clear()
+            self.method = 'tcp'
+            self.port = 443
+
+    async def probe(self, interface, target):
+        await self.limiter.wait(target)
+        async with self._inflight:
+            if self.method == 'icmp':
+                return await self._pinger(interface, _family(target)).probe(target, self.timeout)
+            probe = tcp_probe if self.method == 'tcp' else udp_probe
+            return await probe(target, self.port, self.timeout, interface.get('device'),
+                               _source(interface, _family(target)))
+
+    async def _probe_round(self, interface, target):
+        when = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        latencies = [await self.probe(interface, target) for _ in range(self.count)]
+        self._results.append(summarize(target, interface['name'], latencies, when))
+
+    async def _probe_loop(self, interface, target):
+        while True:
+            started = time.monotonic()
+            try:
+                await self._probe_round(interface, target)
+            except Exception:
+                logging.error(f"Error probing {target} via {interface['name']}", exc_info=True)
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def _insert(self, rows):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS PingResults ("
+                                   "id INTEGER PRIMARY KEY, "
+                                   "server_ip TEXT, "
+                                   "interface TEXT, "
+                                   "min_latency REAL, "
+                                   "max_latency REAL, "
+                                   "avg_latency REAL, "
+                                   "success_rate REAL, "
+                                   "timestamp TEXT)")
+                connection.executemany("INSERT INTO PingResults (server_ip, interface, min_latency, max_latency, "
+                                       "avg_latency, success_rate, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            connection.close()
+
+    async def flush(self):
+        rows, self._results = self._results, []
+        if rows:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._insert, rows)
+            except Exception:
+                logging.error(f"Error inserting {len(rows)} ping results", exc_info=True)
+                self._results[:0] = rows
+
+    async def run(self):
+        self._select_method()
+        tasks = [asyncio.ensure_future(self._probe_loop(interface, target))
+                 for interface in self.interfaces for target in self.targets]
+        logging.info(f"Probing {len(self.targets)} targets on {len(self.interfaces)} interfaces using {self.method}.")
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.flush()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Prober(load_config('config.yml')).run())
@@ -0,0 +1,243 @@
+import gzip
+import http.client
+import logging
+import os
+import random
+import time
+import urllib.parse
+from config_loader import load_config
+
+BATCH_SUFFIX = '.lp.gz'
+REJECTED_SUFFIX = '.rejected'
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+STALE_TEMP_SECONDS = 600
+
+class SpoolSendError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Append-only directory of gzip-compressed line protocol batches waiting to be
+# sent to InfluxDB. Batch names start with a nanosecond timestamp so sorting
+# them gives the order they were spooled in. When the directory grows past
+# max_bytes the oldest batches are dropped first.
+class Spool:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, compresslevel=6):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        os.makedirs(path, exist_ok=True)
+        self._remove_stale_temp_files()
+
+    def put(self, payload):
+        name = f"{time.time_ns():020d}-{os.getpid()}{BATCH_SUFFIX}"
+        temp_path = os.path.join(self.path, name + '.tmp')
+        with open(temp_path, 'wb') as file:
+            file.write(gzip.compress(payload, compresslevel=self.compresslevel, mtime=0))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, os.path.join(self.path, name))
+        self._fsync_directory()
+        self._enforce_limit()
+        return name
+
+    def batches(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(BATCH_SUFFIX))
+
+    def read(self, name):
+        with open(os.path.join(self.path, name), 'rb') as file:
+            return file.read()
+
+    def remove(self, name):
+        os.remove(os.path.join(self.path, name))
+
+    # Keep a batch the server refused as malformed out of the send queue for inspection
+    def reject(self, name):
+        os.replace(os.path.join(self.path, name), os.path.join(self.path, name + REJECTED_SUFFIX))
+
+    def size(self):
+        return sum(size for _, size in self._files())
+
+    def _files(self):
+        files = []
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(BATCH_SUFFIX) or name.endswith(REJECTED_SUFFIX):
+                try:
+                    files.append((name, os.path.getsize(os.path.join(self.path, name))))
+                except FileNotFoundError:
+                    pass
+        return files
+
+    def _enforce_limit(self):
+        files = self._files()
+        total = sum(size for _, size in files)
+        dropped = 0
+        for name, size in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            dropped += 1
+        if dropped:
+            logging.warning(f"Spool over {self.max_bytes} bytes, dropped {dropped} oldest batches.")
+
+    # Partially written batches left behind by a crash are never valid. Every
+    # exporter shares the directory, so a temp file is only removed once it is
+    # too old to belong to a put() still in progress in another process.
+    def _remove_stale_temp_files(self):
+        cutoff = time.time() - STALE_TEMP_SECONDS
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                temp_path = os.path.join(self.path, name)
+                try:
+                    if os.path.getmtime(temp_path) < cutoff:
+                        os.remove(temp_path)
+                except FileNotFoundError:
+                    pass
+
+    def _fsync_directory(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+# Stands in for an influxdb_client write API: records are serialized to line
+# protocol and spooled instead of sent, so a write returns as soon as the batch
+# is on disk. The bucket is fixed by the sender's configuration.
+class SpoolWriter:
+    def __init__(self, spool):
+        self.spool = spool
+
+    def write(self, bucket, record, **kwargs):
+        lines = []
+        for item in record:
+            if isinstance(item, bytes):
+                line = item
+            elif isinstance(item, str):
+                line = item.encode('utf-8')
+            else:
+                line = item.to_line_protocol().encode('utf-8')
+            if line:
+                lines.append(line)
+        if lines:
+            self.spool.put(b'\n'.join(lines))
+
+# Drains a spool into InfluxDB over one keep-alive HTTP connection. A batch is
+# removed only after the server acknowledges it; failures back off exponentially.
+class SpoolSender:
+    def __init__(self, spool, influx_config, timeout=30, initial_backoff=1, max_backoff=300):
+        self.spool = spool
+        url = urllib.parse.urlsplit(influx_config['url'])
+        self._scheme = url.scheme
+        self._netloc = url.netloc
+        self._write_path = (url.path.rstrip('/') + '/api/v2/write?' +
+                            urllib.parse.urlencode({'org': influx_config['org'],
+                                                    'bucket': influx_config['bucket'],
+                                                    'precision': 'ns'}))
+        self._headers = {'Authorization': f"Token {influx_config['token']}",
+                         'Content-Encoding': 'gzip',
+                         'Content-Type': 'text/plain; charset=utf-8'}
+        self.timeout = timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._connection = None
+
+    def _connect(self):
+        if self._scheme == 'https':
+            return http.client.HTTPSConnection(self._netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self._netloc, timeout=self.timeout)
+
+    # POST one gzip-compressed line protocol body, returning the response
+    def post(self, body):
+        if self._connection is None:
+            self._connection = self._connect()
+        try:
+            self._connection.request('POST', self._write_path, body=body, headers=self._headers)
+            response = self._connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise SpoolSendError(f"Error sending batch to InfluxDB: {e}") from e
+        if response.will_close:
+            self.close()
+        return response
+
+    # Send every spooled batch oldest first, returning how many were accepted.
+    # The writer's size limit may drop the oldest batches at any moment, so a
+    # batch that vanished between listing and reading or removing it is skipped.
+    def drain(self):
+        sent = 0
+        for name in self.spool.batches():
+            try:
+                body = self.spool.read(name)
+            except FileNotFoundError:
+                continue
+            response = self.post(body)
+            if 200 <= response.status < 300:
+                try:
+                    self.spool.remove(name)
+                except FileNotFoundError:
+                    pass
+                sent += 1
+            elif 400 <= response.status < 500 and response.status not in (408, 429):
+                logging.error(f"InfluxDB rejected batch {name} with status {response.status}, setting it aside.")
+                try:
+                    self.spool.reject(name)
+                except FileNotFoundError:
+                    pass
+            else:
+                retry_after = response.getheader('Retry-After')
+                raise SpoolSendError(f"InfluxDB returned status {response.status} for batch {name}",
+                                     retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return sent
+
+    def run(self, poll_interval=5):
+        delay = self.initial_backoff
+        while True:
+            try:
+                sent = self.drain()
+                if sent:
+                    logging.info(f"Sent {sent} spooled batches to InfluxDB.")
+                delay = self.initial_backoff
+                time.sleep(poll_interval)
+            except SpoolSendError as e:
+                wait = e.retry_after if e.retry_after is not None else delay * random.uniform(0.5, 1.0)
+                logging.warning(f"{e}; retrying in {wait:.1f}s")
+                time.sleep(wait)
+                delay = min(delay * 2, self.max_backoff)
+            except Exception:
+                # The sender runs as the only drain of the spool; it must outlive any one failure
+                wait = delay * random.uniform(0.5, 1.0)
+                logging.error(f"Draining the spool failed; retrying in {wait:.1f}s", exc_info=True)
+                self.close()
+                time.sleep(wait)
+                delay = min(delay * 2, self.max_backoff)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def open_spool(spool_config):
+    return Spool(spool_config['path'],
+                 max_bytes=spool_config.get('max_bytes', DEFAULT_MAX_BYTES),
+                 compresslevel=spool_config.get('compresslevel', 6))
+
+def make_sender(config):
+    spool_config = config['spool']
+    return SpoolSender(open_spool(spool_config), config['influx_db'],
+                       timeout=spool_config.get('timeout', 30),
+                       initial_backoff=spool_config.get('initial_backoff', 1),
+                       max_backoff=spool_config.get('max_backoff', 300))
+
+def main():
+    config = load_config('config.yml')
+    logging.basicConfig(level=logging.INFO)
+    make_sender(config).run(poll_interval=config['spool'].get('poll_interval', 5))
+
+if __name__ == "__main__":
+    main()
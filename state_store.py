@@ -0,0 +1,200 @@
+import datetime
+import sqlite3
+import time
+from dataclasses import dataclass
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Downtime rollup bucket sizes in seconds
+ROLLUP_PERIODS = {'hour': 3600, 'day': 86400}
+
+@dataclass(slots=True)
+class InterfaceState:
+    interface_name: str
+    is_online: bool
+    last_online_time: datetime.datetime = None
+    last_checked_time: datetime.datetime = None
+    last_power_cycle_time: datetime.datetime = None
+
+def format_time(value):
+    return value.strftime(TIME_FORMAT) if value is not None else None
+
+# Accepts both TIME_FORMAT and the whole-second form sqlite3's datetime adapter writes
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+# Interface state shared by mwan_monitor, mwan_checker and ookla.py.
+#
+# One connection per process in WAL mode, so the monitor and checker read and
+# write concurrently instead of failing with "database is locked", and
+# synchronous=NORMAL keeps fsyncs on router flash to checkpoints. All state is
+# read with one query and a whole tick is written in one transaction.
+class StateStore:
+    def __init__(self, db_path, timeout=10):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS mwan3_status ("
+                                    "interface_name TEXT PRIMARY KEY, "
+                                    "is_online INTEGER, "
+                                    "last_online_time TEXT, "
+                                    "last_checked_time TEXT, "
+                                    "last_power_cycle_time TEXT)")
+            # Append-only log of state changes and power cycles. Each row carries the
+            # interface's cumulative downtime and outage count at that moment, so the
+            # downtime inside any window is the difference of two indexed lookups.
+            self.connection.execute("CREATE TABLE IF NOT EXISTS interface_transitions ("
+                                    "id INTEGER PRIMARY KEY, "
+                                    "interface_name TEXT NOT NULL, "
+                                    "event TEXT NOT NULL, "
+                                    "event_time REAL NOT NULL, "
+                                    "is_online INTEGER NOT NULL, "
+                                    "cause TEXT, "
+                                    "downtime_total REAL NOT NULL, "
+                                    "outages_total INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS interface_transitions_by_time "
+                                    "ON interface_transitions (interface_name, event_time)")
+            # Downtime and outage counts per interface per hour and day, in UTC buckets
+            self.connection.execute("CREATE TABLE IF NOT EXISTS downtime_rollup ("
+                                    "interface_name TEXT NOT NULL, "
+                                    "period TEXT NOT NULL, "
+                                    "bucket_start INTEGER NOT NULL, "
+                                    "downtime REAL NOT NULL, "
+                                    "outages INTEGER NOT NULL, "
+                                    "PRIMARY KEY (interface_name, period, bucket_start)) WITHOUT ROWID")
+
+    def load_states(self):
+        rows = self.connection.execute("SELECT interface_name, is_online, last_online_time, "
+                                       "last_checked_time, last_power_cycle_time FROM mwan3_status").fetchall()
+        return {row[0]: InterfaceState(row[0], bool(row[1]), parse_time(row[2]), parse_time(row[3]), parse_time(row[4]))
+                for row in rows}
+
+    # Record one poll of every interface; statuses maps interface name to is_online
+    def record_tick(self, statuses, now=None):
+        now = now or datetime.datetime.now()
+        checked = format_time(now)
+        with self.connection:
+            self._record_changes(((name, is_online, now) for name, is_online in statuses.items()), cause='mwan3')
+            self.connection.executemany(
+                "INSERT INTO mwan3_status (interface_name, is_online, last_online_time, last_checked_time) "
+                "VALUES (?, ?, CASE WHEN ? THEN ? END, ?) "
+                "ON CONFLICT(interface_name) DO UPDATE SET "
+                "is_online = excluded.is_online, "
+                "last_online_time = CASE WHEN excluded.is_online THEN excluded.last_checked_time "
+                "ELSE mwan3_status.last_online_time END, "
+                "last_checked_time = excluded.last_checked_time",
+                [(name, int(is_online), int(is_online), checked, checked) for name, is_online in statuses.items()])
+
+    # Write full interface states, e.g. as kept in memory by the watchdog
+    def save_states(self, states):
+        with self.connection:
+            self._record_changes(((state.interface_name, state.is_online, state.last_checked_time or datetime.datetime.now())
+                                  for state in states), cause='mwan3')
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO mwan3_status (interface_name, is_online, last_online_time, "
+                "last_checked_time, last_power_cycle_time) VALUES (?, ?, ?, ?, ?)",
+                [(state.interface_name, int(state.is_online), format_time(state.last_online_time),
+                  format_time(state.last_checked_time), format_time(state.last_power_cycle_time))
+                 for state in states])
+
+    def record_power_cycle(self, interface_name, now=None, cause='mwan_checker'):
+        now = now or datetime.datetime.now()
+        with self.connection:
+            self.connection.execute("UPDATE mwan3_status SET last_power_cycle_time = ? WHERE interface_name = ?",
+                                    (format_time(now), interface_name))
+            last = self._last_transition(interface_name, now.timestamp())
+            self._append_transition(interface_name, 'power_cycle', now.timestamp(),
+                                    bool(last[1]) if last else False, cause, last)
+
+    # Log a transition for every interface whose state differs from the stored one
+    def _record_changes(self, observations, cause):
+        previous = dict(self.connection.execute("SELECT interface_name, is_online FROM mwan3_status").fetchall())
+        for name, is_online, when in observations:
+            if name not in previous:
+                event_cause = 'initial'
+            elif bool(previous[name]) != bool(is_online):
+                event_cause = cause
+            else:
+                continue
+            timestamp = when.timestamp()
+            last = self._last_transition(name, timestamp)
+            # Coming back right after a power cycle is credited to the power cycle
+            if is_online and last and last[3] == 'power_cycle':
+                event_cause = 'power_cycle'
+            self._append_transition(name, 'online' if is_online else 'offline', timestamp,
+                                    bool(is_online), event_cause, last)
+
+    def _last_transition(self, interface_name, before):
+        return self.connection.execute(
+            "SELECT event_time, is_online, downtime_total, event, outages_total FROM interface_transitions "
+            "WHERE interface_name = ? AND event_time <= ? ORDER BY event_time DESC, id DESC LIMIT 1",
+            (interface_name, before)).fetchone()
+
+    def _append_transition(self, interface_name, event, timestamp, is_online, cause, last):
+        downtime_total, outages_total = (last[2], last[4]) if last else (0.0, 0)
+        if last and not last[1]:
+            # The interface was offline since the previous event; roll that span up
+            downtime_total += max(0.0, timestamp - last[0])
+            self._add_downtime(interface_name, last[0], timestamp)
+        if event == 'offline':
+            outages_total += 1
+            self._add_outage(interface_name, timestamp)
+        self.connection.execute(
+            "INSERT INTO interface_transitions (interface_name, event, event_time, is_online, cause, "
+            "downtime_total, outages_total) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (interface_name, event, timestamp, int(is_online), cause, downtime_total, outages_total))
+
+    def _add_rollup(self, rows):
+        self.connection.executemany(
+            "INSERT INTO downtime_rollup (interface_name, period, bucket_start, downtime, outages) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(interface_name, period, bucket_start) DO UPDATE SET "
+            "downtime = downtime + excluded.downtime, outages = outages + excluded.outages", rows)
+
+    def _add_downtime(self, interface_name, start, end):
+        rows = []
+        for period, size in ROLLUP_PERIODS.items():
+            bucket = int(start // size) * size
+            while bucket < end:
+                rows.append((interface_name, period, bucket, min(end, bucket + size) - max(start, bucket), 0))
+                bucket += size
+        self._add_rollup(rows)
+
+    def _add_outage(self, interface_name, timestamp):
+        self._add_rollup([(interface_name, period, int(timestamp // size) * size, 0.0, 1)
+                          for period, size in ROLLUP_PERIODS.items()])
+
+    # Cumulative downtime and outage count of an interface at a unix timestamp
+    def _totals_at(self, interface_name, timestamp):
+        last = self._last_transition(interface_name, timestamp)
+        if last is None:
+            return 0.0, 0
+        event_time, is_online, downtime_total, _, outages_total = last
+        return downtime_total + (0.0 if is_online else timestamp - event_time), outages_total
+
+    # Downtime, outage count and availability of an interface between two datetimes,
+    # answered from two index lookups however long the window or history is
+    def availability(self, interface_name, start, end):
+        start_ts = start.timestamp()
+        end_ts = min(end.timestamp(), time.time())
+        if end_ts <= start_ts:
+            return {"downtime": 0.0, "outages": 0, "availability": None}
+        downtime_start, outages_start = self._totals_at(interface_name, start_ts)
+        downtime_end, outages_end = self._totals_at(interface_name, end_ts)
+        downtime = downtime_end - downtime_start
+        return {"downtime": downtime,
+                "outages": outages_end - outages_start,
+                "availability": 1.0 - downtime / (end_ts - start_ts)}
+
+    # Hourly or daily downtime buckets of closed outage spans between two datetimes
+    def downtime_rollup(self, interface_name, period, start, end):
+        rows = self.connection.execute(
+            "SELECT bucket_start, downtime, outages FROM downtime_rollup "
+            "WHERE interface_name = ? AND period = ? AND bucket_start >= ? AND bucket_start < ? ORDER BY bucket_start",
+            (interface_name, period, int(start.timestamp() // ROLLUP_PERIODS[period]) * ROLLUP_PERIODS[period],
+             end.timestamp())).fetchall()
+        return [(datetime.datetime.fromtimestamp(bucket), downtime, outages) for bucket, downtime, outages in rows]
+
+    def close(self):
+        self.connection.close()
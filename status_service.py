@@ -0,0 +1,211 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import time
+import plugctl
+import telemetry
+from concurrent.futures import ThreadPoolExecutor
+from config_loader import MWAN_SCHEMA, load_config
+from mwan3 import Mwan3Wrapper
+from state_store import StateStore
+
+DEFAULT_REFRESH_INTERVAL = 10
+DEFAULT_HTTP_HOST = '127.0.0.1'
+_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+def _time(value):
+    return value.isoformat(sep=' ') if value else None
+
+def _response(code, body=b'', etag=None, head=False, refreshed_at=None):
+    headers = [f"HTTP/1.1 {code} {_REASONS[code]}", "Content-Type: application/json",
+               f"Content-Length: {len(body) if code != 304 else 0}", "Cache-Control: no-cache"]
+    if etag:
+        headers.append(f"ETag: {etag}")
+    if refreshed_at is not None:
+        headers.append(f"X-Refreshed-At: {refreshed_at:.3f}")
+    payload = '\r\n'.join(headers).encode() + b'\r\n\r\n'
+    return payload if head or code == 304 else payload + body
+
+# A JSON document with its responses rendered once per refresh, so serving it
+# is a dictionary lookup and a write. The refresh time goes in a header, not
+# the body, so the ETag only changes with the data.
+class Document:
+    __slots__ = ('etag', 'ok', 'ok_head', 'not_modified')
+
+    def __init__(self, data, refreshed_at=None):
+        body = json.dumps(data, separators=(',', ':'), sort_keys=True).encode()
+        self.etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        self.ok = _response(200, body, self.etag, refreshed_at=refreshed_at)
+        self.ok_head = _response(200, body, self.etag, head=True, refreshed_at=refreshed_at)
+        self.not_modified = _response(304, etag=self.etag, refreshed_at=refreshed_at)
+
+    # If-None-Match may list several tags, weak ones included, or be *
+    def matches(self, if_none_match):
+        if if_none_match is None:
+            return False
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or self.etag in tags
+
+_NOT_FOUND = _response(404, b'{"error":"not found"}')
+_NOT_ALLOWED = _response(405, b'{"error":"method not allowed"}')
+_BAD_REQUEST = _response(400, b'{"error":"bad request"}')
+
+# Read-only status service for dashboards and scripts.
+#
+# One refresh loop runs `mwan3 status`, reads the mwan3_status table and asks
+# the strips for their socket states every refresh_interval seconds, keeping
+# the last good result of each in memory. Queries never touch mwan3, SQLite or
+# the strips: they are answered from pre-rendered JSON over HTTP/1.1 on
+# localhost and/or a Unix socket (curl --unix-socket PATH http://x/status),
+# with a content ETag so pollers sending If-None-Match get an empty 304, and
+# the time of the last refresh in an X-Refreshed-At header (Unix seconds).
+#
+#   /status      everything below
+#   /mwan3       the parsed Mwan3Status
+#   /interfaces  the interface state table
+#   /plugs       relay state of every socket per strip
+#
+# status_service:
+#   refresh_interval: 10
+#   socket: /var/run/guardsman-status.sock
+#   http_port: 8765
+#   http_host: 127.0.0.1
+class StatusService:
+    def __init__(self, config):
+        service_config = config.get('status_service') or {}
+        self.db_path = config['sqlite']['mwan3_path']
+        self.refresh_interval = service_config.get('refresh_interval', DEFAULT_REFRESH_INTERVAL)
+        self.socket_path = service_config.get('socket')
+        self.http_port = service_config.get('http_port')
+        self.http_host = service_config.get('http_host', DEFAULT_HTTP_HOST)
+        self.strips = [config['smart_plug']['ip']]
+
+        self.mwan3 = Mwan3Wrapper(status_ttl=0)
+        self.controller = plugctl.from_config(config)
+        # Last good result of each source; a failing source keeps serving its previous value
+        self.data = {'mwan3': None, 'interfaces': None, 'plugs': None}
+        self.documents = {}
+        self._store = None
+        # SQLite connections are bound to their thread, so the store lives on one worker
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+
+    async def _db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    async def _read_mwan3(self):
+        return dataclasses.asdict(await self.mwan3.status_async())
+
+    async def _read_interfaces(self):
+        if self._store is None:
+            self._store = await self._db(StateStore, self.db_path)
+        states = await self._db(self._store.load_states)
+        return {name: {'is_online': state.is_online, 'last_online_time': _time(state.last_online_time),
+                       'last_checked_time': _time(state.last_checked_time),
+                       'last_power_cycle_time': _time(state.last_power_cycle_time)}
+                for name, state in states.items()}
+
+    async def _read_plugs(self):
+        async def read_strip(host):
+            children = await self.controller.strip(host).children(refresh=True)
+            return [{'index': index, 'alias': child.alias, 'is_on': child.is_on}
+                    for index, child in enumerate(children)]
+
+        results = await asyncio.gather(*(read_strip(host) for host in self.strips), return_exceptions=True)
+        plugs = {}
+        for host, result in zip(self.strips, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Could not read plug states from {host}: {result}")
+                # An unreachable strip keeps its last known states
+                result = (self.data['plugs'] or {}).get(host)
+            plugs[host] = result
+        return plugs
+
+    async def refresh(self):
+        names = list(self.data)
+        with telemetry.timer('status_refresh_seconds'):
+            results = await asyncio.gather(self._read_mwan3(), self._read_interfaces(), self._read_plugs(),
+                                           return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logging.error(f"Refreshing {name} failed", exc_info=result)
+            else:
+                self.data[name] = result
+        refreshed_at = time.time()
+        documents = {f'/{name}': Document(value, refreshed_at) for name, value in self.data.items()}
+        documents['/status'] = Document(self.data, refreshed_at)
+        # Swapped in whole so a request never sees half a refresh
+        self.documents = documents
+
+    def respond(self, method, target, headers):
+        if method not in ('GET', 'HEAD'):
+            return _NOT_ALLOWED
+        path = target.split('?', 1)[0].rstrip('/') or '/status'
+        document = self.documents.get(path)
+        if document is None:
+            telemetry.count('status_requests', path='other', code=404)
+            return _NOT_FOUND
+        if document.matches(headers.get('if-none-match')):
+            telemetry.count('status_requests', path=path, code=304)
+            return document.not_modified
+        telemetry.count('status_requests', path=path, code=200)
+        return document.ok_head if method == 'HEAD' else document.ok
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    writer.write(_BAD_REQUEST)
+                    break
+                method, target, version = parts
+                writer.write(self.respond(method, target, headers))
+                await writer.drain()
+                connection = headers.get('connection', '').lower()
+                if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        servers = []
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            servers.append(await asyncio.start_unix_server(self.handle, path=self.socket_path))
+            logging.info(f"Serving status on unix:{self.socket_path}")
+        if self.http_port is not None:
+            servers.append(await asyncio.start_server(self.handle, self.http_host, self.http_port))
+            logging.info(f"Serving status on http://{self.http_host}:{servers[-1].sockets[0].getsockname()[1]}")
+        if not servers:
+            raise ValueError("status_service needs a socket path or an http_port")
+        return servers
+
+    async def run(self):
+        # Serve only once there is something to serve
+        await self.refresh()
+        await self.start()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+            telemetry.publish_if_due()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    config = load_config('/root/ctrl-guardsman-beryl/config.yml', MWAN_SCHEMA)
+    telemetry.configure(config, job='status_service')
+    asyncio.run(StatusService(config).run())
@@ -0,0 +1,202 @@
+import bisect
+import logging
+import os
+import time
+from line_protocol import _ESCAPE_KEY, _ESCAPE_MEASUREMENT, escape_tag_value, format_field_value
+from spool import open_spool
+
+# Seconds buckets for timers; other histograms pass their own
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DEFAULT_MEASUREMENT = 'guardsman_telemetry'
+DEFAULT_PUBLISH_INTERVAL = 60
+PROMETHEUS_PREFIX = 'guardsman_'
+
+# Self-instrumentation shared by every script: counters, histograms and timers
+# kept in process and published at the end of a run (or periodically by the
+# daemons) as a Prometheus textfile for node_exporter and as an Influx
+# measurement through the exporters' writer or the spool.
+#
+# Everything is off until configure() enables it. While disabled, count() and
+# observe() return after one global check and timer() hands back a shared no-op
+# context manager, so the instrumented hot paths cost next to nothing.
+_enabled = False
+_settings = {}
+_last_publish = 0.0
+_counters = {}
+_histograms = {}
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('key', 'started')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        _observe(self.key, time.perf_counter() - self.started, DEFAULT_BUCKETS)
+        if exc_type is not None:
+            _count((self.key[0] + '_errors', self.key[1]), 1)
+        return False
+
+def _key(name, tags):
+    return name, tuple(sorted(tags.items())) if tags else ()
+
+def _count(key, value):
+    _counters[key] = _counters.get(key, 0) + value
+
+def _observe(key, value, buckets):
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram(buckets)
+    histogram.observe(value)
+
+def enabled():
+    return _enabled
+
+# Enable telemetry from the `telemetry` section of a script's config; job names the
+# script in both outputs and the default textfile name.
+def configure(config, job):
+    global _enabled
+    telemetry_config = config.get('telemetry') or {}
+    _enabled = bool(telemetry_config.get('enabled', False))
+    _settings.clear()
+    _settings.update(job=job,
+                     location_name=config.get('location_name'),
+                     measurement=telemetry_config.get('measurement', DEFAULT_MEASUREMENT),
+                     textfile_dir=telemetry_config.get('textfile_dir'),
+                     influx=telemetry_config.get('influx', True),
+                     publish_interval=telemetry_config.get('publish_interval', DEFAULT_PUBLISH_INTERVAL),
+                     spool=config.get('spool'))
+
+def count(name, value=1, **tags):
+    if _enabled:
+        _count(_key(name, tags), value)
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **tags):
+    if _enabled:
+        _observe(_key(name, tags), value, buckets)
+
+# Time a block in seconds; an exception leaving the block also counts <name>_errors
+def timer(name, **tags):
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(_key(name, tags))
+
+def reset():
+    _counters.clear()
+    _histograms.clear()
+
+def _prometheus_labels(tags, extra=()):
+    labels = [('job', _settings.get('job'))] + list(tags) + list(extra)
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _prometheus_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Prometheus text exposition format of every metric
+def to_prometheus():
+    lines = []
+    for name in sorted({name for name, _ in _counters}):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name}_total counter")
+        for (metric, tags), value in sorted(_counters.items()):
+            if metric == name:
+                lines.append(f"{PROMETHEUS_PREFIX}{name}_total{_prometheus_labels(tags)} {_prometheus_number(value)}")
+    for name in sorted({name for name, _ in _histograms}):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} histogram")
+        for (metric, tags), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += bucket_count
+                labels = _prometheus_labels(tags, [('le', bound if bound == '+Inf' else repr(float(bound)))])
+                lines.append(f"{PROMETHEUS_PREFIX}{name}_bucket{labels} {cumulative}")
+            lines.append(f"{PROMETHEUS_PREFIX}{name}_sum{_prometheus_labels(tags)} {repr(histogram.sum)}")
+            lines.append(f"{PROMETHEUS_PREFIX}{name}_count{_prometheus_labels(tags)} {histogram.count}")
+    return '\n'.join(lines) + '\n'
+
+# Write the textfile atomically so node_exporter never reads half of it
+def write_textfile(path):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        file.write(to_prometheus())
+    os.replace(temp_path, path)
+
+def _line(name, tags, fields, timestamp):
+    tags = [('job', _settings.get('job')), ('location_name', _settings.get('location_name')),
+            ('metric', name)] + list(tags)
+    tag_text = ''.join(f",{key.translate(_ESCAPE_KEY)}={escape_tag_value(value)}"
+                       for key, value in sorted(tags) if value is not None and value != '')
+    field_text = ','.join(f"{key}={format_field_value(value)}" for key, value in fields)
+    return f"{_settings['measurement'].translate(_ESCAPE_MEASUREMENT)}{tag_text} {field_text} {timestamp}"
+
+# One Influx point per metric: counters carry `value`, histograms count, sum and max
+def to_line_protocol(timestamp=None):
+    timestamp = timestamp or time.time_ns()
+    lines = [_line(name, tags, [('value', float(value))], timestamp) for (name, tags), value in _counters.items()]
+    lines += [_line(name, tags, [('count', histogram.count), ('max', histogram.max), ('sum', histogram.sum)], timestamp)
+              for (name, tags), histogram in _histograms.items()]
+    return '\n'.join(lines).encode('utf-8'), len(lines)
+
+# Export the current metrics: the Prometheus textfile when textfile_dir is set,
+# and the Influx measurement through writer (a BatchWriter), or into the spool
+# the exporters' sender drains when the script has no writer of its own.
+def publish(writer=None):
+    global _last_publish
+    if not _enabled:
+        return
+    _last_publish = time.monotonic()
+    if _settings.get('textfile_dir'):
+        try:
+            write_textfile(os.path.join(_settings['textfile_dir'], f"{_settings['job']}.prom"))
+        except OSError:
+            logging.error("Could not write the telemetry textfile", exc_info=True)
+    if not _settings.get('influx'):
+        return
+    payload, points = to_line_protocol()
+    if not points:
+        return
+    if writer is not None:
+        writer.write([payload], count=points)
+    elif _settings.get('spool'):
+        try:
+            open_spool(_settings['spool']).put(payload)
+        except OSError:
+            logging.error("Could not spool telemetry", exc_info=True)
+
+# For long-running scripts: publish at most once per publish_interval
+def publish_if_due(writer=None):
+    if _enabled and time.monotonic() - _last_publish >= _settings['publish_interval']:
+        publish(writer)
@@ -0,0 +1,29 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = None
+
+# The exporter modules load config.yml when they are imported, so point them at
+# a throwaway config (and config cache) before any test imports one
+def pytest_configure(config):
+    global _workdir
+    _workdir = tempfile.mkdtemp(prefix='guardsman-tests-')
+    config_path = os.path.join(_workdir, 'config.json')
+    with open(config_path, 'w') as file:
+        json.dump({'dry_run': True, 'location_name': 'test',
+                   'influx_db': {'url': 'http://127.0.0.1:8086', 'token': 't', 'org': 'o', 'bucket': 'b'},
+                   'sqlite': {'iperf_path': os.path.join(_workdir, 'iperf.db'),
+                              'ping_path': os.path.join(_workdir, 'ping.db'),
+                              'speedtest_path': os.path.join(_workdir, 'speedtest.db')}}, file)
+    os.environ['GUARDSMAN_CONFIG'] = config_path
+    os.environ['GUARDSMAN_CONFIG_CACHE'] = _workdir
+
+def pytest_unconfigure(config):
+    if _workdir:
+        shutil.rmtree(_workdir, ignore_errors=True)
@@ -0,0 +1,64 @@
+import calendar
+import collections
+import random
+import time
+
+from aggregation import aggregate_ping_rows, closed_window_chunks
+from line_protocol import TIME_FORMAT
+
+START = calendar.timegm((2024, 1, 1, 0, 0, 0))
+
+# PingResults rows (id, server_ip, interface, min, max, avg, success_rate, timestamp)
+# with the rowid appended, as fetch_chunks() yields them
+def ping_rows(offsets, server='192.0.2.1'):
+    return [(rowid, server, 'wan', 1.0, 3.0, 2.0, 100.0, time.strftime(TIME_FORMAT, time.gmtime(START + offset)), rowid)
+            for rowid, offset in enumerate(offsets, 1)]
+
+def chunked(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def check_chunks(rows, chunks, window):
+    yielded = [row for chunk in chunks for row in chunk]
+    # Each chunk continues the previous one in rowid order, so its last rowid can be acknowledged
+    assert yielded == rows[:len(yielded)]
+    counts = collections.Counter()
+    for chunk in chunks:
+        for server_ip, start, *_ in aggregate_ping_rows(chunk, window):
+            counts[(server_ip, start)] += 1
+    # No (series, window) point is uploaded twice
+    assert all(count == 1 for count in counts.values())
+    return yielded
+
+# A row of an older window written within grace after rows of a newer one stays with its window
+def test_late_row_joins_its_window():
+    rows = ping_rows([0, 10, 65, 20, 70, 130, 140, 200])
+    chunks = list(closed_window_chunks(chunked(rows, 3), 60, grace=30, now=START + 1000))
+    yielded = check_chunks(rows, chunks, 60)
+    assert yielded == rows
+    aggregated = {start: samples for _, start, _, _, _, _, samples, *_ in aggregate_ping_rows(chunks[0], 60)}
+    assert aggregated['2024-01-01 00:00:00'] == 3
+
+def test_open_window_is_held_until_closed():
+    rows = ping_rows([0, 30, 61, 85])
+    assert [len(chunk) for chunk in closed_window_chunks([rows], 60, grace=30, now=START + 149)] == [2]
+    assert [len(chunk) for chunk in closed_window_chunks([rows], 60, grace=30, now=START + 150)] == [4]
+    # Mid-stream a window closes once a timestamp grace seconds past its end has been read
+    rows = ping_rows([0, 30, 61, 85, 90, 95])
+    assert [len(chunk) for chunk in closed_window_chunks(chunked(rows, 2), 60, grace=30, now=START + 100)] == [2]
+    assert [len(chunk) for chunk in closed_window_chunks(chunked(rows, 2)[:2], 60, grace=30, now=START + 89)] == []
+
+# A late row of a closed window behind a row of the open window holds back both
+def test_closed_window_behind_open_window_is_held():
+    rows = ping_rows([0, 61, 10])
+    assert list(closed_window_chunks([rows], 60, grace=0, now=START + 100)) == []
+    assert list(closed_window_chunks([rows], 60, grace=0, now=START + 120)) == [rows]
+
+def test_random_out_of_order_rows():
+    rnd = random.Random(1)
+    for _ in range(200):
+        written = sorted(rnd.uniform(45, 600) for _ in range(rnd.randint(1, 80)))
+        # Some rows are written up to 45 s after their timestamp, so rowid order is only roughly time order
+        rows = ping_rows([int(at - rnd.choice([0, 0, 0, rnd.uniform(0, 45)])) for at in written])
+        chunks = list(closed_window_chunks(chunked(rows, rnd.randint(1, 20)), 60, grace=45,
+                                           now=START + written[-1] + rnd.randint(0, 120)))
+        check_chunks(rows, chunks, 60)
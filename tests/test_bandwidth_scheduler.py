@@ -0,0 +1,72 @@
+import asyncio
+import shutil
+import socket
+import sqlite3
+import subprocess
+import time
+
+import pytest
+
+from bandwidth_scheduler import TEST_TYPES, BandwidthScheduler, insert_result
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def read_rows(db_path, table):
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.row_factory = sqlite3.Row
+        return [dict(row) for row in connection.execute(f"SELECT * FROM {table}")]
+    finally:
+        connection.close()
+
+# Rows land in their named columns even when the collector created the table in another order
+def test_insert_result_names_columns(tmp_path):
+    db_path = str(tmp_path / 'iperf.db')
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE Performance (id INTEGER PRIMARY KEY, speed REAL, direction TEXT, "
+                       "timestamp TEXT, server_ip TEXT, bandwidth_limit INTEGER)")
+    connection.close()
+    _, _, table, columns, schema = TEST_TYPES['iperf']
+    insert_result(db_path, table, schema, columns, ('192.0.2.1', '2024-01-01 00:00:00', 'download', 100, 94.5))
+    assert read_rows(db_path, table) == [{'id': 1, 'speed': 94.5, 'direction': 'download',
+                                          'timestamp': '2024-01-01 00:00:00', 'server_ip': '192.0.2.1',
+                                          'bandwidth_limit': 100}]
+
+@pytest.fixture
+def iperf3_server():
+    if shutil.which('iperf3') is None:
+        pytest.skip("iperf3 is not installed")
+    port = _free_port()
+    server = subprocess.Popen(['iperf3', '-s', '-1', '-B', '127.0.0.1', '-p', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait for the server to listen
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield port
+    server.kill()
+    server.wait()
+
+def test_iperf_over_loopback(tmp_path, iperf3_server):
+    db_path = str(tmp_path / 'iperf.db')
+    scheduler = BandwidthScheduler({
+        'sqlite': {'iperf_path': db_path},
+        'bandwidth_tests': {'check_mwan3': False, 'tests': [
+            {'type': 'iperf', 'interface': 'lo', 'server': '127.0.0.1', 'port': iperf3_server,
+             'direction': 'upload', 'duration': 1}]},
+    })
+    [result] = asyncio.run(scheduler.run_once())
+    assert result is not None
+    [row] = read_rows(db_path, 'Performance')
+    assert row['server_ip'] == '127.0.0.1'
+    assert row['direction'] == 'upload'
+    assert row['bandwidth_limit'] is None
+    assert row['speed'] > 0
+    assert len(row['timestamp']) == 19
@@ -0,0 +1,69 @@
+import sqlite3
+
+from exporter import acknowledge_rows, fetch_chunks
+from maintenance import Maintenance
+
+def make_db(path, rows):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("CREATE TABLE PingResults (id INTEGER PRIMARY KEY, server_ip TEXT, interface TEXT, "
+                           "min_latency REAL, max_latency REAL, avg_latency REAL, success_rate REAL, timestamp TEXT)")
+    connection.close()
+    insert(path, rows)
+
+# What the collector does: append rows without choosing their ids
+def insert(path, rows, timestamp='2024-01-01 00:00:00'):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executemany("INSERT INTO PingResults (server_ip, interface, min_latency, max_latency, avg_latency, "
+                               "success_rate, timestamp) VALUES ('192.0.2.1', 'wan', 1.0, 3.0, 2.0, 100.0, ?)",
+                               [(timestamp,)] * rows)
+    connection.close()
+
+def rowids(path):
+    connection = sqlite3.connect(path)
+    try:
+        return [rowid for rowid, in connection.execute("SELECT rowid FROM PingResults ORDER BY rowid")]
+    finally:
+        connection.close()
+
+def cursor(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT last_rowid FROM export_cursor WHERE table_name = 'PingResults'").fetchone()[0]
+    finally:
+        connection.close()
+
+# A cron exporter fetched rows 1-10 when retention empties the table and the
+# collector writes new rows; its late acknowledgement must not delete them
+def test_acknowledgement_after_retention_keeps_new_rows(tmp_path):
+    path = str(tmp_path / 'ping.db')
+    make_db(path, 10)
+    [chunk] = fetch_chunks(path, 'PingResults')
+    assert chunk[-1][-1] == 10
+
+    report = Maintenance({'sqlite': {'ping_path': path}, 'maintenance': {'max_age_days': 1}}).maintain(path, ['ping_path'])
+    assert report['rows_deleted'] == {'PingResults': 10}
+    assert cursor(path) == 10
+
+    insert(path, 3, timestamp='2999-01-01 00:00:00')
+    assert rowids(path) == [11, 12, 13]
+    assert acknowledge_rows(path, 'PingResults', 10) == 10
+    assert rowids(path) == [11, 12, 13]
+    assert [row[-1] for chunk in fetch_chunks(path, 'PingResults') for row in chunk] == [11, 12, 13]
+
+# Emptying the table by acknowledgement keeps the cursor; rowids continue above it
+def test_rowids_continue_after_table_empties(tmp_path):
+    path = str(tmp_path / 'ping.db')
+    make_db(path, 5)
+    [chunk] = fetch_chunks(path, 'PingResults')
+    assert acknowledge_rows(path, 'PingResults', chunk[-1][-1]) == 5
+    assert rowids(path) == []
+    insert(path, 2)
+    assert rowids(path) == [6, 7]
+    # An older acknowledgement arriving late does not move the cursor back
+    assert acknowledge_rows(path, 'PingResults', 3) == 5
+    assert rowids(path) == [6, 7]
+    assert acknowledge_rows(path, 'PingResults', 7) == 7
+    insert(path, 1)
+    assert rowids(path) == [8]
@@ -0,0 +1,92 @@
+import datetime
+import re
+import sqlite3
+
+import pytest
+
+import exporter_fan_in
+from exporter import BatchWriter
+
+START = datetime.datetime(2024, 1, 1)
+
+def make_site(path, rows):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("CREATE TABLE PingResults (id INTEGER PRIMARY KEY, server_ip TEXT, interface TEXT, "
+                           "min_latency REAL, max_latency REAL, avg_latency REAL, success_rate REAL, timestamp TEXT)")
+        # One second apart, so an uploaded line's timestamp gives back its rowid
+        connection.executemany("INSERT INTO PingResults VALUES (NULL, '192.0.2.1', 'wan', 1.0, 3.0, 2.0, 100.0, ?)",
+                               [((START + datetime.timedelta(seconds=rowid)).strftime('%Y-%m-%d %H:%M:%S'),)
+                                for rowid in range(1, rows + 1)])
+    connection.close()
+
+def remaining_rowids(path):
+    connection = sqlite3.connect(path)
+    try:
+        return {rowid for rowid, in connection.execute("SELECT rowid FROM PingResults")}
+    finally:
+        connection.close()
+
+# Write API that records every uploaded row per site and fails the writes picked by fail()
+class WriteApi:
+    def __init__(self, fail):
+        self.fail = fail
+        self.calls = 0
+        self.uploaded = {}
+
+    def write(self, bucket, record):
+        self.calls += 1
+        lines = b'\n'.join(record).decode().splitlines()
+        if self.fail(self.calls, lines):
+            raise RuntimeError("400 bad request")
+        for line in lines:
+            site = re.search(r'location_name=(\w+)', line).group(1)
+            nanoseconds = int(line.rsplit(' ', 1)[1])
+            rowid = int(nanoseconds // 10 ** 9 - START.replace(tzinfo=datetime.timezone.utc).timestamp())
+            self.uploaded.setdefault(site, set()).add(rowid)
+
+def run_sites(tmp_path, fail, sites='abc', rows=40, workers=3, batch_size=15):
+    for site in sites:
+        make_site(tmp_path / f'{site}.db', rows)
+    api = WriteApi(fail)
+    writer = BatchWriter(api, 'b', batch_size=batch_size)
+    jobs = [(site, 'PingResults', str(tmp_path / f'{site}.db')) for site in sites]
+    stats = exporter_fan_in.run(jobs, writer, workers, chunk_size=5, chunks_per_task=1)
+    return api, stats
+
+def check_no_row_lost(tmp_path, api, sites='abc', rows=40):
+    for site in sites:
+        deleted = set(range(1, rows + 1)) - remaining_rowids(tmp_path / f'{site}.db')
+        # Only rows that reached InfluxDB may be deleted
+        assert deleted <= api.uploaded.get(site, set()), site
+
+# One failed upload of site b: its rows stay in its database and the other sites finish
+@pytest.mark.parametrize('attempt', range(10))
+def test_failed_write_does_not_delete_unsent_rows(tmp_path, attempt):
+    failed = []
+
+    def fail(call, lines):
+        if not failed and any('location_name=b' in line for line in lines):
+            failed.append(call)
+            return True
+        return False
+
+    api, stats = run_sites(tmp_path, fail)
+    check_no_row_lost(tmp_path, api)
+    assert stats[('b', str(tmp_path / 'b.db'))].error
+    for site in 'ac':
+        if not stats[(site, str(tmp_path / f'{site}.db'))].error:
+            assert remaining_rowids(tmp_path / f'{site}.db') == set()
+
+def test_all_writes_succeed(tmp_path):
+    api, stats = run_sites(tmp_path, lambda call, lines: False)
+    assert not any(site.error for site in stats.values())
+    for site in 'abc':
+        assert remaining_rowids(tmp_path / f'{site}.db') == set()
+        assert api.uploaded[site] == set(range(1, 41))
+
+def test_every_write_fails(tmp_path):
+    api, stats = run_sites(tmp_path, lambda call, lines: True)
+    assert all(site.error for site in stats.values())
+    for site in 'abc':
+        assert remaining_rowids(tmp_path / f'{site}.db') == set(range(1, 41))
@@ -0,0 +1,108 @@
+import importlib
+import math
+import random
+
+import pytest
+
+pytest.importorskip('influxdb_client')
+
+# Tag values that exercise every escape Point applies, plus empty, missing and non-ASCII ones
+TAG_VALUES = ['bench', 'with space', 'comma,separated', 'key=value', 'trailing\\', 'new\nline', 'tab\tbed',
+              'carriage\rreturn', 'quote"d', 'Zürich', '東京', 'emoji 📶', '', None]
+# Field values as SQLite hands them back, including the ones Point drops or refuses
+FIELD_VALUES = [0, 1, -7, 2 ** 40, 0.0, -0.0, 0.1 + 0.2, 1e20, 1e-7, 123.456, math.inf, -math.inf, math.nan, None]
+TIMESTAMPS = ['2024-01-01 00:00:00', '2024-02-29 23:59:59', '1999-12-31 12:34:56', '2038-01-19 03:14:08',
+              '1970-01-01 00:00:00']
+
+# Rows of each collector table with the rowid appended, as fetch_chunks() yields them
+def _performance_row(rnd, index):
+    return (index, rnd.choice(TAG_VALUES), rnd.choice(TIMESTAMPS), rnd.choice(TAG_VALUES),
+            rnd.choice(FIELD_VALUES), rnd.choice(FIELD_VALUES), index)
+
+def _ping_row(rnd, index):
+    return (index, rnd.choice(TAG_VALUES), rnd.choice(TAG_VALUES), *(rnd.choice(FIELD_VALUES) for _ in range(4)),
+            rnd.choice(TIMESTAMPS), index)
+
+def _speedtest_row(rnd, index):
+    return (index, rnd.choice(TAG_VALUES), rnd.choice(TIMESTAMPS), *(rnd.choice(FIELD_VALUES) for _ in range(3)),
+            index)
+
+ROW_BUILDERS = {'iperf': _performance_row, 'ping': _ping_row, 'speedtest': _speedtest_row}
+
+# Line protocol of rows through one path, or the type of the exception it raised
+def _outcome(format_rows, rows):
+    try:
+        return format_rows(rows)
+    except Exception as error:
+        return f"<{type(error).__name__}>"
+
+def _point(module, location_name):
+    def format_rows(rows):
+        module.config['location_name'] = location_name
+        lines = (point.to_line_protocol() for point in module.format_data_for_influx(rows))
+        return '\n'.join(line for line in lines if line)
+    return format_rows
+
+def _serializer(module, location_name):
+    serializer = module.serializer_for(location_name)
+    return lambda rows: serializer.serialize(rows).decode('utf-8')
+
+@pytest.fixture(params=sorted(ROW_BUILDERS))
+def exporter(request):
+    module = importlib.import_module(request.param)
+    location_name = module.config['location_name']
+    yield request.param, module
+    module.config['location_name'] = location_name
+
+# Random rows compared one by one and then as one chunk, for every location name
+def test_serializer_matches_point(exporter):
+    name, module = exporter
+    rnd = random.Random(0)
+    for location_name in TAG_VALUES:
+        point, serializer = _point(module, location_name), _serializer(module, location_name)
+        rows = [ROW_BUILDERS[name](rnd, index) for index in range(1, 301)]
+        for row in rows:
+            assert _outcome(serializer, [row]) == _outcome(point, [row]), (location_name, row)
+        # One row either path refuses fails the whole chunk, so the chunk holds only accepted rows
+        accepted = [row for row in rows if not _outcome(point, [row]).startswith('<')]
+        assert _outcome(serializer, accepted) == _outcome(point, accepted)
+
+def _both(module, rows, location_name='site'):
+    return _outcome(_serializer(module, location_name), rows), _outcome(_point(module, location_name), rows)
+
+def test_escaping():
+    iperf = importlib.import_module('iperf')
+    row = (1, 'a b,c=d', '2024-01-01 00:00:00', 'trailing\\', 5, 1.5, 1)
+    serialized, point = _both(iperf, [row], location_name='Zürich, 東京')
+    assert serialized == point
+    assert serialized == ('performance_metrics,direction=trailing\\ ,location_name=Zürich\\,\\ 東京,'
+                          'server_ip=a\\ b\\,c\\=d bandwidth_limit=5i,speed=1.5 1704067200000000000')
+
+# Tags and fields come out sorted by key, whatever order the formatter adds them in
+def test_tag_and_field_order():
+    ping = importlib.import_module('ping')
+    row = (1, '192.0.2.1', 'wan', 1.0, 3.0, 2.0, 100.0, '2024-01-01 00:00:10', 1)
+    serialized, point = _both(ping, [row])
+    assert serialized == point
+    assert serialized == ('ping_metrics,location_name=site,server_ip=192.0.2.1 avg_latency=2,max_latency=3,'
+                          'min_latency=1,success_rate=100 1704067210000000000')
+
+def test_nan_and_infinite_fields_are_dropped():
+    speedtest = importlib.import_module('speedtest')
+    row = (1, 'wan', '2024-01-01 00:00:00', math.nan, math.inf, 12.5, 1)
+    serialized, point = _both(speedtest, [row])
+    assert serialized == point == 'network_metrics,interface=wan,location_name=site ping_latency=12.5 1704067200000000000'
+    # A row left without fields produces no line at all
+    empty = (2, 'wan', '2024-01-01 00:00:00', math.nan, -math.inf, math.nan, 2)
+    assert _both(speedtest, [empty]) == ('', '')
+    assert _both(speedtest, [row, empty]) == _both(speedtest, [row])
+
+def test_none_fields_and_tags():
+    iperf = importlib.import_module('iperf')
+    # bandwidth_limit is written as stored, so None just leaves the field out, as does a None tag
+    row = (1, None, '2024-01-01 00:00:00', 'download', None, 2.0, 1)
+    serialized, point = _both(iperf, [row])
+    assert serialized == point == 'performance_metrics,direction=download,location_name=site speed=2 1704067200000000000'
+    # Float columns go through float(), which refuses None on both paths
+    speedtest = importlib.import_module('speedtest')
+    assert _both(speedtest, [(1, 'wan', '2024-01-01 00:00:00', None, 1.0, 1.0, 1)]) == ('<TypeError>', '<TypeError>')
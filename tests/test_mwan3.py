@@ -0,0 +1,46 @@
+import asyncio
+import os
+import subprocess
+
+import pytest
+
+from mwan3 import Mwan3Wrapper
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'benchmarks', 'fixtures', 'mwan3_status_4wan.txt')
+
+# A stand-in mwan3 that prints the fixture, or fails like mwan3 does when its
+# hotplug state is missing
+@pytest.fixture
+def mwan3(tmp_path):
+    script = tmp_path / 'mwan3'
+    script.write_text(f"#!/bin/sh\n"
+                      f"if [ -e {tmp_path}/fail ]; then echo 'Error: mwan3 is not running' >&2; exit 1; fi\n"
+                      f"cat {FIXTURE}\n")
+    script.chmod(0o755)
+    wrapper = Mwan3Wrapper(status_ttl=60)
+    wrapper.mwan3_command = str(script)
+    return wrapper, tmp_path / 'fail'
+
+def test_status(mwan3):
+    wrapper, _ = mwan3
+    assert wrapper.interface_states() == {'wan': True, 'wanb': False, 'wanc': True, 'wan6': False}
+    assert asyncio.run(wrapper.interface_states_async())['wan'] is True
+
+def test_failed_command_raises(mwan3):
+    wrapper, fail = mwan3
+    fail.touch()
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        wrapper.status()
+    assert 'not running' in error.value.stderr
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(wrapper.status_async())
+
+# A failure is not cached, so the next call runs mwan3 again
+def test_failed_command_is_not_cached(mwan3):
+    wrapper, fail = mwan3
+    fail.touch()
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(wrapper.status_async())
+    fail.unlink()
+    assert len(asyncio.run(wrapper.status_async()).interfaces) == 4
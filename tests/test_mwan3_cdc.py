@@ -0,0 +1,38 @@
+import datetime
+import os
+
+from mwan3 import Mwan3Status, parse_status
+from mwan3_cdc import Mwan3ChangeLog
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures')
+NOW = datetime.datetime(2024, 1, 1)
+
+def fixture_status(name):
+    with open(os.path.join(FIXTURES, name)) as file:
+        return parse_status(file.read())
+
+def test_changes_are_recorded(tmp_path):
+    change_log = Mwan3ChangeLog(str(tmp_path / 'mwan3.db'))
+    try:
+        assert change_log.record(fixture_status('mwan3_status_4wan.txt'), now=NOW) > 0
+        assert change_log.record(fixture_status('mwan3_status_4wan.txt'), now=NOW + datetime.timedelta(seconds=10)) == 0
+        assert change_log.record(fixture_status('mwan3_status_degraded.txt'), now=NOW + datetime.timedelta(seconds=20)) > 0
+        assert change_log.reconstruct() == change_log.snapshot()
+    finally:
+        change_log.close()
+
+# An empty status (mwan3 failed, or its output did not parse) leaves the log untouched
+def test_empty_status_is_ignored(tmp_path):
+    change_log = Mwan3ChangeLog(str(tmp_path / 'mwan3.db'))
+    try:
+        change_log.record(fixture_status('mwan3_status_4wan.txt'), now=NOW)
+        snapshot = change_log.snapshot()
+        events = change_log.connection.execute("SELECT COUNT(*) FROM mwan3_events").fetchone()[0]
+        assert change_log.record(Mwan3Status(), now=NOW + datetime.timedelta(seconds=10)) == 0
+        assert change_log.record(parse_status("Error: mwan3 is not running\n"),
+                                 now=NOW + datetime.timedelta(days=2)) == 0
+        assert change_log.snapshot() == snapshot
+        assert change_log.connection.execute("SELECT COUNT(*) FROM mwan3_events").fetchone()[0] == events
+        assert change_log.record(fixture_status('mwan3_status_4wan.txt'), now=NOW + datetime.timedelta(seconds=20)) == 0
+    finally:
+        change_log.close()
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from fake_kasa_strip import FakeStrip
+from plugctl import PlugController, PlugError
+
+async def with_strip(test, sockets=4):
+    strip = FakeStrip(sockets=sockets)
+    host = f"127.0.0.1:{await strip.start('127.0.0.1', 0)}"
+    controller = PlugController(timeout=2)
+    try:
+        return await test(strip, host, controller)
+    finally:
+        await controller.close()
+        strip.close()
+
+# python-kasa connects to the legacy strip; the sockets of one strip go off and on together
+def test_power_cycle_switches_sockets_together():
+    async def test(strip, host, controller):
+        await controller.strip(host).device()
+        strip.switches.clear()
+        strip.requests = 0
+        results = await controller.power_cycle([(host, 'Plug 1'), (host, 2), (host, 'Plug 1')], off_time=0)
+        assert results == {host: None}
+        ids = [child['id'] for child in strip.children]
+        assert strip.switches == [(ids[0], 0), (ids[2], 0), (ids[0], 1), (ids[2], 1)]
+        # One request off, one refresh of the cached states, one request on
+        assert strip.requests == 3
+    asyncio.run(with_strip(test))
+
+def test_toggle_flips_each_socket():
+    async def test(strip, host, controller):
+        strip.children[1]['state'] = 0
+        results = await controller.toggle([(host, 'Plug 1'), (host, 'Plug 2')])
+        assert results == {host: {'Plug 1': False, 'Plug 2': True}}
+        assert [child['state'] for child in strip.children] == [0, 1, 1, 1]
+        children = await controller.strip(host).children(refresh=True)
+        assert [(child.alias, child.is_on) for child in children][:2] == [('Plug 1', False), ('Plug 2', True)]
+    asyncio.run(with_strip(test))
+
+def test_unknown_socket_is_reported_per_strip():
+    async def test(strip, host, controller):
+        results = await controller.turn_off([(host, 'Plug 9')])
+        assert isinstance(results[host], PlugError)
+        assert strip.switches == []
+    asyncio.run(with_strip(test))
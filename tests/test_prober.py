@@ -0,0 +1,63 @@
+import asyncio
+import socket
+import sqlite3
+
+import pytest
+
+from prober import Prober
+
+def _icmp_available():
+    for type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            socket.socket(socket.AF_INET, type, socket.IPPROTO_ICMP).close()
+            return True
+        except OSError:
+            pass
+    return False
+
+def make_prober(tmp_path, method='icmp'):
+    return Prober({'sqlite': {'ping_path': str(tmp_path / 'ping.db')},
+                   'prober': {'targets': ['127.0.0.1'], 'interfaces': [{'name': 'lo'}],
+                              'method': method, 'count': 3, 'timeout': 1.0, 'rate_limit': 0}})
+
+async def probe_once(prober):
+    prober._select_method()
+    try:
+        await asyncio.gather(*(prober._probe_round(interface, target)
+                               for interface in prober.interfaces for target in prober.targets))
+        await prober.flush()
+    finally:
+        for pinger in prober._pingers.values():
+            pinger.close()
+
+def read_rows(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'ping.db')
+    try:
+        return connection.execute("SELECT * FROM PingResults").fetchall()
+    finally:
+        connection.close()
+
+def check_row(row):
+    _, server_ip, interface, min_latency, max_latency, avg_latency, success_rate, timestamp = row
+    assert (server_ip, interface) == ('127.0.0.1', 'lo')
+    assert 0.0 <= success_rate <= 100.0
+    assert success_rate == 100.0
+    assert 0.0 < min_latency <= avg_latency <= max_latency < 1000.0
+    assert len(timestamp) == 19
+
+@pytest.mark.skipif(not _icmp_available(), reason="neither ping nor raw ICMP sockets are permitted")
+def test_icmp_probe_of_loopback(tmp_path):
+    prober = make_prober(tmp_path)
+    asyncio.run(probe_once(prober))
+    assert prober.method == 'icmp'
+    rows = read_rows(tmp_path)
+    assert len(rows) == 1
+    check_row(rows[0])
+
+# A refused connect still measures the round trip, so loopback answers on any closed port
+def test_tcp_probe_of_loopback(tmp_path):
+    prober = make_prober(tmp_path, method='tcp')
+    asyncio.run(probe_once(prober))
+    rows = read_rows(tmp_path)
+    assert len(rows) == 1
+    check_row(rows[0])
@@ -0,0 +1,110 @@
+import gzip
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import spool
+from spool import Spool, SpoolSender, SpoolSendError, SpoolWriter
+
+# Local stand-in for the InfluxDB write endpoint. Each request takes the next
+# (status, headers) from responses, answering 204 once they run out.
+class FakeInflux:
+    def __init__(self):
+        self.responses = []
+        self.bodies = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                fake.bodies.append(gzip.decompress(body))
+                status, headers = fake.responses.pop(0) if fake.responses else (204, {})
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+@pytest.fixture
+def influx():
+    fake = FakeInflux()
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+def make_sender(path, influx, **kwargs):
+    return SpoolSender(Spool(str(path)), {'url': influx.url, 'token': 't', 'org': 'o', 'bucket': 'b'}, **kwargs)
+
+def test_drain_sends_batches_in_order_and_removes_them(tmp_path, influx):
+    writer = SpoolWriter(Spool(str(tmp_path)))
+    writer.write('b', [b'm v=1i 1', 'm v=2i 2'])
+    writer.write('b', [b'm v=3i 3'])
+    sender = make_sender(tmp_path, influx)
+    assert sender.drain() == 2
+    assert influx.bodies == [b'm v=1i 1\nm v=2i 2', b'm v=3i 3']
+    assert sender.spool.batches() == []
+
+def test_drain_keeps_batches_on_server_error(tmp_path, influx):
+    sender = make_sender(tmp_path, influx)
+    sender.spool.put(b'm v=1i 1')
+    influx.responses = [(503, {'Retry-After': '7'})]
+    with pytest.raises(SpoolSendError) as error:
+        sender.drain()
+    assert error.value.retry_after == 7
+    assert len(sender.spool.batches()) == 1
+    assert sender.drain() == 1
+    assert sender.spool.batches() == []
+
+def test_drain_sets_rejected_batches_aside(tmp_path, influx):
+    sender = make_sender(tmp_path, influx)
+    name = sender.spool.put(b'not line protocol')
+    sender.spool.put(b'm v=1i 1')
+    influx.responses = [(400, {})]
+    assert sender.drain() == 1
+    assert sorted(os.listdir(tmp_path)) == [name + spool.REJECTED_SUFFIX]
+
+# run() backs off exponentially with jitter while the server fails, up to
+# max_backoff, and returns to the poll interval once a drain succeeds
+def test_run_backs_off_until_the_server_recovers(tmp_path, influx, monkeypatch):
+    sender = make_sender(tmp_path, influx, initial_backoff=1, max_backoff=4)
+    sender.spool.put(b'm v=1i 1')
+    influx.responses = [(500, {})] * 5
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 7:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(spool.time, 'sleep', sleep)
+    with pytest.raises(KeyboardInterrupt):
+        sender.run(poll_interval=5)
+    backoffs, polls = sleeps[:5], sleeps[5:]
+    for wait, delay in zip(backoffs, [1, 2, 4, 4, 4]):
+        assert delay * 0.5 <= wait <= delay
+    assert polls == [5, 5]
+    assert len(influx.bodies) == 6
+    assert sender.spool.batches() == []
+
+def test_only_stale_temp_files_are_removed(tmp_path):
+    stale = tmp_path / 'stale.lp.gz.tmp'
+    fresh = tmp_path / 'fresh.lp.gz.tmp'
+    stale.write_bytes(b'')
+    fresh.write_bytes(b'')
+    old = time.time() - spool.STALE_TEMP_SECONDS - 60
+    os.utime(stale, (old, old))
+    Spool(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['fresh.lp.gz.tmp']